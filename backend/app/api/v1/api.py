@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from .endpoints import file, user, totp, logs
+from .endpoints import file, user, totp, logs, metrics
 
 api_router = APIRouter()
 
@@ -9,3 +9,4 @@ api_router.include_router(file.router)
 api_router.include_router(user.router)
 api_router.include_router(totp.router)
 api_router.include_router(logs.router)
+api_router.include_router(metrics.router)
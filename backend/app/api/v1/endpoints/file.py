@@ -1,49 +1,260 @@
+from typing import Literal, Optional
+
+from core.user_cache import CurrentUser
 from db.database import get_db
-from dependencies import get_current_user
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, Request
+from dependencies import get_current_user, get_read_db
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, status, Request, Query
 from fastapi.responses import StreamingResponse
-from models.models import User
-from schemas.file import FileSetIsFavorite, FileDownloadManyFiles, StorageInfo
+from schemas.file import (
+    FileSetIsFavorite, FileDownloadManyFiles, FileUploadNegotiation, StorageInfo, FileListPage, UploadSessionCreate
+)
 from services.file_service import FileService
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/files", tags=["files"])
 
+# Tyle pominiętych id (po ~37 bajtów) trafia do X-Skipped-File-Ids - nagłówek mieści się w buforach
+# nagłówków proxy niezależnie od tego, ile nieaktualnych id zawiera żądanie
+MAX_SKIPPED_FILE_IDS_IN_HEADER = 20
+
+
+def _file_download_response(download: dict) -> StreamingResponse:
+    """
+    Builds a streaming response (200 or 206 Partial Content) from a download prepared by FileService
+    """
+    return StreamingResponse(
+        download["stream"],
+        status_code=download["status_code"],
+        media_type=download["media_type"],
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{download['filename']}",
+            "Content-Length": str(download["size"]),
+            **download["headers"]
+        }
+    )
+
+
+@router.post("/upload/negotiate", status_code=status.HTTP_200_OK)
+async def negotiate_upload(
+        negotiation: FileUploadNegotiation,
+        request: Request,
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to announce an upload before sending the content
+    - **filename**, **size**, **sha256**: File to upload and the SHA-256 of its content
+
+    Returns **status**:
+    - **exists**: the content is already stored - the new version was created (or the file is up to date)
+    - **quota_exceeded**: the file does not fit in the storage quota
+    - **upload**: send the file to /files/upload with the returned **upload_session_id**,
+      or in chunks to /files/upload-sessions/{upload_session_id}
+    """
+    try:
+        ip_address = request.client.host if request.client else None
+        return await FileService(db).negotiate_upload(
+            filename=negotiation.filename,
+            size=negotiation.size,
+            sha256=negotiation.sha256,
+            username=user.username,
+            ip_address=ip_address
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error negotiating upload: {str(e)}")
+
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED)
 async def upload_file(
         request: Request,
         file: UploadFile = File(...),
-        user: User = Depends(get_current_user),
+        upload_session_id: Optional[str] = Form(None),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
     Endpoint to upload a file
     - **file**: File to upload
+    - **upload_session_id**: Optional session from /files/upload/negotiate (the content must match it)
     """
     try:
         ip_address = request.client.host if request.client else None
-        return await FileService(db).upload_file(file=file, username=user.username, ip_address=ip_address)
+        return await FileService(db).upload_file(
+            file=file, username=user.username, ip_address=ip_address, upload_session_id=upload_session_id
+        )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
 
-@router.get("/", status_code=status.HTTP_200_OK)
-async def list_files(db: AsyncSession = Depends(get_db),
-                     user: User = Depends(get_current_user)):
+@router.post("/upload-sessions", status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+        upload: UploadSessionCreate,
+        request: Request,
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to start a resumable upload
+    - **filename**, **size**: File to upload
+    - **sha256**: Optional SHA-256 of the content, verified on finalize
+
+    Send the content in chunks with PUT /files/upload-sessions/{upload_session_id}?offset=...,
+    then call POST /files/upload-sessions/{upload_session_id}/finalize
+    """
+    try:
+        ip_address = request.client.host if request.client else None
+        return await FileService(db).create_upload_session(
+            filename=upload.filename,
+            size=upload.size,
+            sha256=upload.sha256,
+            username=user.username,
+            ip_address=ip_address
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating upload session: {str(e)}")
+
+
+@router.get("/upload-sessions/{upload_session_id}", status_code=status.HTTP_200_OK)
+async def get_upload_session(
+        upload_session_id: str,
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to get the state of a resumable upload
+    - **committed_offset**: Bytes received so far - resume sending from this offset
+    """
+    try:
+        return await FileService(db).get_upload_session(upload_session_id, user.username)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching upload session: {str(e)}")
+
+
+@router.put("/upload-sessions/{upload_session_id}", status_code=status.HTTP_200_OK)
+async def upload_chunk(
+        upload_session_id: str,
+        request: Request,
+        offset: int = Query(..., ge=0),
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to upload the next chunk of a resumable upload (raw bytes in the request body)
+    - **offset**: Position of the chunk in the file - must equal the committed offset
+    """
+    try:
+        return await FileService(db).upload_chunk(
+            upload_session_id, offset, request.stream(), user.username
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading chunk: {str(e)}")
+
+
+@router.post("/upload-sessions/{upload_session_id}/presign", status_code=status.HTTP_200_OK)
+async def presign_upload(
+        upload_session_id: str,
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to get presigned URLs for uploading the file directly to storage
+
+    Returns a single PUT **url**, or for large files (**multipart**) one PUT url per part in **parts**
+    (with its offset and size). Then call POST /files/upload-sessions/{upload_session_id}/finalize.
+    Call again to get fresh URLs for the same upload when they expire.
+    """
+    try:
+        return await FileService(db).presign_upload(upload_session_id, user.username)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error presigning upload: {str(e)}")
+
+
+@router.post("/upload-sessions/{upload_session_id}/finalize", status_code=status.HTTP_201_CREATED)
+async def finalize_upload_session(
+        upload_session_id: str,
+        request: Request,
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
     """
-    Endpoint to list files
+    Endpoint to finish a resumable upload - creates the file or its new version
     """
-    files = await FileService(db).list_files(username=user.username)
-    return {"files": files}
+    try:
+        ip_address = request.client.host if request.client else None
+        return await FileService(db).finalize_upload_session(upload_session_id, user.username, ip_address)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error finalizing upload: {str(e)}")
+
+
+@router.delete("/upload-sessions/{upload_session_id}", status_code=status.HTTP_200_OK)
+async def cancel_upload_session(
+        upload_session_id: str,
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to cancel a resumable upload and discard the chunks sent so far
+    """
+    try:
+        return await FileService(db).cancel_upload_session(upload_session_id, user.username)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error cancelling upload session: {str(e)}")
+
+
+@router.get("/", status_code=status.HTTP_200_OK, response_model=FileListPage)
+async def list_files(
+        limit: int = Query(100, ge=1, le=1000),
+        cursor: Optional[str] = None,
+        sort: Literal["updated_at", "name"] = "updated_at",
+        order: Literal["asc", "desc"] = "desc",
+        is_favorite: Optional[bool] = None,
+        name_prefix: Optional[str] = None,
+        db: AsyncSession = Depends(get_db),
+        read_db: AsyncSession = Depends(get_read_db),
+        user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Endpoint to list files, one page at a time
+
+    - **limit**: Maximum number of files on the page (1-1000)
+    - **cursor**: `next_cursor` from the previous page; omit for the first page
+    - **sort**: `updated_at` or `name`
+    - **order**: `asc` or `desc`
+    - **is_favorite**: Only favorite (true) or non-favorite (false) files
+    - **name_prefix**: Only files whose name starts with this prefix
+    """
+    return await FileService(db, read_db=read_db).list_files(
+        username=user.username,
+        limit=limit,
+        cursor=cursor,
+        sort=sort,
+        order=order,
+        is_favorite=is_favorite,
+        name_prefix=name_prefix
+    )
 
 
 @router.get("/me", status_code=status.HTTP_200_OK, response_model=StorageInfo)
 async def get_my_storage_info(
-        user: User = Depends(get_current_user),
-        db: AsyncSession = Depends(get_db)
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db),
+        read_db: AsyncSession = Depends(get_read_db)
 ):
     """
     Endpoint returning storage information about the current user
@@ -63,67 +274,130 @@ async def get_my_storage_info(
     - **total_versions_size_mb**: Total size of all versions in MB
     """
     try:
-        return await FileService(db).get_user_storage_info(username=user.username)
+        return await FileService(db, read_db=read_db).get_user_storage_info(username=user.username)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching storage info: {str(e)}")
 
 
+@router.post("/storage/reconcile", status_code=status.HTTP_200_OK)
+async def reconcile_storage(
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to recalculate used storage of all users from their file versions (admin only)
+
+    Storage usage is updated incrementally on every upload/delete; this corrects any drift.
+    """
+    if not user.user_type == 'admin':
+        raise HTTPException(status_code=403,
+                            detail="Not authorized to reconcile storage.")
+
+    try:
+        corrected = await FileService(db).reconcile_storage()
+        return {"corrected_users": corrected}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reconciling storage: {str(e)}")
+
+
 @router.get("/download/{file_id}", status_code=status.HTTP_200_OK)
 async def download_file(
         file_id: str,
         request: Request,
-        user: User = Depends(get_current_user),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
     Endpoint to download a file by ID
 
+    Supports `Range` / `If-Range` headers (206 Partial Content, multipart/byteranges for several ranges).
+
     - **file_id**: UUID of the file to download
     """
     ip_address = request.client.host if request.client else None
-    file_obj, filename, file_size = await FileService(db).download_file(file_id=file_id, username=user.username,
-                                                             ip_address=ip_address)
+    download = await FileService(db).download_file(
+        file_id=file_id,
+        username=user.username,
+        ip_address=ip_address,
+        range_header=request.headers.get("range"),
+        if_range=request.headers.get("if-range")
+    )
 
     try:
-        return StreamingResponse(
-            file_obj,
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{filename}",
-                "Content-Length": str(file_size)
-            }
-        )
+        return _file_download_response(download)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")
 
 
+@router.get("/download/{file_id}/presigned", status_code=status.HTTP_200_OK)
+async def presign_download(
+        file_id: str,
+        request: Request,
+        version: Optional[int] = Query(None, ge=1),
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Endpoint to get a short-lived URL for downloading a file directly from storage
+
+    - **file_id**: UUID of the file
+    - **version**: Version number (defaults to the current version)
+    """
+    try:
+        ip_address = request.client.host if request.client else None
+        return await FileService(db).presign_download(
+            file_id=file_id,
+            username=user.username,
+            version_number=version,
+            ip_address=ip_address
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error presigning download: {str(e)}")
+
+
 @router.post("/download", status_code=status.HTTP_200_OK)
 async def download_many_files(
         files: FileDownloadManyFiles,
         request: Request,
-        user: User = Depends(get_current_user),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
     Endpoint to download multiple files as a ZIP archive
     - **files**: Object containing a list of file IDs to download
+
+    Repeated IDs are included once. IDs that do not exist or belong to another user are skipped:
+    their number is returned in the `X-Skipped-File-Count` response header and the first
+    20 of them in the `X-Skipped-File-Ids` header (comma-separated).
     """
     ip_address = request.client.host if request.client else None
-    zip_obj, zip_filename, zip_size = await FileService(db).get_many_files(file_ids=files.file_ids, username=user.username,
-                                                                 ip_address=ip_address)
+    zip_obj, zip_filename, zip_size, skipped_file_ids = await FileService(db).get_many_files(
+        file_ids=files.file_ids,
+        username=user.username,
+        ip_address=ip_address
+    )
 
     try:
+        headers = {
+            "Content-Disposition": f"attachment; filename*=UTF-8''{zip_filename}",
+            "Content-Length": str(zip_size)
+        }
+        if skipped_file_ids:
+            headers["X-Skipped-File-Count"] = str(len(skipped_file_ids))
+            headers["X-Skipped-File-Ids"] = ",".join(skipped_file_ids[:MAX_SKIPPED_FILE_IDS_IN_HEADER])
+
         return StreamingResponse(
             zip_obj,
             media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{zip_filename}",
-                "Content-Length": str(zip_size)
-            }
+            headers=headers
         )
     except HTTPException:
         raise
@@ -135,7 +409,7 @@ async def download_many_files(
 async def delete_file(
         file_id: str,
         request: Request,
-        user: User = Depends(get_current_user),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
@@ -155,7 +429,7 @@ async def delete_file(
 @router.post("/change-is-favorite", status_code=status.HTTP_200_OK)
 async def set_favorite_file(file: FileSetIsFavorite,
                             request: Request,
-                            user: User = Depends(get_current_user),
+                            user: CurrentUser = Depends(get_current_user),
                             db: AsyncSession = Depends(get_db)):
     """
     Endpoint to set or unset a file as favorite
@@ -175,8 +449,9 @@ async def set_favorite_file(file: FileSetIsFavorite,
 @router.get("/{file_id}/versions", status_code=status.HTTP_200_OK)
 async def get_file_versions(
         file_id: str,
-        user: User = Depends(get_current_user),
-        db: AsyncSession = Depends(get_db)
+        user: CurrentUser = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db),
+        read_db: AsyncSession = Depends(get_read_db)
 ):
     """
     Endpoint to get all versions of a file
@@ -184,7 +459,7 @@ async def get_file_versions(
     - **file_id**: UUID of the file
     """
     try:
-        versions = await FileService(db).get_file_versions(file_id=file_id, username=user.username)
+        versions = await FileService(db, read_db=read_db).get_file_versions(file_id=file_id, username=user.username)
         return {"file_id": file_id, "versions": versions}
     except HTTPException:
         raise
@@ -197,32 +472,29 @@ async def download_file_version(
         file_id: str,
         version_number: int,
         request: Request,
-        user: User = Depends(get_current_user),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
     Endpoint to download a specific version of a file
 
+    Supports `Range` / `If-Range` headers (206 Partial Content, multipart/byteranges for several ranges).
+
     - **file_id**: UUID of the file
     - **version_number**: Version number to download
     """
     try:
         ip_address = request.client.host if request.client else None
-        file_obj, filename, file_size = await FileService(db).download_file_version(
+        download = await FileService(db).download_file_version(
             file_id=file_id,
             version_number=version_number,
             username=user.username,
-            ip_address=ip_address
+            ip_address=ip_address,
+            range_header=request.headers.get("range"),
+            if_range=request.headers.get("if-range")
         )
 
-        return StreamingResponse(
-            file_obj,
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{filename}",
-                "Content-Length": str(file_size)
-            }
-        )
+        return _file_download_response(download)
     except HTTPException:
         raise
     except Exception as e:
@@ -234,7 +506,7 @@ async def restore_file_version(
         file_id: str,
         version_number: int,
         request: Request,
-        user: User = Depends(get_current_user),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
@@ -262,7 +534,7 @@ async def delete_file_version(
         file_id: str,
         version_number: int,
         request: Request,
-        user: User = Depends(get_current_user),
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
@@ -1,11 +1,11 @@
 from datetime import datetime
-from io import BytesIO
+from typing import Literal, Optional
 
+from core.user_cache import CurrentUser
 from db.database import get_db
 from dependencies import get_current_user
 from fastapi import APIRouter, HTTPException, Depends, \
-    status, Request
-from models.models import User
+    status, Request, Path, Query
 from schemas.file import FileSetIsFavorite, FileDownloadManyFiles
 from services.log_service import LogService
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -14,17 +14,37 @@ from starlette.responses import StreamingResponse
 router = APIRouter(prefix="/logs", tags=["logs"])
 
 
+_EXPORT_MEDIA_TYPES = {
+    "text": ("text/plain", "txt"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "csv": ("text/csv", "csv"),
+}
+
+
 @router.get("/download/{limit}", status_code=status.HTTP_200_OK)
 async def download_logs(
-        limit: int,
         request: Request,
-        user: User = Depends(get_current_user),
+        limit: int = Path(..., ge=1),
+        export_format: Literal["text", "jsonl", "csv"] = Query("text", alias="format"),
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        log_username: Optional[str] = Query(None, alias="username"),
+        action: Optional[str] = None,
+        log_status: Optional[str] = Query(None, alias="status"),
+        file_id: Optional[str] = None,
+        user: CurrentUser = Depends(get_current_user),
         db: AsyncSession = Depends(get_db)
 ):
     """
-    Endpoint to download logs
+    Endpoint to download logs, newest first. The export is streamed, so any number of entries can be downloaded
 
     - **limit**: Maximum number of logs to download
+    - **format**: `text` (default), `jsonl` (JSON Lines) or `csv`
+    - **start** / **end**: Only logs from `start` (inclusive) to `end` (exclusive), ISO 8601
+    - **username**: Only logs of this user
+    - **action**: Only logs of this action, e.g. `FILE_UPLOAD`
+    - **status**: Only logs with this status (`SUCCESS` or `FAILED`)
+    - **file_id**: Only logs of this file
     """
 
     if not user.user_type == 'admin':
@@ -33,19 +53,25 @@ async def download_logs(
 
     try:
         ip_address = request.client.host if request.client else None
-        log_content = await LogService(db).get_logs(
+        log_stream = await LogService(db).get_logs(
             limit=limit,
             username=user.username,
-            ip_address=ip_address
+            ip_address=ip_address,
+            export_format=export_format,
+            start=start,
+            end=end,
+            filter_username=log_username,
+            action=action,
+            status=log_status,
+            file_id=file_id
         )
 
-        file_bytes = BytesIO(log_content.encode('utf-8'))
-
-        filename = f"logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        media_type, extension = _EXPORT_MEDIA_TYPES[export_format]
+        filename = f"logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
 
         return StreamingResponse(
-            file_bytes,
-            media_type="text/plain",
+            log_stream,
+            media_type=media_type,
             headers={
                 "Content-Disposition": f"attachment; filename={filename}"
             }
@@ -55,4 +81,3 @@ async def download_logs(
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=f"Error downloading logs: {str(e)}")
-
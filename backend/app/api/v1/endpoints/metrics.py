@@ -0,0 +1,70 @@
+from core.password_pool import password_pool
+from core.s3_client import object_store
+from core.user_cache import CurrentUser
+from db.database import pool_stats
+from dependencies import get_current_user
+from fastapi import APIRouter, HTTPException, Depends, status
+from services.audit_log_writer import audit_log_writer
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+def _require_admin(user: CurrentUser):
+    if not user.user_type == 'admin':
+        raise HTTPException(status_code=403,
+                            detail="Not authorized to access metrics.")
+
+
+@router.get("/s3", status_code=status.HTTP_200_OK)
+async def s3_metrics(user: CurrentUser = Depends(get_current_user)):
+    """
+    Endpoint returning S3 thread pool and connection pool saturation metrics
+
+    - **active_calls** / **queued_calls**: S3 calls running / waiting for a worker thread
+    - **open_streams**: response bodies currently being streamed to clients
+    - **pool_saturation**: connections in use divided by `max_pool_connections`
+    - **avg_queue_wait_ms** / **max_queue_wait_ms**: time calls spent waiting for a thread
+    """
+    _require_admin(user)
+    return object_store.stats()
+
+
+@router.get("/db", status_code=status.HTTP_200_OK)
+async def db_metrics(user: CurrentUser = Depends(get_current_user)):
+    """
+    Endpoint returning connection pool metrics of the primary database (and of the read replica, if configured)
+
+    - **checked_out** / **overflow**: connections in use / opened above `pool_size`
+    - **pool_saturation**: connections in use divided by `pool_size + max_overflow`
+    - **avg_checkout_wait_ms** / **max_checkout_wait_ms**: time requests waited for a connection
+    - **checkout_timeouts**: checkouts that gave up after `DB_POOL_TIMEOUT`
+    """
+    _require_admin(user)
+    return pool_stats()
+
+
+@router.get("/passwords", status_code=status.HTTP_200_OK)
+async def password_hashing_metrics(user: CurrentUser = Depends(get_current_user)):
+    """
+    Endpoint returning metrics of the Argon2 password hashing pool
+
+    - **active** / **waiting**: operations running / waiting for a free worker
+    - **rejected**: operations refused with 503 because too many were waiting
+    - **avg_queue_wait_ms** / **max_queue_wait_ms**: time operations spent waiting
+    - **avg_duration_ms** / **max_duration_ms**: time of a single hash or verification
+    """
+    _require_admin(user)
+    return password_pool.stats()
+
+
+@router.get("/audit-log", status_code=status.HTTP_200_OK)
+async def audit_log_metrics(user: CurrentUser = Depends(get_current_user)):
+    """
+    Endpoint returning metrics of the background audit log writer
+
+    - **queued**: entries waiting to be written
+    - **written** / **failed**: entries written to / lost for the database
+    - **batches**: bulk INSERTs executed
+    """
+    _require_admin(user)
+    return audit_log_writer.stats()
@@ -1,5 +1,6 @@
 import base64
 
+from core.user_cache import CurrentUser
 from db.database import get_db
 from dependencies import get_current_user, get_user_for_totp_setup
 from fastapi import APIRouter, Depends, status
@@ -42,9 +43,8 @@ async def verify_totp(
 
 @router.get("/status", status_code=status.HTTP_200_OK)
 async def totp_status(
-        user: User = Depends(get_current_user),
-        db: AsyncSession = Depends(get_db)
+        user: CurrentUser = Depends(get_current_user)
 ):
     """Endpoint to check if TOTP is configured for the user"""
-    needs_setup = await TOTPService(db).check_totp_required(user.username)
+    needs_setup = not user.totp_configured
     return {"totp_configured": not needs_setup, "requires_setup": needs_setup}
@@ -1,7 +1,7 @@
+from core.user_cache import CurrentUser
 from db.database import get_db
 from dependencies import get_current_user
 from fastapi import APIRouter, Depends, status, HTTPException, Request
-from models.models import User
 from schemas.totp import TOTPSetupToken
 from schemas.user import UserCreate, Token, UserLogin, RefreshTokenRequest, UserLoginWithTOTP
 from services.user_service import UserService
@@ -70,7 +70,7 @@ async def refresh_token(
 async def logout(
         request: Request,
         db: AsyncSession = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Endpoint to logout a user - delete all their refresh tokens
@@ -86,7 +86,7 @@ async def logout(
 
 @router.get("/me", status_code=status.HTTP_200_OK)
 async def get_current_user_info(
-        current_user: User = Depends(get_current_user)
+        current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Endpoint to get current user info
@@ -106,7 +106,7 @@ async def get_current_user_info(
 
 @router.get("/isadmin", status_code=status.HTTP_200_OK)
 async def is_admin(
-        current_user: User = Depends(get_current_user)
+        current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Endpoint to check if current user is admin
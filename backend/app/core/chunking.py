@@ -0,0 +1,178 @@
+"""
+Podział na kawałki zależny od treści (content-defined chunking, rolling hash "gear" jak w FastCDC).
+
+Granice kawałków zależą od treści wokół nich, a nie od przesunięć, więc wstawienie lub
+usunięcie bajtów w pliku zmienia tylko kawałki wokół zmiany - pozostałe zachowują granice
+i skróty, i mogą być współdzielone między wersjami pliku.
+
+Hash gear przesuwany w lewo o bit na bajt "zapomina" bajty starsze niż 64 pozycje, więc poza
+pierwszymi 63 bajtami kawałka jest funkcją samego okna 64 ostatnich bajtów. Hashe okien liczone
+są wektorowo w numpy (poza GIL) dla całego bufora naraz, a w Pythonie zostaje tylko początek
+każdego kawałka - granice są identyczne jak przy liczeniu bajt po bajcie.
+"""
+import hashlib
+from typing import BinaryIO, List, NamedTuple
+
+import numpy as np
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+# Deterministyczna tablica 256 pseudolosowych wartości 64-bitowych. Nie może się zmienić:
+# zależą od niej granice kawałków (a więc deduplikacja między zapisanymi wersjami)
+_GEAR = [
+    int.from_bytes(hashlib.sha256(b"spcloud-gear-%d" % i).digest()[:8], "little")
+    for i in range(256)
+]
+_GEAR_ARRAY = np.array(_GEAR, dtype=np.uint64)
+_GEAR_WINDOW = 64
+
+
+class Chunk(NamedTuple):
+    offset: int
+    size: int
+    sha256: str
+
+
+class ChunkedFile(NamedTuple):
+    sha256: str
+    size: int
+    chunks: List[Chunk]
+
+
+# Ile bajtów pliku czytać naraz - granice wszystkich kawałków okna wyznaczane są jednym wywołaniem
+CUT_WINDOW_SIZE = 16 * 1024 * 1024
+# Ile bajtów hashować wektorowo naraz - tablice uint64 (8x tyle) mieszczą się w pamięci podręcznej CPU
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def _boundary_mask(min_size: int, avg_size: int) -> int:
+    # Granica wypada średnio co 2^bits bajtów po min_size. Hash gear przesuwany w lewo
+    # miesza najwięcej bajtów w najstarszych bitach, więc maska używa właśnie ich
+    bits = max((avg_size - min_size).bit_length() - 1, 1)
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def _boundary_candidates(data: bytes, mask: int) -> np.ndarray:
+    """
+    Pozycje (rosnąco), na których hash okna 64 bajtów kończącego się na tej pozycji
+    spełnia warunek granicy. Liczone blokami po HASH_BLOCK_SIZE bajtów we wspólnych buforach
+    """
+    # Maska to najstarsze bity, więc "h & mask == 0" to po prostu "h <= ~mask"
+    limit = np.uint64(~mask & _MASK_64)
+    hashes = np.empty(HASH_BLOCK_SIZE + _GEAR_WINDOW - 1, dtype=np.uint64)
+    shifted = np.empty_like(hashes)
+    source = np.frombuffer(data, dtype=np.uint8)
+    candidates = [np.empty(0, dtype=np.int64)]
+    for block_start in range(0, len(data), HASH_BLOCK_SIZE):
+        block_stop = min(block_start + HASH_BLOCK_SIZE, len(data))
+        lead = min(block_start, _GEAR_WINDOW - 1)
+        block = hashes[:block_stop - block_start + lead]
+        np.take(_GEAR_ARRAY, source[block_start - lead:block_stop], out=block, mode="clip")
+        # Podwajanie okna: hash okna 2w = hash okna w + (hash okna w sprzed w bajtów) << w
+        width = 1
+        while width < min(_GEAR_WINDOW, len(block)):
+            np.left_shift(block[:-width], np.uint64(width), out=shifted[:len(block) - width])
+            np.add(block[width:], shifted[:len(block) - width], out=block[width:])
+            width *= 2
+        candidates.append(np.flatnonzero(block[lead:] <= limit) + block_start)
+    # Bufor (bytearray) nie może być eksportowany, gdy chunk_file go skraca
+    del source
+    return np.concatenate(candidates)
+
+
+def _cut_point(
+        data: bytes,
+        start: int,
+        length: int,
+        min_size: int,
+        max_size: int,
+        mask: int,
+        candidates: np.ndarray
+) -> int:
+    remaining = length - start
+    if remaining <= min_size:
+        return remaining
+
+    end = start + min(remaining, max_size)
+    # Bajty przed min_size nigdy nie są granicą, więc hashowanie zaczyna się od min_size.
+    # Dopóki hash obejmuje mniej niż 64 bajty, różni się od hasha okna - te pozycje liczone są tutaj
+    hash_start = start + min_size
+    window_start = min(hash_start + _GEAR_WINDOW - 1, end)
+    gear = _GEAR
+    h = 0
+    for i in range(hash_start, window_start):
+        h = ((h << 1) + gear[data[i]]) & _MASK_64
+        if not h & mask:
+            return i + 1 - start
+
+    index = np.searchsorted(candidates, window_start)
+    if index < len(candidates) and candidates[index] < end:
+        return int(candidates[index]) + 1 - start
+    return end - start
+
+
+def _cut_points(data: bytes, min_size: int, max_size: int, mask: int, final: bool) -> List[int]:
+    """
+    Rozmiary kolejnych kawałków od początku `data`. Jeśli to nie koniec pliku (`final`),
+    końcówka krótsza niż max_size zostaje - jej granica może zależeć od dalszych bajtów
+    """
+    candidates = _boundary_candidates(data, mask)
+    sizes = []
+    start = 0
+    length = len(data)
+    while start < length and (final or length - start >= max_size):
+        size = _cut_point(data, start, length, min_size, max_size, mask, candidates)
+        sizes.append(size)
+        start += size
+    return sizes
+
+
+def chunk_file(
+        fileobj: BinaryIO,
+        min_size: int,
+        avg_size: int,
+        max_size: int,
+        window_size: int = CUT_WINDOW_SIZE
+) -> ChunkedFile:
+    """
+    Dzieli (blokujący) plik na kawałki zależne od treści, po min_size..max_size bajtów.
+    Zwraca SHA-256 i rozmiar całego pliku oraz SHA-256 każdego kawałka.
+    Czyta plik od początku oknami po `window_size` bajtów - granice wszystkich kawałków okna
+    wyznaczane są jednym wywołaniem, a w pamięci jest najwyżej jedno okno plus niepodzielona
+    końcówka poprzedniego.
+    """
+    if not 0 < min_size < avg_size < max_size:
+        raise ValueError("Chunk sizes must satisfy 0 < min_size < avg_size < max_size")
+
+    mask = _boundary_mask(min_size, avg_size)
+    window_size = max(window_size, max_size)
+    file_digest = hashlib.sha256()
+    chunks: List[Chunk] = []
+    buffer = bytearray()
+    offset = 0
+
+    fileobj.seek(0)
+    while True:
+        data = fileobj.read(window_size)
+        eof = not data
+        buffer += data
+        if not buffer:
+            break
+
+        sizes = _cut_points(buffer, min_size, max_size, mask, eof)
+
+        position = 0
+        with memoryview(buffer) as view:
+            for size in sizes:
+                with view[position:position + size] as chunk:
+                    file_digest.update(chunk)
+                    chunks.append(Chunk(offset, size, hashlib.sha256(chunk).hexdigest()))
+                position += size
+                offset += size
+        del buffer[:position]
+
+        if eof:
+            break
+
+    fileobj.seek(0)
+    return ChunkedFile(file_digest.hexdigest(), offset, chunks)
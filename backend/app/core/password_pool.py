@@ -0,0 +1,93 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import settings
+from core.security import hash_password, verify_password
+
+
+class PasswordHashPoolBusy(Exception):
+    """Zgłaszany, gdy na pulę czeka już zbyt wiele operacji na hasłach"""
+
+
+class PasswordHashPool:
+    """
+    Wykonuje hashowanie i weryfikację Argon2 poza pętlą zdarzeń.
+
+    Argon2 jest celowo wolny (~64 MB pamięci, time_cost=3) i inaczej blokowałby cały worker
+    przy każdym logowaniu. Naraz działa najwyżej `max_workers` operacji (argon2-cffi zwalnia
+    GIL, więc działają równolegle), kolejne czekają w kolejce asyncio, a gdy czeka już
+    `max_waiting` wywołań, nowe odrzucane są wyjątkiem PasswordHashPoolBusy. Fala logowań
+    spowalnia więc tylko logowania.
+    """
+
+    def __init__(self, max_workers: int, max_waiting: int):
+        self.max_workers = max_workers
+        self.max_waiting = max_waiting
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="argon2")
+        self._semaphore = asyncio.Semaphore(max_workers)
+
+        # Używane tylko z wątku pętli zdarzeń
+        self._waiting = 0
+        self._active = 0
+        self._rejected = 0
+        self._total_calls = 0
+        self._total_queue_wait = 0.0
+        self._max_queue_wait = 0.0
+        self._total_duration = 0.0
+        self._max_duration = 0.0
+
+    async def run(self, func, *args):
+        if self._waiting >= self.max_waiting:
+            self._rejected += 1
+            raise PasswordHashPoolBusy()
+
+        queued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        started_at = time.perf_counter()
+        queue_wait = started_at - queued_at
+        self._active += 1
+        self._total_calls += 1
+        self._total_queue_wait += queue_wait
+        self._max_queue_wait = max(self._max_queue_wait, queue_wait)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            duration = time.perf_counter() - started_at
+            self._total_duration += duration
+            self._max_duration = max(self._max_duration, duration)
+            self._active -= 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(verify_password, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_waiting": self.max_waiting,
+            "active": self._active,
+            "waiting": self._waiting,
+            "rejected": self._rejected,
+            "total_calls": self._total_calls,
+            "avg_queue_wait_ms": round(self._total_queue_wait / self._total_calls * 1000, 3)
+            if self._total_calls else 0.0,
+            "max_queue_wait_ms": round(self._max_queue_wait * 1000, 3),
+            "avg_duration_ms": round(self._total_duration / self._total_calls * 1000, 3)
+            if self._total_calls else 0.0,
+            "max_duration_ms": round(self._max_duration * 1000, 3),
+        }
+
+
+password_pool = PasswordHashPool(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_waiting=settings.PASSWORD_HASH_MAX_WAITING
+)
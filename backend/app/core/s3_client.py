@@ -1,18 +1,255 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional, Tuple
+
 import boto3
 import os
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from core.config import settings
 
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Odpowiedzi HEAD nie mają treści, więc brak bucketa head_bucket zgłasza jako samo 404 -
+# w innych operacjach (np. head_object na brakującym kluczu) 404 nie oznacza braku bucketa
+_HEAD_BUCKET_MISSING_CODES = ("NoSuchBucket", "404", "NotFound")
+_BUCKET_EXISTS_CODES = ("BucketAlreadyOwnedByYou", "BucketAlreadyExists")
+
 session = boto3.session.Session()
+_endpoint_url = f"http://{os.getenv('MINIO_ENDPOINT', 'localhost:9000')}"
+_credentials = {
+    "aws_access_key_id": os.getenv("MINIO_ACCESS_KEY", "admin"),
+    "aws_secret_access_key": os.getenv("MINIO_SECRET_KEY", "supersecret"),
+    "region_name": "us-east-1",
+}
 s3 = session.client(
     "s3",
-    endpoint_url=f"http://{os.getenv('MINIO_ENDPOINT', 'localhost:9000')}",
-    aws_access_key_id=os.getenv("MINIO_ACCESS_KEY", "admin"),
-    aws_secret_access_key=os.getenv("MINIO_SECRET_KEY", "supersecret"),
-    region_name="us-east-1",
+    endpoint_url=_endpoint_url,
     use_ssl=os.getenv("MINIO_SECURE", "False").lower() == "true",
+    config=Config(
+        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=settings.S3_TCP_KEEPALIVE,
+        connect_timeout=settings.S3_CONNECT_TIMEOUT,
+        read_timeout=settings.S3_READ_TIMEOUT,
+    ),
+    **_credentials,
+)
+
+# Podpisane URL-e trafiają do klientów, więc są podpisywane dla publicznego adresu MinIO.
+# Podpisywanie jest lokalne (bez żądania), więc ten klient nigdy nie otwiera połączenia
+presign_client = session.client(
+    "s3",
+    endpoint_url=settings.S3_PUBLIC_ENDPOINT or _endpoint_url,
+    config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+    **_credentials,
 )
 
-def ensure_bucket_exists(bucket_name: str):
-    buckets = s3.list_buckets()
-    if not any(b["Name"] == bucket_name for b in buckets.get("Buckets", [])):
-        s3.create_bucket(Bucket=bucket_name)
+
+class AsyncObjectStore:
+    """
+    Asynchroniczny adapter na (blokującego) klienta S3 z boto3.
+
+    Każde wywołanie klienta i każdy odczyt treści odpowiedzi wykonywane są we własnej,
+    ograniczonej puli wątków, więc transfery S3 nie blokują pętli zdarzeń. Metody klienta
+    dostępne są jako korutyny o tej samej nazwie i argumentach, np. `await object_store.put_object(...)`.
+
+    Adapter śledzi też nasycenie puli wątków i puli połączeń HTTP (zob. stats()),
+    żeby obie dało się dobrać do rzeczywistej współbieżności.
+
+    Istniejące buckety są zapamiętywane na czas życia procesu, więc sprawdzenie bucketa
+    nie kosztuje zapytania do S3. Wywołanie zakończone błędem NoSuchBucket usuwa bucket z cache.
+    """
+
+    def __init__(self, client, max_workers: int):
+        self.client = client
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3")
+
+        self.known_buckets = set()
+
+        self._lock = threading.Lock()
+        self._queued_calls = 0
+        self._active_calls = 0
+        self._open_streams = 0
+        self._peak_active_calls = 0
+        self._peak_connections_in_use = 0
+        self._total_calls = 0
+        self._total_queue_wait = 0.0
+        self._max_queue_wait = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call_state = {"started": False}
+        submitted_at = time.perf_counter()
+
+        def call():
+            with self._lock:
+                if call_state["started"]:
+                    # Oczekująca korutyna została anulowana, zanim wywołanie dostało wątek
+                    return None
+                call_state["started"] = True
+                queue_wait = time.perf_counter() - submitted_at
+                self._queued_calls -= 1
+                self._active_calls += 1
+                self._total_calls += 1
+                self._total_queue_wait += queue_wait
+                self._max_queue_wait = max(self._max_queue_wait, queue_wait)
+                self._peak_active_calls = max(self._peak_active_calls, self._active_calls)
+                self._update_connection_peak()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active_calls -= 1
+
+        with self._lock:
+            self._queued_calls += 1
+        try:
+            return await loop.run_in_executor(self.executor, call)
+        finally:
+            with self._lock:
+                if not call_state["started"]:
+                    call_state["started"] = True
+                    self._queued_calls -= 1
+
+    def _update_connection_peak(self):
+        # Każde trwające wywołanie i każda otwarta treść odpowiedzi zajmuje jedno połączenie z puli
+        self._peak_connections_in_use = max(
+            self._peak_connections_in_use, self._active_calls + self._open_streams
+        )
+
+    def stats(self) -> dict:
+        max_pool_connections = self.client.meta.config.max_pool_connections
+        with self._lock:
+            connections_in_use = self._active_calls + self._open_streams
+            return {
+                "max_workers": self.max_workers,
+                "max_pool_connections": max_pool_connections,
+                "active_calls": self._active_calls,
+                "queued_calls": self._queued_calls,
+                "open_streams": self._open_streams,
+                "connections_in_use": connections_in_use,
+                "pool_saturation": round(connections_in_use / max_pool_connections, 3),
+                "peak_active_calls": self._peak_active_calls,
+                "peak_connections_in_use": self._peak_connections_in_use,
+                "total_calls": self._total_calls,
+                "avg_queue_wait_ms": round(self._total_queue_wait / self._total_calls * 1000, 3)
+                if self._total_calls else 0.0,
+                "max_queue_wait_ms": round(self._max_queue_wait * 1000, 3),
+            }
+
+    def __getattr__(self, name: str):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            try:
+                return await self.run(method, *args, **kwargs)
+            except ClientError as e:
+                if "Bucket" in kwargs and is_bucket_missing_error(e):
+                    self.known_buckets.discard(kwargs["Bucket"])
+                raise
+
+        return call
+
+    async def load_known_buckets(self):
+        """
+        Wypełnia cache bucketów jednym wywołaniem list_buckets (przy starcie aplikacji)
+        """
+        response = await self.list_buckets()
+        self.known_buckets.update(bucket["Name"] for bucket in response.get("Buckets", []))
+
+    async def ensure_bucket(self, bucket_name: str):
+        if bucket_name in self.known_buckets:
+            return
+
+        try:
+            await self.head_bucket(Bucket=bucket_name)
+        except ClientError as e:
+            if not is_bucket_missing_error(e):
+                raise
+            try:
+                await self.create_bucket(Bucket=bucket_name)
+            except ClientError as create_error:
+                # Inne żądanie mogło w międzyczasie utworzyć bucket
+                if create_error.response.get("Error", {}).get("Code") not in _BUCKET_EXISTS_CODES:
+                    raise
+
+        self.known_buckets.add(bucket_name)
+
+    async def open_object(
+            self,
+            bucket_name: str,
+            key: str,
+            byte_range: Optional[Tuple[int, int]] = None,
+            chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        Wywołuje get_object od razu (błędy S3 pojawiają się przed wysłaniem czegokolwiek)
+        i zwraca asynchroniczny iterator po treści. `byte_range` jest domknięty.
+        """
+        params = {"Bucket": bucket_name, "Key": key}
+        if byte_range is not None:
+            params["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+
+        response = await self.get_object(**params)
+        return self._iter_body(response["Body"], chunk_size)
+
+    async def iter_object(
+            self,
+            bucket_name: str,
+            key: str,
+            byte_range: Optional[Tuple[int, int]] = None,
+            chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        Leniwa wersja open_object - obiekt pobierany jest dopiero przy rozpoczęciu iteracji
+        """
+        chunks = await self.open_object(bucket_name, key, byte_range, chunk_size)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _iter_body(self, body, chunk_size: int) -> AsyncIterator[bytes]:
+        with self._lock:
+            self._open_streams += 1
+            self._update_connection_peak()
+        try:
+            while True:
+                chunk = await self.run(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+            with self._lock:
+                self._open_streams -= 1
+
+
+object_store = AsyncObjectStore(s3, max_workers=settings.S3_MAX_WORKERS)
+
+
+def is_bucket_missing_error(error: Exception) -> bool:
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get("Error", {}).get("Code")
+    if error.operation_name == "HeadBucket":
+        return code in _HEAD_BUCKET_MISSING_CODES
+    return code == "NoSuchBucket"
+
+
+async def ensure_bucket_exists(bucket_name: str):
+    await object_store.ensure_bucket(bucket_name)
+
+
+def generate_presigned_url(client_method: str, params: dict, expires_in: int) -> str:
+    """
+    Zwraca URL, który pozwala jego posiadaczowi wywołać `client_method` (np. put_object, get_object,
+    upload_part) z dokładnie tymi parametrami bezpośrednio w MinIO, do czasu wygaśnięcia
+    """
+    return presign_client.generate_presigned_url(
+        ClientMethod=client_method, Params=params, ExpiresIn=expires_in
+    )
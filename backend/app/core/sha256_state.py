@@ -0,0 +1,56 @@
+"""
+SHA-256 z zapisywalnym stanem pośrednim - skrót uploadu wznawialnego liczony jest kawałek
+po kawałku, a stan między kawałkami trzymany w bazie (kolejny kawałek może trafić do innego
+procesu API). hashlib nie pozwala zapisać stanu, więc używane są funkcje SHA256_* z libcrypto
+(OpenSSL), na której opiera się też hashlib. Bez libcrypto `available` jest False - skrót
+liczony jest wtedy dopiero z całego złożonego obiektu.
+"""
+import ctypes
+import ctypes.util
+from typing import BinaryIO, Optional
+
+# sizeof(SHA256_CTX): h[8], Nl, Nh, data[16], num, md_len - same 32-bitowe pola
+STATE_SIZE = 112
+READ_SIZE = 1024 * 1024  # 1 MB
+
+
+def _load_libcrypto() -> Optional[ctypes.CDLL]:
+    name = ctypes.util.find_library("crypto")
+    if name is None:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+        lib.SHA256_Init.argtypes = [ctypes.c_char_p]
+        lib.SHA256_Update.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t]
+        lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+    except (OSError, AttributeError):
+        return None
+    return lib
+
+
+_lib = _load_libcrypto()
+available = _lib is not None
+
+
+def initial_state() -> bytes:
+    state = ctypes.create_string_buffer(STATE_SIZE)
+    _lib.SHA256_Init(state)
+    return state.raw
+
+
+def update_state(state: bytes, fileobj: BinaryIO) -> bytes:
+    """
+    Stan po dopisaniu całej treści (blokującego) `fileobj` od bieżącej pozycji.
+    Wywołania libcrypto zwalniają GIL
+    """
+    buffer = ctypes.create_string_buffer(state, STATE_SIZE)
+    while data := fileobj.read(READ_SIZE):
+        _lib.SHA256_Update(buffer, data, len(data))
+    return buffer.raw
+
+
+def hexdigest(state: bytes) -> str:
+    buffer = ctypes.create_string_buffer(state, STATE_SIZE)
+    digest = ctypes.create_string_buffer(32)
+    _lib.SHA256_Final(digest, buffer)
+    return digest.raw.hex()
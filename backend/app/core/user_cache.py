@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.models import User
+
+# Nazwa, pod którą w Session.info czekają użytkownicy do usunięcia z cache po commit
+_PENDING_INVALIDATIONS_KEY = "user_cache_invalidations"
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """
+    Zalogowany użytkownik zwracany przez get_current_user - kopia kolumn tylko do odczytu,
+    niezwiązana z żadną sesją. Sekretów (hash hasła, sekret TOTP) nie zawiera. Zmiany zapisuje
+    się na wierszu User pobranym z bazy, a potem wywołuje user_cache.invalidate().
+    """
+    username: str
+    user_type: str
+    max_storage_mb: int
+    used_storage_mb: float
+    totp_configured: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "CurrentUser":
+        return cls(**{field.name: getattr(user, field.name) for field in fields(cls)})
+
+
+class UserCache:
+    """
+    Krótkotrwały cache zalogowanych użytkowników w pamięci procesu, według nazwy użytkownika.
+
+    Wpisy to niezmienne CurrentUser, więc mogą być bezpiecznie współdzielone między żądaniami.
+    Kod zmieniający limit, zajęte miejsce lub stan TOTP użytkownika wywołuje invalidate() po commit
+    (albo invalidate_on_commit() w trakcie transakcji).
+    Pozostałe procesy backendu widzą taką zmianę najpóźniej po `ttl_s` sekundach.
+    """
+
+    def __init__(self, ttl_s: int, max_size: int):
+        self.ttl_s = ttl_s
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, CurrentUser]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[CurrentUser]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+        return user
+
+    def put(self, user: CurrentUser):
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            self._entries[user.username] = (time.monotonic() + self.ttl_s, user)
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def invalidate_on_commit(self, session, username: str):
+        """
+        Usuwa wpis dopiero po zatwierdzeniu transakcji `session` - wcześniej równoległe żądanie
+        mogłoby wczytać z bazy stary wiersz i z powrotem włożyć go do cache
+        """
+        session.info.setdefault(_PENDING_INVALIDATIONS_KEY, set()).add(username)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(ttl_s=settings.USER_CACHE_TTL_S, max_size=settings.USER_CACHE_MAX_SIZE)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    for username in session.info.pop(_PENDING_INVALIDATIONS_KEY, ()):
+        user_cache.invalidate(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_invalidations(session):
+    session.info.pop(_PENDING_INVALIDATIONS_KEY, None)
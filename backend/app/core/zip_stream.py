@@ -0,0 +1,131 @@
+"""
+Strumieniowy zapis archiwów bez kompresji (ZIP_STORED).
+
+Wpisy zapisywane są jako: nagłówek lokalny -> dane -> deskryptor danych, a po nich katalog
+centralny. CRC-32 znane jest dopiero po wysłaniu danych, więc trafia do deskryptora danych
+(bit 3 flag ogólnych). Skoro nic nie jest kompresowane, dokładny rozmiar archiwum można
+policzyć z góry z rozmiarów wpisów.
+"""
+import asyncio
+import struct
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Callable, List
+
+# Bez rozszerzeń ZIP64 rozmiary i przesunięcia są 32-bitowe, a liczba wpisów 16-bitowa
+ZIP_MAX_SIZE = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+_VERSION = 20
+_STORED = 0
+_FLAGS = 0x0808  # bit 3: CRC i rozmiary w deskryptorze danych, bit 11: nazwy plików w UTF-8
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+
+
+class ZipMember:
+    def __init__(self, name: str, size: int, modified_at: datetime, chunks: Callable[[], AsyncIterator[bytes]]):
+        # `chunks` wywoływane jest leniwie, dopiero gdy wpis ma być wysyłany
+        self.name = name
+        self.size = size
+        self.modified_at = modified_at
+        self.chunks = chunks
+
+
+def _dos_datetime(value: datetime) -> tuple:
+    if value is None or value.year < 1980:
+        value = datetime(1980, 1, 1)
+    dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    return dos_time, dos_date
+
+
+def zip_stream_size(members: List[ZipMember]) -> int:
+    """
+    Zwraca dokładny rozmiar w bajtach archiwum, które stream_zip() utworzy z tych wpisów
+    """
+    size = _END_OF_CENTRAL_DIR.size
+    for member in members:
+        name_length = len(member.name.encode("utf-8"))
+        size += _LOCAL_HEADER.size + name_length + member.size + _DATA_DESCRIPTOR.size
+        size += _CENTRAL_HEADER.size + name_length
+    return size
+
+
+async def stream_zip(members: List[ZipMember], read_ahead_chunks: int = 4) -> AsyncIterator[bytes]:
+    """
+    Zwraca kolejne porcje archiwum ZIP_STORED z `members`.
+
+    Jedno zadanie producenta pobiera po kolei porcje wpisów do kolejki o najwyżej
+    `read_ahead_chunks` elementach, więc kolejny obiekt pobierany jest, gdy poprzedni jest
+    jeszcze wysyłany, a zużycie pamięci nie zależy od rozmiaru archiwum.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(read_ahead_chunks, 1))
+
+    async def produce():
+        try:
+            for member in members:
+                chunks = member.chunks()
+                try:
+                    async for chunk in chunks:
+                        if chunk:
+                            await queue.put(chunk)
+                finally:
+                    await chunks.aclose()
+                await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    central_directory = []
+    offset = 0
+
+    try:
+        for member in members:
+            name = member.name.encode("utf-8")
+            dos_time, dos_date = _dos_datetime(member.modified_at)
+
+            local_header = _LOCAL_HEADER.pack(
+                0x04034B50, _VERSION, _FLAGS, _STORED, dos_time, dos_date,
+                0, member.size, member.size, len(name), 0
+            ) + name
+            yield local_header
+
+            crc = 0
+            written = 0
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                crc = zlib.crc32(chunk, crc)
+                written += len(chunk)
+                yield chunk
+
+            if written != member.size:
+                raise RuntimeError(
+                    f"Size mismatch for '{member.name}': expected {member.size} bytes, got {written}"
+                )
+
+            yield _DATA_DESCRIPTOR.pack(0x08074B50, crc, member.size, member.size)
+
+            central_directory.append(_CENTRAL_HEADER.pack(
+                0x02014B50, _VERSION, _VERSION, _FLAGS, _STORED, dos_time, dos_date,
+                crc, member.size, member.size, len(name), 0, 0, 0, 0, 0, offset
+            ) + name)
+            offset += len(local_header) + member.size + _DATA_DESCRIPTOR.size
+
+        central_directory_bytes = b"".join(central_directory)
+        yield central_directory_bytes
+        yield _END_OF_CENTRAL_DIR.pack(
+            0x06054B50, 0, 0, len(members), len(members), len(central_directory_bytes), offset, 0
+        )
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
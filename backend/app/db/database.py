@@ -1,10 +1,88 @@
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from core.config import settings
 
 Base = declarative_base()
 
-engine = create_async_engine(settings.DB_URL, echo=True)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Pula połączeń, która mierzy, ile pobranie połączenia czeka na wolne połączenie
+    (łącznie z otwarciem dodatkowego połączenia ponad pool_size), patrz pool_stats()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._checkout_timeouts = 0
+        self._total_checkout_wait = 0.0
+        self._max_checkout_wait = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self._checkout_timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            with self._stats_lock:
+                self._checkouts += 1
+                self._total_checkout_wait += wait
+                self._max_checkout_wait = max(self._max_checkout_wait, wait)
+
+    def stats(self) -> dict:
+        capacity = self.size() + self._max_overflow
+        with self._stats_lock:
+            return {
+                "pool_size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "pool_saturation": round(self.checkedout() / capacity, 3) if capacity > 0 else 0.0,
+                "total_checkouts": self._checkouts,
+                "checkout_timeouts": self._checkout_timeouts,
+                "avg_checkout_wait_ms": round(self._total_checkout_wait / self._checkouts * 1000, 3)
+                if self._checkouts else 0.0,
+                "max_checkout_wait_ms": round(self._max_checkout_wait * 1000, 3),
+            }
+
+
+def _connect_args() -> dict:
+    connect_args = {"prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE}
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+    return connect_args
+
+
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        connect_args=_connect_args(),
+    )
+
+
+engine = _create_engine(settings.DB_URL)
+# Replika tylko do odczytu, None gdy DB_REPLICA_URL nie jest ustawione
+replica_engine = _create_engine(settings.DB_REPLICA_URL) if settings.DB_REPLICA_URL else None
 
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -12,7 +90,100 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+ReplicaSessionLocal = sessionmaker(
+    bind=replica_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+) if replica_engine is not None else None
+
 
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+
+def uses_replica(username: str = None) -> bool:
+    """
+    Czy zapytania tylko do odczytu użytkownika `username` idą do repliki - nie, gdy repliki
+    nie ma albo użytkownik niedawno coś zapisał (read-your-writes)
+    """
+    return ReplicaSessionLocal is not None and not recently_wrote(username)
+
+
+def replica_session(username: str = None) -> AsyncSession:
+    """
+    Sesja dla zapytań tylko do odczytu: podpięta do repliki albo do bazy głównej,
+    jeśli dla `username` replika nie jest używana (patrz uses_replica)
+    """
+    if not uses_replica(username):
+        return AsyncSessionLocal()
+    return ReplicaSessionLocal()
+
+
+async def get_replica_db(username: str = None):
+    async with replica_session(username) as session:
+        yield session
+
+
+# Read-your-writes: username -> time.monotonic() ostatniego zatwierdzonego zapisu użytkownika.
+# Trzymane w procesie - przy kilku procesach backendu żądania użytkownika kieruj do tego samego.
+_last_write_at: Dict[str, float] = {}
+_WRITES_KEY = "has_writes"
+# Nazwa, pod którą w Session.info zapisany jest zalogowany użytkownik (ustawia get_current_user)
+SESSION_USERNAME_KEY = "username"
+# Wpisów logu audytowego użytkownik nie odczytuje, więc nie przełączają jego odczytów na bazę główną
+_NON_STICKY_TABLES = {"logs"}
+
+
+def recently_wrote(username: str) -> bool:
+    if not username:
+        return False
+    last_write_at = _last_write_at.get(username)
+    if last_write_at is None:
+        return False
+    if time.monotonic() - last_write_at < settings.DB_REPLICA_STICKY_S:
+        return True
+    _last_write_at.pop(username, None)
+    return False
+
+
+def mark_write(username: str):
+    _last_write_at[username] = time.monotonic()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_writes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if getattr(obj, "__tablename__", None) not in _NON_STICKY_TABLES:
+            session.info[_WRITES_KEY] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement_writes(orm_execute_state):
+    # Zbiorcze UPDATE / DELETE / INSERT omijają flush
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if getattr(table, "name", None) not in _NON_STICKY_TABLES:
+        orm_execute_state.session.info[_WRITES_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed_writes(session):
+    if session.info.pop(_WRITES_KEY, False):
+        username = session.info.get(SESSION_USERNAME_KEY)
+        if username:
+            mark_write(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_writes(session):
+    session.info.pop(_WRITES_KEY, None)
+
+
+def pool_stats() -> dict:
+    stats = {"primary": engine.sync_engine.pool.stats()}
+    if replica_engine is not None:
+        stats["replica"] = replica_engine.sync_engine.pool.stats()
+    return stats
@@ -0,0 +1,189 @@
+"""
+Utrzymanie miesięcznych partycji tabeli `logs` (uruchamiane okresowo z tasks.py):
+tworzy partycje z wyprzedzeniem, podsumowuje wpisy w dzienne liczniki i usuwa partycje
+starsze niż okres retencji - całe partycje, bez DELETE. Każda partycja jest podsumowywana
+jeszcze raz tuż przed usunięciem, więc jej dzienne liczniki zostają.
+
+Żadna z operacji nie bierze blokady ACCESS EXCLUSIVE na `logs`, która wstrzymałaby zapis
+logów audytowych (i czekałaby za długimi eksportami logów): partycje są dołączane przez
+ATTACH PARTITION, a odłączane przez DETACH PARTITION CONCURRENTLY przed DROP TABLE.
+Dlatego `logs` nie ma partycji domyślnej (DETACH CONCURRENTLY jej nie dopuszcza) -
+brakującą partycję miesiąca tworzy na bieżąco zapis logów (ensure_log_partitions).
+"""
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from core.config import settings
+
+# Klucz blokady doradczej brany przez utrzymanie, żeby kilka instancji nie uruchomiło go naraz
+LOG_MAINTENANCE_LOCK_ID = 7305_2026
+_PARTITION_NAME = re.compile(r"^logs_(\d{4})_(\d{2})$")
+
+
+def add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"logs_{month.year:04d}_{month.month:02d}"
+
+
+def month_bound(month: date) -> str:
+    # Literał z jawnym offsetem UTC - granica partycji nie zależy od ustawienia TimeZone sesji
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+async def list_log_partitions(conn: AsyncConnection) -> List[str]:
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'logs'::regclass"
+    ))
+    return list(result.scalars().all())
+
+
+async def _create_missing_partitions(conn: AsyncConnection, months: Iterable[date]) -> List[str]:
+    existing = set(await list_log_partitions(conn))
+    created = []
+    for month in sorted(set(months)):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        # CREATE TABLE ... PARTITION OF wziąłby ACCESS EXCLUSIVE na logs, ATTACH PARTITION
+        # wystarcza SHARE UPDATE EXCLUSIVE; indeksy logs powstają na pustej tabeli przy dołączeniu
+        await conn.execute(text(f"CREATE TABLE {name} (LIKE logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        await conn.execute(text(
+            f"ALTER TABLE logs ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ({month_bound(month)}) TO ({month_bound(add_months(month, 1))})"
+        ))
+        created.append(name)
+    return created
+
+
+async def create_log_partitions(conn: AsyncConnection, months_ahead: int) -> List[str]:
+    """
+    Zapewnia istnienie partycji od bieżącego miesiąca do `months_ahead` miesięcy naprzód.
+    Zwraca nazwy utworzonych partycji.
+    """
+    current_month = datetime.now(timezone.utc).date().replace(day=1)
+    return await _create_missing_partitions(
+        conn, [add_months(current_month, offset) for offset in range(months_ahead + 1)]
+    )
+
+
+async def ensure_log_partitions(conn: AsyncConnection, months: Iterable[date]) -> List[str]:
+    """
+    Tworzy brakujące partycje podanych miesięcy (np. gdy zadanie utrzymania jest wyłączone
+    albo jeszcze nie zadziałało po dłuższej przerwie) - wywoływane przez zapis logów, gdy
+    INSERT nie znalazł partycji. Czeka na trwające utrzymanie. Zwraca nazwy utworzonych partycji.
+    """
+    await conn.execute(text(f"SELECT pg_advisory_xact_lock({LOG_MAINTENANCE_LOCK_ID})"))
+    return await _create_missing_partitions(conn, months)
+
+
+async def rollup_logs(conn: AsyncConnection, since: date, until: date):
+    """
+    Przelicza dzienne liczniki (log_daily_rollups) dla dni z [since, until) - idempotentne
+    """
+    await conn.execute(
+        text(
+            "INSERT INTO log_daily_rollups (day, action, username, status, count) "
+            "SELECT (timestamp AT TIME ZONE 'UTC')::date, COALESCE(action, ''), username, "
+            "COALESCE(status, ''), count(*) "
+            "FROM logs WHERE timestamp >= :since AND timestamp < :until "
+            "GROUP BY 1, 2, 3, 4 "
+            "ON CONFLICT (day, action, username, status) DO UPDATE SET count = EXCLUDED.count"
+        ),
+        {
+            "since": datetime.combine(since, datetime.min.time(), tzinfo=timezone.utc),
+            "until": datetime.combine(until, datetime.min.time(), tzinfo=timezone.utc),
+        }
+    )
+
+
+async def expired_log_partitions(conn: AsyncConnection, retention_months: int) -> List[str]:
+    """
+    Zwraca partycje, których cały miesiąc jest starszy niż `retention_months` miesięcy
+    (licząc od bieżącego miesiąca)
+    """
+    cutoff = add_months(datetime.now(timezone.utc).date().replace(day=1), -retention_months)
+
+    expired = []
+    for name in sorted(await list_log_partitions(conn)):
+        match = _PARTITION_NAME.match(name)
+        if match and add_months(date(int(match.group(1)), int(match.group(2)), 1), 1) <= cutoff:
+            expired.append(name)
+    return expired
+
+
+async def maintain_log_partitions(conn: AsyncConnection) -> dict:
+    """
+    Wykonuje utrzymanie w jednej transakcji: tworzy partycje, przelicza podsumowania
+    (z `LOG_ROLLUPS_ENABLED` także całe miesiące partycji do usunięcia - w tym dni pominięte
+    przez okresowe podsumowanie) i zwraca partycje do usunięcia w "expired" - usuwa je
+    drop_log_partitions, już poza transakcją. Pomijane (zwraca {}), gdy inny proces
+    już je wykonuje.
+    """
+    acquired = (await conn.execute(
+        text(f"SELECT pg_try_advisory_xact_lock({LOG_MAINTENANCE_LOCK_ID})")
+    )).scalar()
+    if not acquired:
+        return {}
+
+    created = await create_log_partitions(conn, settings.LOG_PARTITION_MONTHS_AHEAD)
+
+    if settings.LOG_ROLLUPS_ENABLED:
+        today = datetime.now(timezone.utc).date()
+        await rollup_logs(conn, today - timedelta(days=settings.LOG_ROLLUP_LOOKBACK_DAYS), today + timedelta(days=1))
+
+    expired = []
+    if settings.LOG_RETENTION_MONTHS > 0:
+        expired = await expired_log_partitions(conn, settings.LOG_RETENTION_MONTHS)
+        if settings.LOG_ROLLUPS_ENABLED:
+            for name in expired:
+                match = _PARTITION_NAME.match(name)
+                month = date(int(match.group(1)), int(match.group(2)), 1)
+                await rollup_logs(conn, month, add_months(month, 1))
+
+    return {"created": created, "expired": expired}
+
+
+async def drop_log_partitions(conn: AsyncConnection, names: List[str]) -> List[str]:
+    """
+    Odłącza (DETACH PARTITION CONCURRENTLY) i usuwa podane partycje. `conn` musi być
+    w trybie AUTOCOMMIT - DETACH CONCURRENTLY nie działa w bloku transakcji. Odłączenie
+    przerwane wcześniej (partycja w stanie "detach pending") jest kończone przez FINALIZE.
+    Pomijane, gdy inny proces wykonuje właśnie utrzymanie. Zwraca nazwy usuniętych partycji.
+    """
+    if not names:
+        return []
+    acquired = (await conn.execute(
+        text(f"SELECT pg_try_advisory_lock({LOG_MAINTENANCE_LOCK_ID})")
+    )).scalar()
+    if not acquired:
+        return []
+
+    dropped = []
+    try:
+        for name in names:
+            result = await conn.execute(
+                text(
+                    "SELECT i.inhdetachpending FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "WHERE i.inhparent = 'logs'::regclass AND c.relname = :name"
+                ),
+                {"name": name}
+            )
+            detach_pending = result.scalar_one_or_none()
+            if detach_pending is None:
+                continue
+            mode = "FINALIZE" if detach_pending else "CONCURRENTLY"
+            await conn.execute(text(f"ALTER TABLE logs DETACH PARTITION {name} {mode}"))
+            await conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    finally:
+        await conn.execute(text(f"SELECT pg_advisory_unlock({LOG_MAINTENANCE_LOCK_ID})"))
+    return dropped
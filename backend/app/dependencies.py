@@ -5,7 +5,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from core.security import decode_access_token, now_utc, _jwt_keys_and_alg
-from db.database import get_db
+from core.user_cache import CurrentUser, user_cache
+from db.database import get_db, get_replica_db, uses_replica, SESSION_USERNAME_KEY
 from models.models import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
@@ -14,7 +15,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
 async def get_current_user(
         token: str = Depends(oauth2_scheme),
         db: AsyncSession = Depends(get_db),
-) -> User:
+) -> CurrentUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid or expired token.",
@@ -30,15 +31,37 @@ async def get_current_user(
     if exp < str(now_utc().timestamp()):
         raise credentials_exception
 
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
+    # Większość żądań obsługuje cache, bez zapytania do bazy
+    user = user_cache.get(username)
+    if user is None:
+        result = await db.execute(select(User).where(User.username == username))
+        db_user = result.scalar_one_or_none()
 
-    if not user:
-        raise credentials_exception
+        if not db_user:
+            raise credentials_exception
+
+        user = CurrentUser.from_user(db_user)
+        user_cache.put(user)
+
+    # Pozwala przypisać commity sesji do użytkownika (read-your-writes, patrz get_read_db)
+    db.info[SESSION_USERNAME_KEY] = user.username
 
     return user
 
 
+async def get_read_db(user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    Sesja dla zapytań tylko do odczytu - obsługuje ją replika, chyba że użytkownik zapisał
+    coś w ciągu ostatnich DB_REPLICA_STICKY_S sekund. Bez repliki używana jest sesja samego
+    żądania (get_db), zamiast pobierać z puli drugie połączenie
+    """
+    if not uses_replica(user.username):
+        yield db
+        return
+    async for session in get_replica_db(user.username):
+        yield session
+
+
 async def get_user_for_totp_setup(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
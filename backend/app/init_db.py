@@ -1,28 +1,50 @@
 """
-Script to initialize the database by creating tables if they do not exist.
+Skrypt aktualizujący schemat bazy danych przez uruchomienie migracji alembic.
+
+Uruchamiany raz na wdrożenie, przed startem aplikacji (`python init_db.py`, to samo
+co `alembic upgrade head`). Równoległe uruchomienia szereguje advisory lock, patrz
+migrations/env.py. Sama aplikacja przy starcie tylko sprawdza rewizję schematu.
 """
-import asyncio
+import os
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+from db.database import engine
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def get_alembic_config() -> Config:
+    return Config(ALEMBIC_INI)
+
 
-from sqlalchemy.ext.asyncio import create_async_engine
+def upgrade_db():
+    print("Upgrading the database schema...")
+    command.upgrade(get_alembic_config(), "head")
+    print("Database schema is up to date.")
 
-from core.config import settings
-from models.models import Base
 
+async def check_db_revision():
+    """
+    Rzuca RuntimeError, jeśli baza nie jest na najnowszej rewizji migracji.
+    Kosztuje jedno zapytanie, niezależnie od liczby tabel.
+    """
+    expected = set(ScriptDirectory.from_config(get_alembic_config()).get_heads())
 
-async def init_db():
-    # Creates a database engine.
-    # This is the object that manages database connections. It is configured via a URL.
-    engine = create_async_engine(settings.DB_URL, echo=True)
+    async with engine.connect() as conn:
+        current = set(await conn.run_sync(
+            lambda sync_conn: MigrationContext.configure(sync_conn).get_current_heads()
+        ))
 
-    print("Adding all tables to the database...")
-    # `Base.metadata` is an object containing the schema of all tables defined in models (everything that inherits from `Base`).
-    # `.create_all(engine)` is a method that says: "Iterate through all tables
-    # in this schema and for each one send a CREATE TABLE command to the database (via `engine`), but only IF that table does not already exist."
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    await engine.dispose()
-    print("tables created successfully.")
+    if current != expected:
+        raise RuntimeError(
+            f"Database schema is at revision {sorted(current) or 'none'}, "
+            f"expected {sorted(expected)}. Run `python init_db.py` to apply the migrations."
+        )
 
 
 if __name__ == "__main__":
-    asyncio.run(init_db())
+    upgrade_db()
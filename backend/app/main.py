@@ -1,18 +1,31 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from api.v1.api import api_router
-from init_db import init_db
+from core.s3_client import object_store
+from init_db import check_db_revision
+from services.audit_log_writer import audit_log_writer
+from tasks import start_background_tasks, stop_background_tasks
 from fastapi.middleware.cors import CORSMiddleware
 
 # Special object to manage the lifespan of the app
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Initializing application...")
-    # Initialize the database
-    await init_db()
+    # Bez startu na nieaktualnym schemacie (migracje uruchamia `python init_db.py`)
+    await check_db_revision()
+    # Wypełnienie cache istniejących bucketów S3 (uzupełniany na bieżąco, jeśli MinIO jeszcze nie odpowiada)
+    try:
+        await object_store.load_known_buckets()
+    except Exception as e:
+        print(f"Warning: Failed to load S3 buckets: {str(e)}")
+    audit_log_writer.start()
+    background_tasks = start_background_tasks()
     # yield is used to separate startup and shutdown code
     yield
     print("Shutting down application...")
+    await stop_background_tasks(background_tasks)
+    # Zapis wpisów logu audytowego, które czekają jeszcze w kolejce
+    await audit_log_writer.stop()
 
 # Creating the FastAPI app
 app = FastAPI(
@@ -39,6 +52,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Skipped-File-Ids", "X-Skipped-File-Count"],
 )
 
 
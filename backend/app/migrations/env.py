@@ -0,0 +1,119 @@
+import asyncio
+import re
+import time
+from logging.config import fileConfig
+
+from alembic import context
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect, pool
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core.config import settings
+from models.models import Base
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+# Miesięcznymi partycjami tabeli logs zarządza aplikacja w trakcie działania (db/log_partitions.py)
+LOG_PARTITION_NAME = re.compile(r"^logs_\d{4}_\d{2}$")
+
+# Klucz advisory lock PostgreSQL, który szereguje migracje między replikami
+MIGRATION_LOCK_ID = 7305_2025
+# Co ile sekund replika czekająca na migrację innej ponawia próbę przejęcia blokady
+MIGRATION_LOCK_POLL_S = 1.0
+# Rewizja opisująca schemat, który wcześniej tworzyło Base.metadata.create_all
+BASELINE_REVISION = "0001"
+
+
+def run_migrations_offline() -> None:
+    """Wypisuje SQL migracji na stdout (`alembic upgrade head --sql`) zamiast go wykonywać"""
+    context.configure(
+        url=settings.DB_URL,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    # Żeby `alembic revision --autogenerate` nie usuwało partycji logów
+    return not (type_ == "table" and reflected and LOG_PARTITION_NAME.match(name))
+
+
+def stamp_legacy_schema(connection: Connection) -> None:
+    """
+    Bazy utworzone przed wprowadzeniem migracji mają tabele, ale nie mają alembic_version -
+    oznacza je jako będące na rewizji bazowej
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table("alembic_version") and inspector.has_table("users"):
+        print(f"Existing schema without revision found, stamping it as {BASELINE_REVISION}")
+        context.get_context().stamp(ScriptDirectory.from_config(config), BASELINE_REVISION)
+    connection.commit()
+
+
+def acquire_migration_lock(connection: Connection) -> None:
+    """
+    Czeka na blokadę migracji. Próby (pg_try_advisory_lock) idą w trybie autocommit, więc
+    czekająca replika nie trzyma otwartej transakcji ani snapshotu - CREATE INDEX CONCURRENTLY
+    repliki, która migruje, czekałby na zakończenie każdego starszego snapshotu.
+    Blokadę trzyma sesja, więc zwalnia się ona przy zamknięciu połączenia.
+    """
+    isolation_level = connection.default_isolation_level
+    connection.execution_options(isolation_level="AUTOCOMMIT")
+    waiting = False
+    while not connection.exec_driver_sql(f"SELECT pg_try_advisory_lock({MIGRATION_LOCK_ID})").scalar():
+        if not waiting:
+            print("Another instance is running the migrations, waiting for it to finish...")
+            waiting = True
+        time.sleep(MIGRATION_LOCK_POLL_S)
+    # DDL czekający na blokadę tabeli blokuje wszystkie zapytania w kolejce za nim - lepiej się poddać
+    connection.exec_driver_sql(f"SET lock_timeout = {int(settings.DB_MIGRATION_LOCK_TIMEOUT_MS)}")
+    connection.commit()
+    connection.execution_options(isolation_level=isolation_level)
+
+
+def do_run_migrations(connection: Connection) -> None:
+    # Migruje tylko jedna replika naraz, pozostałe czekają tutaj i potem nie mają nic do zrobienia
+    acquire_migration_lock(connection)
+
+    # Jedna transakcja na rewizję, więc rewizje z autocommit_block()
+    # (np. CREATE INDEX CONCURRENTLY) mogą przeplatać się z transakcyjnymi
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        transaction_per_migration=True,
+    )
+    stamp_legacy_schema(connection)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    engine = create_async_engine(settings.DB_URL, poolclass=pool.NullPool)
+
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+
+    await engine.dispose()
+
+
+def run_migrations_online() -> None:
+    asyncio.run(run_async_migrations())
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
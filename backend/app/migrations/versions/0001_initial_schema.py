@@ -0,0 +1,101 @@
+"""Schemat początkowy (tabele tworzone wcześniej przez Base.metadata.create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-03 12:00:00
+
+Bazy utworzone przed wprowadzeniem migracji mają już te tabele:
+należy je oznaczyć przez `alembic stamp 0001`, a potem uruchomić `alembic upgrade head`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=True),
+        sa.Column("user_type", sa.String(), nullable=True),
+        sa.Column("max_storage_mb", sa.Integer(), nullable=True),
+        sa.Column("used_storage_mb", sa.Float(), nullable=True),
+        sa.Column("totp_secret", sa.String(), nullable=True),
+        sa.Column("totp_configured", sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint("username"),
+    )
+    op.create_index("ix_users_username", "users", ["username"])
+
+    op.create_table(
+        "files",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("path", sa.String(), nullable=True),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("owner", sa.String(), nullable=True),
+        sa.Column("current_version", sa.Integer(), nullable=True),
+        sa.Column("created_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("updated_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("is_favorite", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["owner"], ["users.username"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("owner", "name", name="uq_owner_filename"),
+    )
+    op.create_index("ix_files_id", "files", ["id"])
+
+    op.create_table(
+        "file_versions",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("file_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("version_number", sa.Integer(), nullable=True),
+        sa.Column("path", sa.String(), nullable=True),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("created_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("created_by", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["file_id"], ["files.id"]),
+        sa.ForeignKeyConstraint(["created_by"], ["users.username"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_file_versions_id", "file_versions", ["id"])
+
+    op.create_table(
+        "refresh_tokens",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("user_username", sa.String(), nullable=False),
+        sa.Column("token", sa.String(), nullable=False),
+        sa.Column("expires_at", postgresql.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("created_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["user_username"], ["users.username"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_refresh_tokens_id", "refresh_tokens", ["id"])
+    op.create_index("ix_refresh_tokens_token", "refresh_tokens", ["token"], unique=True)
+
+    op.create_table(
+        "logs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("action", sa.String(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("file_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("timestamp", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("details", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["username"], ["users.username"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_logs_id", "logs", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("logs")
+    op.drop_table("refresh_tokens")
+    op.drop_table("file_versions")
+    op.drop_table("files")
+    op.drop_table("users")
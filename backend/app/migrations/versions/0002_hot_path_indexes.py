@@ -0,0 +1,98 @@
+"""Indeksy dla najczęstszych zapytań FileService i LogService
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-11-03 12:30:00
+
+Indeksy budowane są przez CREATE INDEX CONCURRENTLY (poza transakcją), więc tabele
+przyjmują zapisy, gdy migracja działa na produkcyjnej bazie. Nieudana budowa zostawia
+indeks INVALID; ponowne uruchomienie upgrade usuwa go i buduje od nowa.
+
+Równoległe uploady tego samego pliku mogły utworzyć dwie wersje o tym samym numerze,
+przez co unikalny indeks by się nie utworzył - takie duplikaty są najpierw przenumerowywane (patrz upgrade).
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (nazwa, tabela, kolumny, dodatkowe argumenty create_index)
+INDEXES = [
+    # Wyszukiwanie po (file_id, version_number); obsługuje też każde zapytanie `file_id = ...`
+    ("uq_file_versions_file_id_version_number", "file_versions", ["file_id", "version_number"], {"unique": True}),
+    # Stronicowana lista plików, sortowana po updated_at / filtrowana po ulubionych / po prefiksie nazwy
+    ("ix_files_owner_updated_at_id", "files", ["owner", "updated_at", "id"], {}),
+    ("ix_files_owner_favorite_updated_at_id", "files", ["owner", "updated_at", "id"],
+     {"postgresql_where": sa.text("is_favorite")}),
+    ("ix_files_owner_name_pattern", "files", ["owner", "name"],
+     {"postgresql_ops": {"name": "varchar_pattern_ops"}}),
+    # Eksport logów: od najnowszych, opcjonalnie dla użytkownika / akcji
+    ("ix_logs_timestamp", "logs", ["timestamp"], {}),
+    ("ix_logs_username_timestamp", "logs", ["username", "timestamp"], {}),
+    ("ix_logs_action_timestamp", "logs", ["action", "timestamp"], {}),
+]
+
+
+def _renumber_duplicate_versions() -> None:
+    # Najstarsza kopia zduplikowanego numeru wersji go zachowuje, nowsze dostają kolejne
+    # numery po najwyższej wersji pliku. current_version wskazujący na zduplikowany numer
+    # przechodzi na jego najnowszą kopię, czyli wysłaną jako ostatnia
+    op.execute(
+        "CREATE TEMPORARY TABLE file_version_renumbering AS "
+        "SELECT d.id, d.file_id, d.version_number AS old_number, "
+        "m.max_version + row_number() OVER (PARTITION BY d.file_id ORDER BY d.created_at NULLS FIRST, d.id) "
+        "AS new_number "
+        "FROM (SELECT id, file_id, version_number, created_at, row_number() OVER ("
+        "PARTITION BY file_id, version_number ORDER BY created_at NULLS FIRST, id) AS copy "
+        "FROM file_versions) d "
+        "JOIN (SELECT file_id, max(version_number) AS max_version FROM file_versions GROUP BY file_id) m "
+        "ON m.file_id = d.file_id "
+        "WHERE d.copy > 1"
+    )
+    op.execute(
+        "UPDATE file_versions v SET version_number = r.new_number "
+        "FROM file_version_renumbering r WHERE v.id = r.id"
+    )
+    op.execute(
+        "UPDATE files f SET current_version = r.new_number "
+        "FROM (SELECT DISTINCT ON (file_id, old_number) file_id, old_number, new_number "
+        "FROM file_version_renumbering ORDER BY file_id, old_number, new_number DESC) r "
+        "WHERE f.id = r.file_id AND f.current_version = r.old_number"
+    )
+    op.execute("DROP TABLE file_version_renumbering")
+
+
+def _drop_invalid_indexes() -> None:
+    # Pozostałości po nieudanej budowie CONCURRENTLY - IF NOT EXISTS by je pominęło
+    if context.is_offline_mode():
+        return
+    result = op.get_bind().execute(
+        sa.text(
+            "SELECT c.relname, t.relname FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_class t ON t.oid = i.indrelid "
+            "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+        ),
+        {"names": [name for name, _, _, _ in INDEXES]}
+    )
+    for name, table in result.all():
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+def upgrade() -> None:
+    _renumber_duplicate_versions()
+
+    with op.get_context().autocommit_block():
+        _drop_invalid_indexes()
+        for name, table, columns, kwargs in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kwargs)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,141 @@
+"""Partycjonowanie logów po miesiącach i dzienne podsumowania logów
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-11-10 12:00:00
+
+Istniejąca tabela logs jest zastępowana tabelą partycjonowaną przez RANGE (timestamp), z jedną
+partycją na miesiąc (logs_YYYY_MM). Istniejące wpisy są kopiowane do nowych partycji, więc przy
+dużej tabeli logs migrację należy uruchomić w oknie serwisowym. Partycje kolejnych miesięcy
+tworzy zadanie utrzymania logów (patrz db/log_partitions.py). Wpisy z miesiąca bez partycji
+(np. gdy to zadanie jest wyłączone) trafiają do partycji DEFAULT logs_default, więc zapis logów
+audytowych nigdy się nie kończy błędem; zadanie przenosi je później. Dzienne podsumowania są
+uzupełniane ze wszystkich istniejących wpisów.
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partycje tworzone z wyprzedzeniem, poza bieżącym miesiącem
+MONTHS_AHEAD = 3
+
+
+def _add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _create_partition(month: date) -> None:
+    op.execute(
+        f"CREATE TABLE IF NOT EXISTS logs_{month.year:04d}_{month.month:02d} PARTITION OF logs "
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{_add_months(month, 1).isoformat()} 00:00:00+00')"
+    )
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE logs RENAME TO logs_legacy")
+    op.execute("ALTER TABLE logs_legacy RENAME CONSTRAINT logs_pkey TO logs_legacy_pkey")
+    for index_name in ("ix_logs_id", "ix_logs_timestamp", "ix_logs_username_timestamp", "ix_logs_action_timestamp"):
+        op.drop_index(index_name, table_name="logs_legacy", if_exists=True)
+
+    op.create_table(
+        "logs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("action", sa.String(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("file_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("timestamp", postgresql.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("details", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["username"], ["users.username"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", "timestamp"),
+        postgresql_partition_by="RANGE (timestamp)",
+    )
+    # Indeksy tabeli nadrzędnej tworzone są na każdej partycji
+    op.create_index("ix_logs_timestamp", "logs", ["timestamp"])
+    op.create_index("ix_logs_username_timestamp", "logs", ["username", "timestamp"])
+    op.create_index("ix_logs_action_timestamp", "logs", ["action", "timestamp"])
+
+    current_month = datetime.now(timezone.utc).date().replace(day=1)
+    first_month = current_month
+    last_month = _add_months(current_month, MONTHS_AHEAD)
+    if not context.is_offline_mode():
+        oldest, newest = op.get_bind().execute(
+            sa.text("SELECT min(timestamp), max(timestamp) FROM logs_legacy")
+        ).one()
+        if oldest is not None:
+            first_month = min(first_month, oldest.astimezone(timezone.utc).date().replace(day=1))
+            last_month = max(last_month, newest.astimezone(timezone.utc).date().replace(day=1))
+
+    month = first_month
+    while month <= last_month:
+        _create_partition(month)
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE logs_default PARTITION OF logs DEFAULT")
+
+    # Wpisy bez timestamp dostają bieżący czas, klucz partycjonowania nie może być NULL
+    op.execute(
+        "INSERT INTO logs (id, action, status, username, file_id, timestamp, details) "
+        "SELECT id, action, status, username, file_id, COALESCE(timestamp, now()), details FROM logs_legacy"
+    )
+    op.drop_table("logs_legacy")
+
+    op.create_table(
+        "log_daily_rollups",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("action", sa.String(), nullable=False),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("day", "action", "username", "status"),
+    )
+    op.create_index("ix_log_daily_rollups_username_day", "log_daily_rollups", ["username", "day"])
+
+    # Okresowe podsumowanie obejmuje tylko kilka ostatnich dni - wcześniejsze dni liczone są tutaj
+    op.execute(
+        "INSERT INTO log_daily_rollups (day, action, username, status, count) "
+        "SELECT (timestamp AT TIME ZONE 'UTC')::date, COALESCE(action, ''), username, "
+        "COALESCE(status, ''), count(*) "
+        "FROM logs GROUP BY 1, 2, 3, 4"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("log_daily_rollups")
+
+    op.execute("ALTER TABLE logs RENAME TO logs_partitioned")
+    op.execute("ALTER TABLE logs_partitioned RENAME CONSTRAINT logs_pkey TO logs_partitioned_pkey")
+    for index_name in ("ix_logs_timestamp", "ix_logs_username_timestamp", "ix_logs_action_timestamp"):
+        op.drop_index(index_name, table_name="logs_partitioned")
+
+    op.create_table(
+        "logs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("action", sa.String(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("file_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("timestamp", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("details", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["username"], ["users.username"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_logs_id", "logs", ["id"])
+    op.create_index("ix_logs_timestamp", "logs", ["timestamp"])
+    op.create_index("ix_logs_username_timestamp", "logs", ["username", "timestamp"])
+    op.create_index("ix_logs_action_timestamp", "logs", ["action", "timestamp"])
+
+    op.execute(
+        "INSERT INTO logs (id, action, status, username, file_id, timestamp, details) "
+        "SELECT id, action, status, username, file_id, timestamp, details FROM logs_partitioned"
+    )
+    # Usunięcie tabeli nadrzędnej usuwa wszystkie jej partycje
+    op.drop_table("logs_partitioned")
@@ -0,0 +1,43 @@
+"""Deduplikowane bloby adresowane treścią, do których odwołują się wersje plików
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-11-17 12:00:00
+
+Istniejące wersje zachowują blob_id NULL i zostają zapisane pod swoim kluczem z numerem wersji.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "blobs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("owner", sa.String(), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["owner"], ["users.username"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("owner", "sha256", name="uq_blobs_owner_sha256"),
+    )
+    op.add_column("file_versions", sa.Column("blob_id", postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key("file_versions_blob_id_fkey", "file_versions", "blobs", ["blob_id"], ["id"])
+    op.create_index("ix_file_versions_blob_id", "file_versions", ["blob_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_file_versions_blob_id", table_name="file_versions")
+    op.drop_constraint("file_versions_blob_id_fkey", "file_versions", type_="foreignkey")
+    op.drop_column("file_versions", "blob_id")
+    op.drop_table("blobs")
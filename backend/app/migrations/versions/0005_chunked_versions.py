@@ -0,0 +1,43 @@
+"""Przechowywanie wersji plików w kawałkach wyznaczanych przez zawartość
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-11-24 12:00:00
+
+Istniejące wersje zostają zapisane w całości (is_chunked = false).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "file_versions",
+        sa.Column("is_chunked", sa.Boolean(), server_default=sa.text("false"), nullable=False),
+    )
+    op.create_table(
+        "file_version_chunks",
+        sa.Column("version_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("blob_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("offset", sa.Integer(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["version_id"], ["file_versions.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["blob_id"], ["blobs.id"]),
+        sa.PrimaryKeyConstraint("version_id", "position"),
+    )
+    op.create_index("ix_file_version_chunks_blob_id", "file_version_chunks", ["blob_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_file_version_chunks_blob_id", table_name="file_version_chunks")
+    op.drop_table("file_version_chunks")
+    op.drop_column("file_versions", "is_chunked")
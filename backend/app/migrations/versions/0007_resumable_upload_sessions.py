@@ -0,0 +1,43 @@
+"""Wznawialne sesje uploadu w kawałkach, składane jako uploady multipart w S3
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-12-08 12:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column("upload_sessions", "sha256", existing_type=sa.String(length=64), nullable=True)
+    op.add_column("upload_sessions", sa.Column("upload_id", sa.String(), nullable=True))
+    op.add_column(
+        "upload_sessions",
+        sa.Column("committed_offset", sa.Integer(), server_default=sa.text("0"), nullable=False),
+    )
+    op.create_table(
+        "upload_session_parts",
+        sa.Column("session_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("part_number", sa.Integer(), nullable=False),
+        sa.Column("etag", sa.String(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["session_id"], ["upload_sessions.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("session_id", "part_number"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("upload_session_parts")
+    op.drop_column("upload_sessions", "committed_offset")
+    op.drop_column("upload_sessions", "upload_id")
+    # Sesje utworzone bez zadeklarowanego hasha nie spełnią NOT NULL
+    op.execute("DELETE FROM upload_sessions WHERE sha256 IS NULL")
+    op.alter_column("upload_sessions", "sha256", existing_type=sa.String(length=64), nullable=False)
@@ -0,0 +1,26 @@
+"""Sesje uploadu wysyłane bezpośrednio do S3 przez podpisane URL-e
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-12-15 12:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "upload_sessions",
+        sa.Column("direct_upload", sa.Boolean(), server_default=sa.text("false"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("upload_sessions", "direct_upload")
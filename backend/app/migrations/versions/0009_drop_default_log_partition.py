@@ -0,0 +1,48 @@
+"""Usunięcie partycji domyślnej logs_default
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-12-22 12:00:00
+
+Przy partycji domyślnej PostgreSQL nie pozwala odłączać partycji przez DETACH PARTITION
+CONCURRENTLY, a bez tego usunięcie starej partycji blokuje zapis logów (ACCESS EXCLUSIVE
+na logs). Wpisy z logs_default trafiają do partycji swoich miesięcy (tworzonych w razie
+potrzeby); brakujące partycje tworzy odtąd zapis logów (patrz db/log_partitions.py).
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE logs DETACH PARTITION logs_default")
+
+    if not context.is_offline_mode():
+        result = op.get_bind().execute(sa.text(
+            "SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC')::date FROM logs_default"
+        ))
+        for month in result.scalars().all():
+            op.execute(
+                f"CREATE TABLE IF NOT EXISTS logs_{month.year:04d}_{month.month:02d} PARTITION OF logs "
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+                f"TO ('{_add_months(month, 1).isoformat()} 00:00:00+00')"
+            )
+
+    op.execute("INSERT INTO logs SELECT * FROM logs_default")
+    op.drop_table("logs_default")
+
+
+def downgrade() -> None:
+    op.execute("CREATE TABLE logs_default PARTITION OF logs DEFAULT")
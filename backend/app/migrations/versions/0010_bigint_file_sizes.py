@@ -0,0 +1,42 @@
+"""Rozmiary plików w kolumnach bigint i stan SHA-256 sesji uploadu
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-01-05 12:00:00
+
+Kolumny integer ograniczały pliki do 2 GiB. Zmiana typu przepisuje tabele (blokada
+ACCESS EXCLUSIVE na czas przepisania), więc przy dużych tabelach files / file_versions
+migrację należy uruchomić w oknie serwisowym.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SIZE_COLUMNS = [
+    ("files", "size"),
+    ("file_versions", "size"),
+    ("blobs", "size"),
+    ("file_version_chunks", "offset"),
+    ("file_version_chunks", "size"),
+    ("upload_sessions", "size"),
+    ("upload_sessions", "committed_offset"),
+    ("upload_session_parts", "size"),
+]
+
+
+def upgrade() -> None:
+    for table_name, column_name in SIZE_COLUMNS:
+        op.alter_column(table_name, column_name, existing_type=sa.Integer(), type_=sa.BigInteger())
+    op.add_column("upload_sessions", sa.Column("hash_state", sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("upload_sessions", "hash_state")
+    for table_name, column_name in SIZE_COLUMNS:
+        op.alter_column(table_name, column_name, existing_type=sa.BigInteger(), type_=sa.Integer())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, UniqueConstraint, Float
+from sqlalchemy import Column, BigInteger, Integer, LargeBinary, String, ForeignKey, Boolean, UniqueConstraint, Float, Index, Date, text
 from sqlalchemy.dialects.postgresql import UUID, TIMESTAMP
 from sqlalchemy.orm import declarative_base, relationship
 
@@ -10,7 +10,7 @@ class FileStorage(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, index=True)
     path = Column(String)
     name = Column(String)
-    size = Column(Integer)
+    size = Column(BigInteger)
     owner = Column(String, ForeignKey("users.username"))
     current_version = Column(Integer, default=1)
     created_at = Column(TIMESTAMP(timezone=True))
@@ -22,6 +22,12 @@ class FileStorage(Base):
 
     __table_args__ = (
         UniqueConstraint('owner', 'name', name='uq_owner_filename'),
+        # Stronicowana lista plików (keyset po (updated_at, id) / name) i jej filtry
+        Index('ix_files_owner_updated_at_id', 'owner', 'updated_at', 'id'),
+        Index('ix_files_owner_favorite_updated_at_id', 'owner', 'updated_at', 'id',
+              postgresql_where=text('is_favorite')),
+        Index('ix_files_owner_name_pattern', 'owner', 'name',
+              postgresql_ops={'name': 'varchar_pattern_ops'}),
     )
 
 
@@ -31,13 +37,89 @@ class FileVersion(Base):
     file_id = Column(UUID(as_uuid=True), ForeignKey("files.id"))
     version_number = Column(Integer)
     path = Column(String)
-    size = Column(Integer)
+    size = Column(BigInteger)
     created_at = Column(TIMESTAMP(timezone=True))
     created_by = Column(String, ForeignKey("users.username"))
+    # Treść wersji; NULL dla wersji w kawałkach i wersji z własnym obiektem (patrz path):
+    # zapisanych przed deduplikacją albo wysłanych bezpośrednio do S3 przez podpisane URL-e
+    blob_id = Column(UUID(as_uuid=True), ForeignKey("blobs.id"), nullable=True)
+    # Treść podzielona na kawałki wyznaczane przez zawartość (patrz FileVersionChunk) zamiast jednego bloba
+    is_chunked = Column(Boolean, nullable=False, default=False, server_default=text('false'))
 
     file = relationship("FileStorage", back_populates="versions")
     creator = relationship("User", foreign_keys=created_by)
 
+    __table_args__ = (
+        Index('uq_file_versions_file_id_version_number', 'file_id', 'version_number', unique=True),
+        Index('ix_file_versions_blob_id', 'blob_id'),
+    )
+
+
+class Blob(Base):
+    # Obiekt adresowany treścią (klucz blobs/<sha256> w buckecie użytkownika), wspólny dla wszystkich
+    # wersji plików użytkownika o tej samej treści. ref_count = liczba takich wersji.
+    __tablename__ = "blobs"
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    owner = Column(String, ForeignKey("users.username", ondelete="CASCADE"), nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        UniqueConstraint('owner', 'sha256', name='uq_blobs_owner_sha256'),
+    )
+
+
+class FileVersionChunk(Base):
+    # Uporządkowana lista kawałków (blobów), z których składana jest wersja w kawałkach
+    __tablename__ = "file_version_chunks"
+    version_id = Column(UUID(as_uuid=True), ForeignKey("file_versions.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    blob_id = Column(UUID(as_uuid=True), ForeignKey("blobs.id"), nullable=False)
+    offset = Column(BigInteger, nullable=False)
+    size = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index('ix_file_version_chunks_blob_id', 'blob_id'),
+    )
+
+
+class UploadSession(Base):
+    # Upload zapowiedziany przez klienta (nazwa, rozmiar, opcjonalnie SHA-256) przed wysłaniem treści;
+    # zużywany przy przesłaniu treści, po expires_at nieważny (i usuwany).
+    # Treść wysyłana w kawałkach trafia do uploadu multipart w S3 (klucz uploads/<id>)
+    __tablename__ = "upload_sessions"
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    owner = Column(String, ForeignKey("users.username", ondelete="CASCADE"), nullable=False)
+    filename = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True))
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    # Id uploadu multipart w S3, tworzonego z pierwszym kawałkiem
+    upload_id = Column(String, nullable=True)
+    # Liczba odebranych dotąd bajtów - kolejny kawałek musi zaczynać się od tego offsetu
+    committed_offset = Column(BigInteger, nullable=False, default=0, server_default=text('0'))
+    # Stan SHA-256 (core/sha256_state) po committed_offset bajtach - skrót liczony kawałek po kawałku;
+    # NULL, gdy liczony jest dopiero z całego złożonego obiektu
+    hash_state = Column(LargeBinary, nullable=True)
+    # Treść wysłana przez klienta bezpośrednio do S3 przez podpisane URL-e (zostaje własnym obiektem wersji)
+    direct_upload = Column(Boolean, nullable=False, default=False, server_default=text('false'))
+
+    __table_args__ = (
+        Index('ix_upload_sessions_expires_at', 'expires_at'),
+    )
+
+
+class UploadSessionPart(Base):
+    # Kawałek sesji uploadu = jedna część jej uploadu multipart w S3
+    __tablename__ = "upload_session_parts"
+    session_id = Column(UUID(as_uuid=True), ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    part_number = Column(Integer, primary_key=True)
+    etag = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -66,13 +148,36 @@ class RefreshToken(Base):
 
 
 class LogEntry(Base):
+    # Partycjonowana miesięcznie po timestamp (partycje logs_YYYY_MM, patrz db/log_partitions.py),
+    # więc klucz partycjonowania jest częścią klucza głównego
     __tablename__ = "logs"
-    id = Column(UUID(as_uuid=True), primary_key=True, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True)
     action = Column(String)
     status = Column(String)
     username = Column(String, ForeignKey("users.username", ondelete="CASCADE"), nullable=False)
     file_id = Column(UUID(as_uuid=True), nullable=True)
-    timestamp = Column(TIMESTAMP(timezone=True))
+    timestamp = Column(TIMESTAMP(timezone=True), primary_key=True)
     details = Column(String, nullable=True)
 
     user = relationship("User", back_populates="logs")
+
+    __table_args__ = (
+        Index('ix_logs_timestamp', 'timestamp'),
+        Index('ix_logs_username_timestamp', 'username', 'timestamp'),
+        Index('ix_logs_action_timestamp', 'action', 'timestamp'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+
+class LogDailyRollup(Base):
+    # Liczba wpisów logu na dzień, akcję, użytkownika i status - zostaje po usunięciu starych partycji
+    __tablename__ = "log_daily_rollups"
+    day = Column(Date, primary_key=True)
+    action = Column(String, primary_key=True)
+    username = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_log_daily_rollups_username_day', 'username', 'day'),
+    )
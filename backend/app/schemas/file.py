@@ -1,7 +1,11 @@
 from datetime import datetime
+from typing import List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
+
+# Maksymalny rozmiar obiektu w S3 (5 TiB)
+MAX_FILE_SIZE = 5 * 1024 ** 4
 
 
 class FileItem(BaseModel):
@@ -18,11 +22,32 @@ class FileItem(BaseModel):
     updated_at: datetime
 
 
+class FileListPage(BaseModel):
+    """Jedna strona listy plików; next_cursor przekazany z powrotem zwraca kolejną stronę"""
+    files: List[FileItem]
+    next_cursor: Optional[str] = None
+
+
 class FileSetIsFavorite(BaseModel):
     file_id: str
     is_favorite: bool
 
 
+class FileUploadNegotiation(BaseModel):
+    """Plik, który klient zamierza wysłać, identyfikowany przez SHA-256 treści"""
+    filename: str = Field(min_length=1)
+    size: int = Field(ge=0, le=MAX_FILE_SIZE)
+    sha256: str = Field(pattern=r"^[0-9a-fA-F]{64}$")
+
+
+class UploadSessionCreate(BaseModel):
+    """Upload wznawialny: plik jest potem wysyłany w kawałkach i finalizowany"""
+    filename: str = Field(min_length=1)
+    size: int = Field(gt=0, le=MAX_FILE_SIZE)
+    # Opcjonalne - jeśli podane, przesłana treść jest z nim porównywana przy finalizacji
+    sha256: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{64}$")
+
+
 class FileDownloadManyFiles(BaseModel):
     file_ids: list[str]
 
@@ -41,5 +66,8 @@ class StorageInfo(BaseModel):
     total_versions: int
     total_versions_size_bytes: int
     total_versions_size_mb: float
+    # Treść po deduplikacji: liczba przechowywanych blobów i bajty zaoszczędzone względem zapisu każdej wersji
+    total_blobs: int
+    deduplicated_bytes: int
 
 
@@ -0,0 +1,180 @@
+"""
+Buforowany zapis logów audytowych, uruchamiany i zatrzymywany w `main.lifespan`.
+"""
+import asyncio
+from datetime import timezone
+from typing import List, Optional
+
+from core.config import settings
+from db.database import AsyncSessionLocal, engine
+from db.log_partitions import ensure_log_partitions
+from models.models import LogEntry, User
+from sqlalchemy import insert, select
+
+
+class AuditLogWriter:
+    """
+    Zbiera wpisy logu audytowego w kolejce w pamięci i zapisuje je do bazy zbiorczymi
+    INSERT-ami z zadania w tle, we własnej sesji - żądania nie czekają na zapis logu.
+
+    Paczka zapisywana jest, gdy ma `batch_size` wpisów albo jej najstarszy wpis czeka
+    `flush_interval_s` sekund. Gdy kolejka jest pełna albo zadanie zapisu nie działa
+    (skrypty poza lifespan, po stop(), po awarii zadania), put() zapisuje wpis od razu,
+    więc problem z zapisem logów nigdy nie zawiesza żądań. stop() zapisuje wszystko,
+    co zostało w kolejce.
+    """
+
+    def __init__(self, batch_size: int, flush_interval_s: float, max_queue_size: int):
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+
+    async def put(self, entry: dict):
+        if self._task is None or self._task.done():
+            await self._write([entry])
+            return
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            await self._write([entry])
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        if not task.done():
+            # None oznacza: zapisz to, co jest w kolejce, i zakończ. Przy pełnej kolejce czekamy
+            # też na samo zadanie - gdyby przestało działać, nikt by jej nie opróżnił
+            stop_signal = asyncio.ensure_future(self.queue.put(None))
+            await asyncio.wait({stop_signal, task}, return_when=asyncio.FIRST_COMPLETED)
+            stop_signal.cancel()
+        try:
+            await task
+        except Exception as e:
+            print(f"Warning: Audit log writer failed: {str(e)}")
+
+        # Wpisy, których zadanie nie zdążyło zapisać (np. po jego awarii)
+        remaining = []
+        while not self.queue.empty():
+            entry = self.queue.get_nowait()
+            if entry is not None:
+                remaining.append(entry)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._write(remaining[start:start + self.batch_size])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await self.queue.get()
+            if entry is None:
+                break
+
+            batch = [entry]
+            deadline = loop.time() + self.flush_interval_s
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            await self._write(batch)
+
+    async def _write(self, batch: List[dict]):
+        try:
+            async with AsyncSessionLocal() as db:
+                # logs.username wskazuje na users - wpis nieistniejącego użytkownika (np. nieudane
+                # logowanie z literówką w nazwie) wywróciłby cały INSERT, więc jest pomijany od razu
+                result = await db.execute(
+                    select(User.username).where(User.username.in_({entry["username"] for entry in batch}))
+                )
+                known_usernames = set(result.scalars().all())
+                known = [entry for entry in batch if entry["username"] in known_usernames]
+                if len(known) < len(batch):
+                    self._failed += len(batch) - len(known)
+                    print(f"Warning: Skipped {len(batch) - len(known)} audit log entries of unknown users")
+                batch = known
+                if not batch:
+                    return
+
+                error = await self._insert_batch(db, batch)
+                if error is not None and await self._create_missing_partitions(batch):
+                    error = await self._insert_batch(db, batch)
+                if error is None:
+                    return
+                print(f"Warning: Failed to write {len(batch)} audit log entries, retrying one by one: {str(error)}")
+
+                # Jeden błędny wpis nie może przepaść razem z całą paczką
+                for entry in batch:
+                    try:
+                        await db.execute(insert(LogEntry), [entry])
+                        await db.commit()
+                        self._written += 1
+                    except Exception:
+                        await db.rollback()
+                        self._failed += 1
+        except Exception as e:
+            # Baza niedostępna - wpisy przepadają, ale zapis działa dalej
+            self._failed += len(batch)
+            print(f"Warning: Failed to write {len(batch)} audit log entries: {str(e)}")
+
+    async def _insert_batch(self, db, batch: List[dict]) -> Optional[Exception]:
+        try:
+            await db.execute(insert(LogEntry), batch)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            return e
+        self._written += len(batch)
+        self._batches += 1
+        return None
+
+    async def _create_missing_partitions(self, batch: List[dict]) -> bool:
+        # `logs` nie ma partycji domyślnej - wpis z miesiąca bez partycji (np. przy wyłączonym
+        # LOG_MAINTENANCE_INTERVAL_S) wywraca INSERT, więc brakująca partycja powstaje od razu
+        months = {entry["timestamp"].astimezone(timezone.utc).date().replace(day=1) for entry in batch}
+        try:
+            async with engine.begin() as conn:
+                created = await ensure_log_partitions(conn, months)
+        except Exception as e:
+            print(f"Warning: Failed to create log partitions: {str(e)}")
+            return False
+        if created:
+            print(f"Log partitions created: {created}")
+        return bool(created)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "max_queue_size": self.queue.maxsize,
+            "batch_size": self.batch_size,
+            "flush_interval_s": self.flush_interval_s,
+            "written": self._written,
+            "failed": self._failed,
+            "batches": self._batches,
+        }
+
+
+audit_log_writer = AuditLogWriter(
+    batch_size=settings.AUDIT_LOG_BATCH_SIZE,
+    flush_interval_s=settings.AUDIT_LOG_FLUSH_INTERVAL_S,
+    max_queue_size=settings.AUDIT_LOG_QUEUE_SIZE
+)
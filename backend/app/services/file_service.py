@@ -1,62 +1,443 @@
 import asyncio
-import zipfile
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime, timezone
-from io import BytesIO
-from typing import List, Tuple
-from uuid import uuid4
+import base64
+import hashlib
+import json
+import tempfile
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+from uuid import UUID, uuid4
 import os
-import time
 
-from core.s3_client import s3, ensure_bucket_exists
-
-# Globalny executor dla operacji S3 z większą liczbą wątków
-_s3_executor = ThreadPoolExecutor(max_workers=10)
+from core import sha256_state
+from core.chunking import Chunk, ChunkedFile, chunk_file
+from core.config import settings
+from botocore.exceptions import ClientError
+from core.s3_client import object_store, ensure_bucket_exists, is_bucket_missing_error, generate_presigned_url
+from core.user_cache import user_cache
+from core.zip_stream import ZipMember, stream_zip, zip_stream_size, ZIP_MAX_SIZE, ZIP_MAX_ENTRIES
 from fastapi import UploadFile, HTTPException, status
-from models.models import User, FileStorage, FileVersion
+from models.models import User, FileStorage, FileVersion, FileVersionChunk, Blob, UploadSession, UploadSessionPart
 from schemas.file import FileItem, FileSetIsFavorite
 from services.log_service import LogService, LogAction
+from sqlalchemy import and_, any_, delete, func, literal, true, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID, insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from util import _str_to_uuid
-
+from sqlalchemy.orm import aliased
+from util import _str_to_uuid, parse_range_header, if_range_matches
+
+BLOB_HASH_CHUNK_SIZE = 1024 * 1024  # 1 MB
+# Limity uploadu multipart w S3: minimalny rozmiar części (poza ostatnią) i maksymalna liczba części
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+# copy_object kopiuje obiekty do 5 GiB - większe kopiowane są multipartem, częściami upload_part_copy
+S3_MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024
+S3_COPY_PART_SIZE = 512 * 1024 * 1024
+# Ile bajtów kawałka uploadu wznawialnego trzymać w pamięci, zanim trafi do pliku tymczasowego
+CHUNK_SPOOL_MAX_MEMORY = 1024 * 1024  # 1 MB
 
 class FileService:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, read_db: AsyncSession = None):
+        # read_db (np. sesja repliki) obsługuje metody tylko do odczytu:
+        # list_files, get_user_storage_info, get_file_versions
         self.db = db
+        self.read_db = read_db if read_db is not None else db
         self.log_service = LogService(db)
 
-    async def _recalculate_user_storage(self, username: str) -> float:
+    async def _apply_storage_delta(self, username: str, delta_bytes: int):
+        """
+        Dodaje zmianę rozmiaru (w bajtach) do used_storage_mb użytkownika jednym UPDATE,
+        w tej samej transakcji co zmiana wersji pliku (bez commit - robi go wywołujący).
+        Wpis użytkownika w cache jest usuwany dopiero po tym commit
+        """
+        await self.db.execute(
+            update(User)
+            .where(User.username == username)
+            .values(used_storage_mb=User.used_storage_mb + delta_bytes / (1024 * 1024))
+        )
+        user_cache.invalidate_on_commit(self.db, username)
+
+    async def reconcile_storage(self, username: str = None) -> int:
         """
-        Przelicza rzeczywiste wykorzystanie miejsca użytkownika i aktualizuje w bazie
-        Zwraca aktualną wartość w MiB
+        Przelicza used_storage_mb na podstawie sumy rozmiarów wersji i poprawia rekordy,
+        które rozjechały się z rzeczywistością (jednym UPDATE ... FROM po stronie bazy).
+        Bez username - dla wszystkich użytkowników. Zwraca liczbę poprawionych użytkowników.
         """
-        all_versions_query = select(FileVersion).join(
-            FileStorage, FileVersion.file_id == FileStorage.id
-        ).where(FileStorage.owner == username)
-        result = await self.db.execute(all_versions_query)
-        all_versions = result.scalars().all()
+        # Zajętość wg polityki deduplikacji: każdy blob (także kawałek) liczony raz,
+        # wersje z własnym obiektem (sprzed deduplikacji lub wysłane bezpośrednio do S3) osobno
+        legacy_query = select(
+            FileStorage.owner.label("owner"),
+            FileVersion.size.label("size")
+        ).join(
+            FileVersion, FileVersion.file_id == FileStorage.id
+        ).where(FileVersion.blob_id.is_(None), FileVersion.is_chunked.is_(False))
+        blobs_query = select(
+            Blob.owner.label("owner"),
+            Blob.size.label("size")
+        ).where(Blob.ref_count > 0)
+
+        user_alias = aliased(User)
+        actual_query = select(user_alias.username.label("username"))
+
+        if username is not None:
+            legacy_query = legacy_query.where(FileStorage.owner == username)
+            blobs_query = blobs_query.where(Blob.owner == username)
+            actual_query = actual_query.where(user_alias.username == username)
+
+        stored = union_all(legacy_query, blobs_query).subquery()
+        usage = select(
+            stored.c.owner,
+            func.sum(stored.c.size).label("total_bytes")
+        ).group_by(stored.c.owner).subquery()
+        actual = actual_query.add_columns(
+            (func.coalesce(usage.c.total_bytes, 0) / float(1024 * 1024)).label("used_storage_mb")
+        ).outerjoin(usage, usage.c.owner == user_alias.username).subquery()
+
+        try:
+            result = await self.db.execute(
+                update(User)
+                .where(
+                    User.username == actual.c.username,
+                    func.abs(User.used_storage_mb - actual.c.used_storage_mb) > 1e-6
+                )
+                .values(used_storage_mb=actual.c.used_storage_mb)
+            )
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
 
-        total_size_bytes = sum(version.size for version in all_versions)
-        actual_used_storage_mb = total_size_bytes / (1024 * 1024)
+        if result.rowcount:
+            if username is not None:
+                user_cache.invalidate(username)
+            else:
+                user_cache.clear()
 
-        result = await self.db.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
+        return result.rowcount
 
-        if user:
-            user.used_storage_mb = actual_used_storage_mb
-            self.db.add(user)
-            await self.db.commit()
+    def _blob_key(self, sha256: str) -> str:
+        """
+        Klucz obiektu z treścią o danym skrócie SHA-256 w buckecie użytkownika
+        """
+        return f"blobs/{sha256}"
+
+    def _key_from_path(self, path: str) -> str:
+        """
+        Klucz obiektu z FileVersion.path (s3://bucket/key) - dla blobów i wersji z własnym obiektem
+        """
+        return path.split("/", 3)[3]
+
+    @staticmethod
+    def _hash_file(fileobj) -> Tuple[str, int]:
+        fileobj.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        while chunk := fileobj.read(BLOB_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+        fileobj.seek(0)
+        return digest.hexdigest(), size
+
+    @classmethod
+    def _analyze_file(cls, fileobj) -> ChunkedFile:
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        if settings.CHUNKED_STORAGE_ENABLED and size >= settings.CHUNKED_STORAGE_MIN_FILE_SIZE:
+            return chunk_file(
+                fileobj,
+                settings.CHUNK_MIN_SIZE,
+                settings.CHUNK_AVG_SIZE,
+                settings.CHUNK_MAX_SIZE
+            )
+        sha256, size = cls._hash_file(fileobj)
+        return ChunkedFile(sha256, size, [])
+
+    async def _analyze_upload(self, file: UploadFile) -> ChunkedFile:
+        """
+        Liczy SHA-256 i rozmiar przesłanego pliku (już zapisanego lokalnie przez FastAPI)
+        w wątku, bez blokowania pętli zdarzeń. Przy włączonym CHUNKED_STORAGE_ENABLED duże pliki
+        są dodatkowo dzielone na kawałki (content-defined chunking) - wtedy chunks nie jest puste.
+        Granice kawałków liczone są wektorowo w numpy, które zwalnia GIL na czas obliczeń
+        """
+        return await asyncio.to_thread(self._analyze_file, file.file)
+
+    async def _store_blob(self, file: UploadFile, bucket_name: str, sha256: str, max_bytes: int):
+        await file.seek(0)
+        try:
+            await self._upload_to_bucket(file, bucket_name, self._blob_key(sha256), max_bytes)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise ValueError(f"Failed to upload file: {str(e)}")
 
-        return actual_used_storage_mb
+    async def _read_chunk(self, file: UploadFile, chunk: Chunk) -> bytes:
+        await file.seek(chunk.offset)
+        return await file.read(chunk.size)
 
-    def _build_versioned_filename(self, original_filename: str, version_number: int) -> str:
+    async def _store_chunk(self, file: UploadFile, bucket_name: str, chunk: Chunk):
+        body = await self._read_chunk(file, chunk)
+        await object_store.put_object(Bucket=bucket_name, Key=self._blob_key(chunk.sha256), Body=body)
+
+    async def _store_chunks(self, file: UploadFile, bucket_name: str, chunks: List[Chunk]):
+        """
+        Wysyła kawałki do S3 (maks. S3_TRANSFER_CONCURRENCY naraz). Plik czytany jest po kolei,
+        więc w pamięci jest tylko kilka kawałków
+        """
+        concurrency = max(settings.S3_TRANSFER_CONCURRENCY, 1)
+        pending = set()
+        try:
+            for chunk in chunks:
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+
+                body = await self._read_chunk(file, chunk)
+                pending.add(asyncio.create_task(
+                    object_store.put_object(Bucket=bucket_name, Key=self._blob_key(chunk.sha256), Body=body)
+                ))
+
+            await asyncio.gather(*pending)
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+
+    async def _reference_blobs(
+            self,
+            username: str,
+            blobs: List[Tuple[str, int, int]],
+            store: Callable[[str], Awaitable[None]] = None
+    ) -> Dict[str, UUID]:
+        """
+        Zwiększa liczniki odwołań blobów (sha256, rozmiar, liczba odwołań) jednym upsertem,
+        w transakcji wywołującego; brakujące bloby są tworzone. Polityka limitu: użytkownik
+        płaci za każdy blob raz - przy przejściu ref_count 0 -> n, niezależnie od liczby wersji
+        i plików, które go współdzielą.
+        `store(sha256)` wgrywa treść bloba, który powstał na nowo, choć wywołujący uznał go
+        za już przechowywany (został zwolniony i usunięty z S3 między sprawdzeniem a tą transakcją).
+        Zwraca id blobów wg sha256.
         """
-        Tworzy nazwę pliku z numerem wersji: filename_v1.txt
+        if not blobs:
+            return {}
+
+        now = datetime.now(timezone.utc)
+        # Stała kolejność blokowania wierszy - równoległe uploady nie zakleszczą się
+        blobs = sorted(blobs)
+        insert_stmt = pg_insert(Blob)
+        result = await self.db.execute(
+            insert_stmt
+            .values([
+                {
+                    "id": uuid4(),
+                    "owner": username,
+                    "sha256": sha256,
+                    "size": size,
+                    "ref_count": count,
+                    "created_at": now
+                }
+                for sha256, size, count in blobs
+            ])
+            .on_conflict_do_update(
+                constraint="uq_blobs_owner_sha256",
+                set_={"ref_count": Blob.ref_count + insert_stmt.excluded.ref_count}
+            )
+            .returning(Blob.id, Blob.sha256, Blob.size, Blob.ref_count)
+        )
+        rows = result.all()
+
+        counts = {sha256: count for sha256, _, count in blobs}
+        added_bytes = 0
+        for row in rows:
+            if row.ref_count == counts[row.sha256]:
+                if store is not None:
+                    await store(row.sha256)
+                added_bytes += row.size
+        if added_bytes:
+            await self._apply_storage_delta(username, added_bytes)
+
+        return {row.sha256: row.id for row in rows}
+
+    async def _release_blobs(self, username: str, blob_ids: List[UUID]) -> List[UUID]:
+        """
+        Zmniejsza liczniki odwołań blobów usuwanych wersji (wersje muszą być już usunięte
+        i zapisane przez flush). Rozmiar blobów bez odwołań zwalnia limit użytkownika.
+        Zwraca ich id - treść usuwa _delete_released_blobs dopiero po zatwierdzeniu transakcji.
         """
-        name, ext = os.path.splitext(original_filename)
-        return f"{name}_v{version_number}{ext}"
+        if not blob_ids:
+            return []
+
+        counts = Counter(blob_ids)
+        # Stała kolejność blokowania wierszy - równoległe usuwanie nie zakleszczy się
+        await self.db.execute(
+            select(Blob.id).where(Blob.id.in_(counts)).order_by(Blob.id).with_for_update()
+        )
+
+        released = []
+        # Jedno UPDATE na każdą różną liczbę odwołań (zwykle wszystkie bloby tracą po jednym)
+        ids_by_count = {}
+        for blob_id, count in counts.items():
+            ids_by_count.setdefault(count, []).append(blob_id)
+        for count, ids in ids_by_count.items():
+            result = await self.db.execute(
+                update(Blob)
+                .where(Blob.id.in_(ids))
+                .values(ref_count=Blob.ref_count - count)
+                .returning(Blob.id, Blob.sha256, Blob.size, Blob.ref_count)
+            )
+            released.extend(blob for blob in result.all() if blob.ref_count <= 0)
+
+        if released:
+            await self._apply_storage_delta(username, -sum(blob.size for blob in released))
+        return [blob.id for blob in released]
+
+    async def _delete_released_blobs(self, bucket_name: str, blob_ids: List[UUID]):
+        """
+        Usuwa z S3 i z bazy bloby zwolnione przez _release_blobs. Wywoływane po zatwierdzeniu
+        transakcji, która je zwolniła - gdyby commit się nie udał, wersje wskazywałyby na usuniętą
+        treść. Bloby ponownie użyte w międzyczasie (ref_count > 0) są pomijane. Obiekt usuwany
+        jest, gdy wiersz bloba jest zablokowany, więc równoległy upload tej samej treści poczeka
+        i wgra ją ponownie. Przy błędzie wiersz z ref_count = 0 po prostu zostaje.
+        """
+        if not blob_ids:
+            return
+
+        try:
+            # Stała kolejność blokowania wierszy - równoległe usuwanie nie zakleszczy się
+            result = await self.db.execute(
+                select(Blob.id, Blob.sha256)
+                .where(Blob.id.in_(blob_ids), Blob.ref_count <= 0)
+                .order_by(Blob.id)
+                .with_for_update()
+            )
+            deleted_ids = []
+            for blob in result.all():
+                try:
+                    await object_store.delete_object(Bucket=bucket_name, Key=self._blob_key(blob.sha256))
+                except Exception as e:
+                    print(f"Warning: Failed to delete blob {blob.sha256} from S3: {str(e)}")
+                    continue
+                deleted_ids.append(blob.id)
+            if deleted_ids:
+                await self.db.execute(delete(Blob).where(Blob.id.in_(deleted_ids)))
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            print(f"Warning: Failed to delete released blobs: {str(e)}")
+
+    async def _load_chunks(self, version_ids: List[UUID]) -> Dict[UUID, List[Chunk]]:
+        """
+        Kawałki (w kolejności) wersji zapisanych w kawałkach, jednym zapytaniem
+        """
+        if not version_ids:
+            return {}
+
+        result = await self.db.execute(
+            select(FileVersionChunk.version_id, FileVersionChunk.offset, FileVersionChunk.size, Blob.sha256)
+            .join(Blob, Blob.id == FileVersionChunk.blob_id)
+            .where(FileVersionChunk.version_id.in_(version_ids))
+            .order_by(FileVersionChunk.version_id, FileVersionChunk.position)
+        )
+        chunks = {version_id: [] for version_id in version_ids}
+        for version_id, offset, size, sha256 in result.all():
+            chunks[version_id].append(Chunk(offset, size, sha256))
+        return chunks
+
+    async def _chunk_blob_ids(self, version_ids: List[UUID]) -> List[UUID]:
+        """
+        Bloby kawałków wersji (po jednym na każde wystąpienie kawałka) - do zwolnienia przy usuwaniu
+        """
+        if not version_ids:
+            return []
+
+        result = await self.db.execute(
+            select(FileVersionChunk.blob_id).where(FileVersionChunk.version_id.in_(version_ids))
+        )
+        return list(result.scalars().all())
+
+    async def _read_chunk_object(
+            self,
+            bucket_name: str,
+            chunk: Chunk,
+            chunk_range: Optional[Tuple[int, int]]
+    ) -> bytes:
+        parts = await object_store.open_object(bucket_name, self._blob_key(chunk.sha256), chunk_range)
+        try:
+            return b"".join([part async for part in parts])
+        finally:
+            await parts.aclose()
+
+    async def _iter_chunks(
+            self,
+            bucket_name: str,
+            chunks: List[Chunk],
+            byte_range: Optional[Tuple[int, int]] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Składa wersję z kawałków na bieżąco. Kawałki (lub ich części, gdy pobierany jest zakres
+        bajtów) pobierane są z wyprzedzeniem, maks. S3_TRANSFER_CONCURRENCY naraz - kolejne GET-y
+        trwają, gdy poprzedni kawałek jest wysyłany, a w pamięci jest najwyżej tyle kawałków
+        """
+        start, end = byte_range if byte_range is not None else (0, None)
+        read_ahead = max(settings.S3_TRANSFER_CONCURRENCY, 1)
+        pending = deque()
+        try:
+            for chunk in chunks:
+                chunk_end = chunk.offset + chunk.size - 1
+                if chunk_end < start:
+                    continue
+                if end is not None and chunk.offset > end:
+                    break
+
+                first = max(start, chunk.offset) - chunk.offset
+                last = (chunk_end if end is None else min(end, chunk_end)) - chunk.offset
+                chunk_range = None if first == 0 and last == chunk.size - 1 else (first, last)
+
+                if len(pending) >= read_ahead:
+                    yield await pending.popleft()
+                pending.append(asyncio.create_task(self._read_chunk_object(bucket_name, chunk, chunk_range)))
+
+            while pending:
+                yield await pending.popleft()
+        finally:
+            # Przerwane pobieranie (np. klient się rozłączył) - pobrane z wyprzedzeniem kawałki przepadają
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _iter_version(
+            self,
+            bucket_name: str,
+            version: FileVersion,
+            chunks: Optional[List[Chunk]] = None,
+            byte_range: Optional[Tuple[int, int]] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Leniwy strumień treści wersji (lub zakresu bajtów) - z jednego obiektu albo z kawałków
+        """
+        if version.is_chunked:
+            return self._iter_chunks(bucket_name, chunks, byte_range)
+        return object_store.iter_object(bucket_name, self._key_from_path(version.path), byte_range)
+
+    async def _open_version(
+            self,
+            bucket_name: str,
+            version: FileVersion,
+            chunks: Optional[List[Chunk]] = None,
+            byte_range: Optional[Tuple[int, int]] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Jak _iter_version, ale obiekt pojedynczej wersji jest pobierany od razu,
+        więc błędy S3 pojawiają się przed wysłaniem odpowiedzi
+        """
+        if version.is_chunked:
+            return self._iter_chunks(bucket_name, chunks, byte_range)
+        return await object_store.open_object(bucket_name, self._key_from_path(version.path), byte_range)
 
     def _parse_base_filename(self, filename: str) -> str:
         """
@@ -71,219 +452,1586 @@ class FileService:
                 return f"{parts[0]}{ext}"
         return filename
 
-    async def upload_file(self, file: UploadFile, username: str, ip_address: str = None) -> dict:
+    def _quota_exceeded_error(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Uploading this file would exceed your storage quota."
+        )
+
+    async def _upload_part(
+            self,
+            bucket_name: str,
+            file_key: str,
+            upload_id: str,
+            part_number: int,
+            body: Union[bytes, BinaryIO]
+    ) -> dict:
+        response = await object_store.upload_part(
+            Bucket=bucket_name,
+            Key=file_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    async def _copy_part(
+            self,
+            bucket_name: str,
+            source_key: str,
+            file_key: str,
+            upload_id: str,
+            part_number: int,
+            byte_range: Tuple[int, int]
+    ) -> dict:
+        response = await object_store.upload_part_copy(
+            Bucket=bucket_name,
+            Key=file_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={"Bucket": bucket_name, "Key": source_key},
+            CopySourceRange=f"bytes={byte_range[0]}-{byte_range[1]}"
+        )
+        return {"ETag": response["CopyPartResult"]["ETag"], "PartNumber": part_number}
+
+    async def _copy_object(self, bucket_name: str, source_key: str, file_key: str, size: int):
+        """
+        Kopiuje obiekt w buckecie po stronie S3. Obiekty większe niż S3_MAX_COPY_SIZE kopiowane są
+        uploadem multipart z częściami upload_part_copy (maks. S3_TRANSFER_CONCURRENCY naraz)
+        """
+        if size <= S3_MAX_COPY_SIZE:
+            await object_store.copy_object(
+                Bucket=bucket_name,
+                Key=file_key,
+                CopySource={"Bucket": bucket_name, "Key": source_key}
+            )
+            return
+
+        part_size = max(S3_COPY_PART_SIZE, -(-size // S3_MAX_PARTS))
+        upload = await object_store.create_multipart_upload(Bucket=bucket_name, Key=file_key)
+        upload_id = upload["UploadId"]
+        concurrency = max(settings.S3_TRANSFER_CONCURRENCY, 1)
+        parts = []
+        pending = set()
+        try:
+            for part_number, start in enumerate(range(0, size, part_size), start=1):
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    parts.extend(task.result() for task in done)
+
+                pending.add(asyncio.create_task(self._copy_part(
+                    bucket_name, source_key, file_key, upload_id, part_number, (start, min(start + part_size, size) - 1)
+                )))
+
+            parts.extend(await asyncio.gather(*pending))
+            pending = set()
+
+            await object_store.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=file_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])}
+            )
+        except BaseException:
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                await object_store.abort_multipart_upload(Bucket=bucket_name, Key=file_key, UploadId=upload_id)
+            except Exception as e:
+                print(f"Warning: Failed to abort multipart copy {upload_id}: {str(e)}")
+            raise
+
+    async def _stream_upload_to_s3(self, file: UploadFile, bucket_name: str, file_key: str, max_bytes: int) -> int:
+        """
+        Wysyła plik do S3 strumieniowo. Pliki mniejsze niż S3_MULTIPART_THRESHOLD idą jednym PUT,
+        większe - częściami multipart o rozmiarze S3_MULTIPART_CHUNK_SIZE, wysyłanymi równolegle
+        (maks. S3_TRANSFER_CONCURRENCY naraz), więc w pamięci trzymanych jest tylko kilka części.
+        Liczy bajty w trakcie przesyłania i przerywa upload multipart po przekroczeniu max_bytes.
+        Zwraca rozmiar pliku w bajtach.
+        """
+        part_size = settings.S3_MULTIPART_CHUNK_SIZE
+        threshold = max(settings.S3_MULTIPART_THRESHOLD, 1)
+        concurrency = max(settings.S3_TRANSFER_CONCURRENCY, 1)
+
+        head = await file.read(threshold)
+        if len(head) > max_bytes:
+            raise self._quota_exceeded_error()
+
+        if len(head) < threshold:
+            # Plik mniejszy niż próg multipart - wystarczy zwykły PUT
+            await object_store.put_object(Bucket=bucket_name, Key=file_key, Body=head)
+            return len(head)
+
+        upload = await object_store.create_multipart_upload(Bucket=bucket_name, Key=file_key)
+        upload_id = upload["UploadId"]
+        buffer = bytearray(head)
+        pending = set()
+        parts = []
+        part_number = 0
+        total_size = 0
+        eof = False
+
+        try:
+            while buffer or not eof:
+                while len(buffer) < part_size and not eof:
+                    data = await file.read(part_size - len(buffer))
+                    if not data:
+                        eof = True
+                    buffer += data
+
+                if not buffer:
+                    break
+
+                part = bytes(buffer[:part_size])
+                del buffer[:part_size]
+
+                total_size += len(part)
+                if total_size > max_bytes:
+                    raise self._quota_exceeded_error()
+
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    parts.extend(task.result() for task in done)
+
+                part_number += 1
+                pending.add(asyncio.create_task(
+                    self._upload_part(bucket_name, file_key, upload_id, part_number, part)
+                ))
+
+            parts.extend(await asyncio.gather(*pending))
+            pending = set()
+
+            await object_store.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=file_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])}
+            )
+        except BaseException:
+            # Poczekaj na wysyłane części, żeby abort nie ścigał się z upload_part
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                await object_store.abort_multipart_upload(Bucket=bucket_name, Key=file_key, UploadId=upload_id)
+            except Exception as e:
+                print(f"Warning: Failed to abort multipart upload {upload_id}: {str(e)}")
+            raise
+
+        return total_size
+
+    async def _upload_to_bucket(self, file: UploadFile, bucket_name: str, file_key: str, max_bytes: int) -> int:
+        """
+        Upload z jedną ponowną próbą, jeśli bucket z cache został usunięty poza aplikacją
+        """
+        try:
+            return await self._stream_upload_to_s3(file, bucket_name, file_key, max_bytes)
+        except ClientError as e:
+            if not is_bucket_missing_error(e):
+                raise
+            await ensure_bucket_exists(bucket_name)
+            await file.seek(0)
+            return await self._stream_upload_to_s3(file, bucket_name, file_key, max_bytes)
+
+    def _content_blobs(self, content: ChunkedFile) -> Tuple[Dict[str, Chunk], Counter]:
+        """
+        Różne bloby treści (wg sha256) i liczba odwołań do każdego z nich. Treść bez kawałków
+        to jeden blob z całym plikiem
+        """
+        if not content.chunks:
+            return {content.sha256: Chunk(0, content.size, content.sha256)}, Counter({content.sha256: 1})
+
+        blobs = {}
+        counts = Counter()
+        for chunk in content.chunks:
+            blobs.setdefault(chunk.sha256, chunk)
+            counts[chunk.sha256] += 1
+        return blobs, counts
+
+    def _content_path(self, bucket_name: str, content: ChunkedFile) -> str:
+        if content.chunks:
+            # Wersja nie ma jednego obiektu w S3 - składana jest z kawałków (file_version_chunks)
+            return f"chunked://{bucket_name}/{content.sha256}"
+        return f"s3://{bucket_name}/{self._blob_key(content.sha256)}"
+
+    async def _attach_content(
+            self,
+            version: FileVersion,
+            username: str,
+            content: ChunkedFile,
+            store: Callable[[str], Awaitable[None]] = None
+    ):
+        """
+        Dodaje wersję wraz z odwołaniami do blobów jej treści (i listą kawałków) w transakcji wywołującego
+        """
+        blobs, counts = self._content_blobs(content)
+        blob_ids = await self._reference_blobs(
+            username,
+            [(blob_sha256, blob.size, counts[blob_sha256]) for blob_sha256, blob in blobs.items()],
+            store
+        )
+        version.is_chunked = bool(content.chunks)
+        version.blob_id = None if content.chunks else blob_ids[content.sha256]
+        self.db.add(version)
+        if content.chunks:
+            await self.db.flush()
+            self.db.add_all(
+                FileVersionChunk(
+                    version_id=version.id,
+                    position=position,
+                    blob_id=blob_ids[chunk.sha256],
+                    offset=chunk.offset,
+                    size=chunk.size
+                )
+                for position, chunk in enumerate(content.chunks)
+            )
+
+    async def _find_stored_content(self, username: str, sha256: str, size: int) -> Optional[ChunkedFile]:
+        """
+        Szuka treści o danym SHA-256 i rozmiarze wśród plików użytkownika: jako bloba
+        albo jako wersji zapisanej w kawałkach. Zwraca treść gotową do _attach_content
+        """
+        result = await self.db.execute(
+            select(Blob.id).where(
+                Blob.owner == username,
+                Blob.sha256 == sha256,
+                Blob.size == size,
+                Blob.ref_count > 0
+            )
+        )
+        if result.scalar_one_or_none() is not None:
+            return ChunkedFile(sha256, size, [])
+
+        result = await self.db.execute(
+            select(FileVersion.id).join(
+                FileStorage, FileVersion.file_id == FileStorage.id
+            ).where(
+                FileStorage.owner == username,
+                FileVersion.is_chunked.is_(True),
+                FileVersion.path == f"chunked://user-{username}/{sha256}",
+                FileVersion.size == size
+            ).limit(1)
+        )
+        version_id = result.scalar_one_or_none()
+        if version_id is None:
+            return None
+
+        chunks = (await self._load_chunks([version_id]))[version_id]
+        return ChunkedFile(sha256, size, chunks)
+
+    async def _lock_content(self, username: str, content: ChunkedFile) -> bool:
+        """
+        Blokuje (do końca transakcji) bloby treści i sprawdza, że wciąż są przechowywane -
+        równoległe usunięcie ostatniej wersji nie zwolni ich, zanim nowa wersja się do nich odwoła
+        """
+        blobs, _ = self._content_blobs(content)
+        result = await self.db.execute(
+            select(Blob.sha256).where(
+                Blob.owner == username,
+                Blob.sha256.in_(blobs),
+                Blob.ref_count > 0
+            ).order_by(Blob.id).with_for_update()
+        )
+        return len(set(result.scalars().all())) == len(blobs)
+
+    async def _save_version(
+            self,
+            username: str,
+            filename: str,
+            size: int,
+            path: str,
+            attach: Callable[[FileVersion], Awaitable[None]]
+    ) -> Tuple[FileStorage, FileVersion, bool]:
+        """
+        Tworzy kolejną wersję pliku o danej nazwie (albo nowy plik z pierwszą wersją) i zatwierdza
+        transakcję. `attach(version)` dodaje wersję z odwołaniami do jej treści w tej samej transakcji.
+        Zwraca (plik, wersja, czy plik został utworzony)
+        """
+        # Sprawdź czy plik o tej nazwie już istnieje - blokada wiersza pliku do końca transakcji,
+        # żeby równoległe uploady tego samego pliku nie nadały wersjom tego samego numeru
+        existing_file_query = select(FileStorage).where(
+            FileStorage.owner == username,
+            FileStorage.name == filename
+        ).with_for_update()
+        result = await self.db.execute(existing_file_query)
+        existing_file = result.scalar_one_or_none()
+
+        if existing_file:
+            # Plik istnieje - tworzymy nową wersję
+            # Znajdź najwyższy numer wersji
+            versions_query = select(FileVersion).where(
+                FileVersion.file_id == existing_file.id
+            ).order_by(FileVersion.version_number.desc())
+            result = await self.db.execute(versions_query)
+            versions = result.scalars().all()
+
+            new_version_number = max([v.version_number for v in versions]) + 1 if versions else existing_file.current_version + 1
+
+            try:
+                # Utwórz nową wersję w bazie
+                new_version = FileVersion(
+                    id=uuid4(),
+                    file_id=existing_file.id,
+                    version_number=new_version_number,
+                    path=path,
+                    size=size,
+                    created_at=datetime.now(timezone.utc),
+                    created_by=username
+                )
+                await attach(new_version)
+
+                # Zaktualizuj current_version i size w FileStorage
+                existing_file.current_version = new_version_number
+                existing_file.size = size
+                existing_file.updated_at = datetime.now(timezone.utc)
+                self.db.add(existing_file)
+
+                await self.db.commit()
+                await self.db.refresh(new_version)
+            except HTTPException:
+                await self.db.rollback()
+                raise
+            except Exception as e:
+                await self.db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Database error: {str(e)}",
+                )
+
+            return existing_file, new_version, False
+
+        # Nowy plik - tworzymy pierwszą wersję
+        version_number = 1
+
+        # Utwórz nowy rekord FileStorage
+        new_file = FileStorage(
+            id=uuid4(),
+            path=path,
+            name=filename,
+            size=size,
+            owner=username,
+            current_version=version_number,
+            created_at=datetime.now(timezone.utc),
+            updated_at=datetime.now(timezone.utc)
+        )
+
+        # Utwórz pierwszą wersję
+        first_version = FileVersion(
+            id=uuid4(),
+            file_id=new_file.id,
+            version_number=version_number,
+            path=path,
+            size=size,
+            created_at=datetime.now(timezone.utc),
+            created_by=username
+        )
+
+        try:
+            self.db.add(new_file)
+            await attach(first_version)
+            await self.db.commit()
+            await self.db.refresh(new_file)
+        except IntegrityError:
+            await self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="File with the same name already exists in the database.",
+            )
+        except HTTPException:
+            await self.db.rollback()
+            raise
+        except Exception as e:
+            await self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Database error: {str(e)}",
+            )
+
+        return new_file, first_version, True
+
+    async def _get_upload_session(
+            self,
+            upload_session_id: str,
+            username: str,
+            for_update: bool = False
+    ) -> UploadSession:
+        query = select(UploadSession).where(
+            UploadSession.id == _str_to_uuid(upload_session_id),
+            UploadSession.owner == username,
+            UploadSession.expires_at > datetime.now(timezone.utc)
+        )
+        if for_update:
+            query = query.with_for_update().execution_options(populate_existing=True)
+        result = await self.db.execute(query)
+        upload_session = result.scalar_one_or_none()
+        if not upload_session:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Upload session not found or expired"
+            )
+        return upload_session
+
+    async def negotiate_upload(
+            self,
+            filename: str,
+            size: int,
+            sha256: str,
+            username: str,
+            ip_address: str = None
+    ) -> dict:
+        """
+        Negocjacja przed wysłaniem pliku - klient podaje nazwę, rozmiar i SHA-256 treści:
+        - "exists": użytkownik już przechowuje tę treść - nowa wersja pliku zostaje utworzona
+          od razu (tylko metadane), pliku nie trzeba wysyłać,
+        - "quota_exceeded": plik nie zmieści się w limicie,
+        - "upload": trzeba wysłać treść - na /files/upload z podanym upload_session_id.
+        """
+        try:
+            sha256 = sha256.lower()
+            base_filename = self._parse_base_filename(filename)
+            bucket_name = f"user-{username}"
+
+            # Aktualna wersja pliku ma już tę treść - nic nie trzeba tworzyć
+            result = await self.db.execute(
+                select(FileStorage, FileVersion).join(
+                    FileVersion,
+                    and_(
+                        FileVersion.file_id == FileStorage.id,
+                        FileVersion.version_number == FileStorage.current_version
+                    )
+                ).where(
+                    FileStorage.owner == username,
+                    FileStorage.name == base_filename
+                )
+            )
+            current = result.one_or_none()
+            if current is not None:
+                file_record, version = current
+                content_paths = (
+                    self._content_path(bucket_name, ChunkedFile(sha256, size, [])),
+                    f"chunked://{bucket_name}/{sha256}"
+                )
+                if version.size == size and version.path in content_paths:
+                    await self.log_service.log_action(
+                        action=LogAction.FILE_UPLOAD_NEGOTIATE,
+                        username=username,
+                        status="SUCCESS",
+                        file_id=file_record.id,
+                        details={
+                            "filename": base_filename,
+                            "size": size,
+                            "sha256": sha256,
+                            "up_to_date": True,
+                            "ip_address": ip_address
+                        }
+                    )
+                    return {
+                        "status": "exists",
+                        "message": "File is already up to date",
+                        "file_id": str(file_record.id),
+                        "filename": base_filename,
+                        "version": version.version_number,
+                        "size": size,
+                        "path": version.path
+                    }
+
+            content = await self._find_stored_content(username, sha256, size)
+            if content is not None and await self._lock_content(username, content):
+                file_record, version, created = await self._save_version(
+                    username,
+                    base_filename,
+                    size,
+                    self._content_path(bucket_name, content),
+                    lambda new_version: self._attach_content(new_version, username, content)
+                )
+
+                await self.log_service.log_action(
+                    action=LogAction.FILE_UPLOAD,
+                    username=username,
+                    status="SUCCESS",
+                    file_id=file_record.id,
+                    details={
+                        "version": version.version_number,
+                        "size": size,
+                        "path": version.path,
+                        "sha256": sha256,
+                        "deduplicated": True,
+                        "stored_bytes": 0,
+                        "negotiated": True,
+                        "ip_address": ip_address
+                    }
+                )
+
+                return {
+                    "status": "exists",
+                    "message": "File uploaded successfully" if created else "New version uploaded successfully",
+                    "file_id": str(file_record.id),
+                    "filename": base_filename,
+                    "version": version.version_number,
+                    "size": size,
+                    "path": version.path
+                }
+            # Zwolnij ewentualne blokady blobów, których treść zniknęła w międzyczasie
+            await self.db.rollback()
+
+            result = await self.db.execute(select(User).where(User.username == username))
+            user = result.scalar_one_or_none()
+            available_bytes = int((user.max_storage_mb - user.used_storage_mb) * 1024 * 1024)
+
+            # Plik zapisywany w kawałkach może zająć mniej niż size (znane kawałki nie są liczone) -
+            # wtedy decyzję o limicie podejmuje dopiero upload
+            chunked = settings.CHUNKED_STORAGE_ENABLED and size >= settings.CHUNKED_STORAGE_MIN_FILE_SIZE
+            if size > available_bytes and not chunked:
+                await self.log_service.log_action(
+                    action=LogAction.FILE_UPLOAD_NEGOTIATE,
+                    username=username,
+                    status="FAILED",
+                    details={
+                        "filename": base_filename,
+                        "size": size,
+                        "sha256": sha256,
+                        "error": "quota_exceeded",
+                        "ip_address": ip_address
+                    }
+                )
+                return {
+                    "status": "quota_exceeded",
+                    "message": self._quota_exceeded_error().detail,
+                    "size": size,
+                    "available_bytes": max(available_bytes, 0)
+                }
+
+            now = datetime.now(timezone.utc)
+            upload_session = UploadSession(
+                id=uuid4(),
+                owner=username,
+                filename=base_filename,
+                size=size,
+                sha256=sha256,
+                created_at=now,
+                expires_at=now + timedelta(seconds=settings.UPLOAD_SESSION_TTL_S)
+            )
+            try:
+                self.db.add(upload_session)
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Database error: {str(e)}",
+                )
+
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD_NEGOTIATE,
+                username=username,
+                status="SUCCESS",
+                details={
+                    "filename": base_filename,
+                    "size": size,
+                    "sha256": sha256,
+                    "upload_session_id": str(upload_session.id),
+                    "ip_address": ip_address
+                }
+            )
+
+            return {
+                "status": "upload",
+                "upload_session_id": str(upload_session.id),
+                "expires_at": upload_session.expires_at
+            }
+        except Exception as e:
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD_NEGOTIATE,
+                username=username,
+                status="FAILED",
+                details={
+                    "error": str(e),
+                    "ip_address": ip_address
+                },
+            )
+            raise
+
+    async def upload_file(
+            self,
+            file: UploadFile,
+            username: str,
+            ip_address: str = None,
+            upload_session_id: str = None
+    ) -> dict:
+        """
+        Upload pliku jako nowy plik lub kolejna wersja istniejącego. Z upload_session_id
+        (z negotiate_upload) nazwa pochodzi z sesji, a treść musi zgadzać się z zadeklarowanym
+        rozmiarem i SHA-256; sesja jest zużywana w tej samej transakcji co tworzona wersja
+        """
         try:
+            upload_session = None
+            if upload_session_id is not None:
+                upload_session = await self._get_upload_session(upload_session_id, username)
+                if upload_session.upload_id is not None or upload_session.direct_upload:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="Upload session is already being uploaded - finalize it instead"
+                    )
+
             result = await self.db.execute(select(User).where(User.username == username))
             user = result.scalar_one_or_none()
 
-            file_content = await file.read()
-            file_size = len(file_content)
+            # Ile bajtów użytkownik może jeszcze zapisać - egzekwowane w trakcie streamingu
+            available_bytes = int((user.max_storage_mb - user.used_storage_mb) * 1024 * 1024)
+
+            # Treść identyfikowana skrótem - jeśli użytkownik już ją przechowuje,
+            # upload jest tylko operacją na metadanych (bez transferu do S3 i bez zużycia limitu).
+            # Plik zapisany w kawałkach to zbiór blobów - wysyłane są tylko nieznane kawałki
+            content = await self._analyze_upload(file)
+            sha256, file_size = content.sha256, content.size
 
-            if (user.used_storage_mb + file_size / (1024 * 1024)) > user.max_storage_mb:
+            if upload_session is not None and (
+                    upload_session.size != file_size
+                    or (upload_session.sha256 is not None and upload_session.sha256 != sha256)
+            ):
                 raise HTTPException(
-                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                    detail="Uploading this file would exceed your storage quota."
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Uploaded content does not match the size and SHA-256 declared for the upload session"
+                )
+
+            blobs, _ = self._content_blobs(content)
+            result = await self.db.execute(
+                select(Blob.sha256).where(
+                    Blob.owner == username,
+                    Blob.sha256.in_(blobs),
+                    Blob.ref_count > 0
+                )
+            )
+            stored_blobs = set(result.scalars().all())
+            missing_blobs = [blob for blob_sha256, blob in blobs.items() if blob_sha256 not in stored_blobs]
+            new_bytes = sum(blob.size for blob in missing_blobs)
+            content_stored = not missing_blobs
+
+            if new_bytes > available_bytes:
+                raise self._quota_exceeded_error()
+
+            if upload_session is not None:
+                base_filename = upload_session.filename
+            else:
+                base_filename = self._parse_base_filename(file.filename)
+
+            bucket_name = f"user-{username}"
+            await ensure_bucket_exists(bucket_name)
+
+            if content.chunks:
+                await self._store_chunks(file, bucket_name, missing_blobs)
+            elif missing_blobs:
+                await self._store_blob(file, bucket_name, sha256, available_bytes)
+            uploaded = {blob.sha256 for blob in missing_blobs}
+
+            async def store(blob_sha256: str):
+                if blob_sha256 in uploaded:
+                    return
+                if content.chunks:
+                    await self._store_chunk(file, bucket_name, blobs[blob_sha256])
+                else:
+                    await self._store_blob(file, bucket_name, blob_sha256, file_size)
+
+            async def attach(version: FileVersion):
+                await self._attach_content(version, username, content, store)
+                if upload_session is not None:
+                    await self.db.delete(upload_session)
+
+            file_record, version, created = await self._save_version(
+                username, base_filename, file_size, self._content_path(bucket_name, content), attach
+            )
+
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD,
+                username=username,
+                status="SUCCESS",
+                file_id=file_record.id,
+                details={
+                    "version": version.version_number,
+                    "size": file_size,
+                    "path": version.path,
+                    "sha256": sha256,
+                    "deduplicated": content_stored,
+                    "stored_bytes": new_bytes,
+                    "ip_address": ip_address
+                }
+            )
+
+            return {
+                "message": "File uploaded successfully" if created else "New version uploaded successfully",
+                "file_id": str(file_record.id),
+                "filename": base_filename,
+                "version": version.version_number,
+                "size": file_size,
+                "path": version.path
+            }
+        except Exception as e:
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD,
+                username=username,
+                status="FAILED",
+                details={
+                    "error": str(e),
+                    "ip_address": ip_address
+                },
+            )
+            raise
+
+    def _staging_key(self, upload_session: UploadSession) -> str:
+        """
+        Klucz obiektu, w którym składany jest upload wznawialny (do finalizacji)
+        """
+        return f"uploads/{upload_session.id}"
+
+    def _version_object_key(self) -> str:
+        """
+        Nowy klucz własnego obiektu wersji (treść uploadu bezpośredniego) - klient nie ma
+        do niego podpisanego URL-a, więc po finalizacji nie może już podmienić treści
+        """
+        return f"versions/{uuid4()}"
+
+    def _upload_session_status(self, upload_session: UploadSession) -> dict:
+        return {
+            "upload_session_id": str(upload_session.id),
+            "filename": upload_session.filename,
+            "size": upload_session.size,
+            "committed_offset": upload_session.committed_offset,
+            "min_chunk_size": S3_MIN_PART_SIZE,
+            "max_chunk_size": settings.UPLOAD_CHUNK_MAX_SIZE,
+            "expires_at": upload_session.expires_at
+        }
+
+    async def _discard_upload_session_content(self, upload_session: UploadSession):
+        """
+        Usuwa z S3 wszystko, co zostało przesłane w ramach sesji (niedokończony multipart
+        albo złożony już obiekt). Błędy są tylko logowane - sesja i tak jest usuwana
+        """
+        bucket_name = f"user-{upload_session.owner}"
+        staging_key = self._staging_key(upload_session)
+        if upload_session.upload_id is not None:
+            try:
+                await object_store.abort_multipart_upload(
+                    Bucket=bucket_name, Key=staging_key, UploadId=upload_session.upload_id
+                )
+            except ClientError as e:
+                # NoSuchUpload - upload został już złożony (finalizacja) albo przerwany
+                if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                    print(f"Warning: Failed to abort upload of session {upload_session.id}: {str(e)}")
+            except Exception as e:
+                print(f"Warning: Failed to abort upload of session {upload_session.id}: {str(e)}")
+        try:
+            await object_store.delete_object(Bucket=bucket_name, Key=staging_key)
+        except Exception as e:
+            print(f"Warning: Failed to delete staged upload of session {upload_session.id}: {str(e)}")
+
+    async def create_upload_session(
+            self,
+            filename: str,
+            size: int,
+            username: str,
+            sha256: str = None,
+            ip_address: str = None
+    ) -> dict:
+        """
+        Rozpoczyna upload wznawialny: klient wysyła kolejne kawałki (upload_chunk), w razie
+        przerwania pyta o committed_offset (get_upload_session) i kontynuuje od niego,
+        a na końcu wywołuje finalize_upload_session
+        """
+        try:
+            result = await self.db.execute(select(User).where(User.username == username))
+            user = result.scalar_one_or_none()
+            available_bytes = int((user.max_storage_mb - user.used_storage_mb) * 1024 * 1024)
+
+            # Jak w negotiate_upload - plik zapisywany w kawałkach może zająć mniej niż size
+            chunked = settings.CHUNKED_STORAGE_ENABLED and size >= settings.CHUNKED_STORAGE_MIN_FILE_SIZE
+            if size > available_bytes and not chunked:
+                raise self._quota_exceeded_error()
+
+            now = datetime.now(timezone.utc)
+            upload_session = UploadSession(
+                id=uuid4(),
+                owner=username,
+                filename=self._parse_base_filename(filename),
+                size=size,
+                sha256=sha256.lower() if sha256 else None,
+                created_at=now,
+                expires_at=now + timedelta(seconds=settings.UPLOAD_SESSION_TTL_S),
+                committed_offset=0
+            )
+            try:
+                self.db.add(upload_session)
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Database error: {str(e)}",
+                )
+
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD_SESSION_CREATE,
+                username=username,
+                status="SUCCESS",
+                details={
+                    "upload_session_id": str(upload_session.id),
+                    "filename": upload_session.filename,
+                    "size": size,
+                    "ip_address": ip_address
+                }
+            )
+
+            return self._upload_session_status(upload_session)
+        except Exception as e:
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD_SESSION_CREATE,
+                username=username,
+                status="FAILED",
+                details={
+                    "error": str(e),
+                    "ip_address": ip_address
+                },
+            )
+            raise
+
+    async def get_upload_session(self, upload_session_id: str, username: str) -> dict:
+        upload_session = await self._get_upload_session(upload_session_id, username)
+        return self._upload_session_status(upload_session)
+
+    async def upload_chunk(
+            self,
+            upload_session_id: str,
+            offset: int,
+            body: AsyncIterator[bytes],
+            username: str
+    ) -> dict:
+        """
+        Przyjmuje kawałek uploadu wznawialnego zaczynający się od `offset` - musi to być
+        committed_offset sesji. Każdy kawałek to jedna część uploadu multipart w S3, więc
+        musi mieć co najmniej 5 MiB (poza ostatnim) i najwyżej UPLOAD_CHUNK_MAX_SIZE.
+        Numer części rezerwowany jest blokadą wiersza sesji (SELECT ... FOR UPDATE) trzymaną
+        do zapisania części, więc równoległe żądania dla tej samej sesji nie nadpiszą sobie
+        części w S3 - kolejne czeka, a potem dostaje 409 z powodu nieaktualnego offsetu.
+        """
+        # Treść kawałka czytana przed otwarciem transakcji (przesyłanie może trwać długo)
+        # do pliku tymczasowego - w pamięci trzymane jest najwyżej CHUNK_SPOOL_MAX_MEMORY bajtów
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SPOOL_MAX_MEMORY) as chunk:
+            chunk_size = 0
+            async for data in body:
+                chunk_size += len(data)
+                if chunk_size > settings.UPLOAD_CHUNK_MAX_SIZE:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Chunk exceeds the maximum of {settings.UPLOAD_CHUNK_MAX_SIZE} bytes"
+                    )
+                await asyncio.to_thread(chunk.write, data)
+            chunk.seek(0)
+
+            upload_session = await self._get_upload_session(upload_session_id, username)
+            self._check_chunk(upload_session, offset, chunk_size)
+            # Skrót treści liczony kawałek po kawałku (przed blokadą sesji) - finalizacja
+            # nie musi pobierać złożonego obiektu z S3
+            hash_state = await asyncio.to_thread(self._next_hash_state, upload_session, chunk)
+
+            bucket_name = f"user-{username}"
+            staging_key = self._staging_key(upload_session)
+            if upload_session.upload_id is None:
+                await ensure_bucket_exists(bucket_name)
+                upload = await object_store.create_multipart_upload(Bucket=bucket_name, Key=staging_key)
+                result = await self.db.execute(
+                    update(UploadSession)
+                    .where(UploadSession.id == upload_session.id, UploadSession.upload_id.is_(None))
+                    .values(upload_id=upload["UploadId"])
+                )
+                await self.db.commit()
+                if not result.rowcount:
+                    # Równoległe żądanie utworzyło upload pierwsze - użyj jego
+                    await object_store.abort_multipart_upload(
+                        Bucket=bucket_name, Key=staging_key, UploadId=upload["UploadId"]
+                    )
+
+            try:
+                # Blokada sesji do końca transakcji - stan sprawdzany ponownie pod blokadą
+                upload_session = await self._get_upload_session(upload_session_id, username, for_update=True)
+                self._check_chunk(upload_session, offset, chunk_size)
+
+                result = await self.db.execute(
+                    select(func.count()).select_from(UploadSessionPart).where(
+                        UploadSessionPart.session_id == upload_session.id
+                    )
+                )
+                part_number = result.scalar_one() + 1
+                if part_number > S3_MAX_PARTS:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Upload cannot have more than {S3_MAX_PARTS} chunks"
+                    )
+
+                part = await self._upload_part(bucket_name, staging_key, upload_session.upload_id, part_number, chunk)
+
+                upload_session.committed_offset = offset + chunk_size
+                upload_session.hash_state = hash_state
+                upload_session.expires_at = datetime.now(timezone.utc) + timedelta(seconds=settings.UPLOAD_SESSION_TTL_S)
+                self.db.add(UploadSessionPart(
+                    session_id=upload_session.id,
+                    part_number=part_number,
+                    etag=part["ETag"],
+                    size=chunk_size
+                ))
+                await self.db.commit()
+            except HTTPException:
+                await self.db.rollback()
+                raise
+            except Exception as e:
+                await self.db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to store chunk: {str(e)}",
+                )
+
+        await self.db.refresh(upload_session)
+        return self._upload_session_status(upload_session)
+
+    def _check_chunk(self, upload_session: UploadSession, offset: int, chunk_size: int):
+        if upload_session.direct_upload:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload session is being uploaded directly to storage - finalize it instead"
+            )
+        if offset != upload_session.committed_offset:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Chunk offset {offset} does not match the committed offset {upload_session.committed_offset}"
+            )
+
+        end_offset = offset + chunk_size
+        if end_offset > upload_session.size:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Chunk ends past the declared file size of {upload_session.size} bytes"
+            )
+        if not chunk_size or (chunk_size < S3_MIN_PART_SIZE and end_offset < upload_session.size):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Chunks must have at least {S3_MIN_PART_SIZE} bytes, except the last one"
+            )
+
+    @staticmethod
+    def _next_hash_state(upload_session: UploadSession, chunk: BinaryIO) -> Optional[bytes]:
+        """
+        Stan SHA-256 sesji po dopisaniu kawałka (czytanego od początku). None, gdy skrót
+        policzy dopiero finalizacja: bez libcrypto albo dla sesji, która ma już kawałki, ale nie stan
+        """
+        if not sha256_state.available:
+            return None
+        if upload_session.committed_offset == 0:
+            state = sha256_state.initial_state()
+        elif upload_session.hash_state is not None:
+            state = upload_session.hash_state
+        else:
+            return None
+        chunk.seek(0)
+        state = sha256_state.update_state(state, chunk)
+        chunk.seek(0)
+        return state
+
+    async def _hash_object(self, bucket_name: str, key: str) -> str:
+        digest = hashlib.sha256()
+        parts = object_store.iter_object(bucket_name, key)
+        try:
+            async for part in parts:
+                await asyncio.to_thread(digest.update, part)
+        finally:
+            await parts.aclose()
+        return digest.hexdigest()
+
+    async def finalize_upload_session(self, upload_session_id: str, username: str, ip_address: str = None) -> dict:
+        """
+        Kończy upload wznawialny: składa części w S3, bierze SHA-256 policzony z kawałków
+        (albo liczy go ze złożonego obiektu) i zapisuje obiekt jako blob (albo odwołuje się do już przechowywanej treści). FileStorage /
+        FileVersion powstają w jednej transakcji z usunięciem sesji. Ponowienie po błędzie
+        (np. zerwanym połączeniu) jest bezpieczne - już złożony obiekt jest używany ponownie.
+        Uploady wysłane bezpośrednio do MinIO kończy _finalize_direct_upload
+        """
+        try:
+            # Blokada sesji do końca transakcji - cleanup_expired_upload_sessions i anulowanie
+            # nie usuną obiektu uploads/<id>, z którego kopiowana jest treść wersji, a presign_upload
+            # nie wyda nowych URL-i do niego
+            upload_session = await self._get_upload_session(upload_session_id, username, for_update=True)
+            if upload_session.direct_upload:
+                return await self._finalize_direct_upload(upload_session, username, ip_address)
+            if upload_session.upload_id is None or upload_session.committed_offset != upload_session.size:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Upload is incomplete: {upload_session.committed_offset} of {upload_session.size} bytes received"
+                )
+
+            result = await self.db.execute(
+                select(UploadSessionPart)
+                .where(UploadSessionPart.session_id == upload_session.id)
+                .order_by(UploadSessionPart.part_number)
+            )
+            parts = result.scalars().all()
+
+            bucket_name = f"user-{username}"
+            staging_key = self._staging_key(upload_session)
+            try:
+                await object_store.complete_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=staging_key,
+                    UploadId=upload_session.upload_id,
+                    MultipartUpload={"Parts": [{"ETag": part.etag, "PartNumber": part.part_number} for part in parts]}
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                    raise
+                # Upload złożony przy poprzedniej próbie finalizacji
+                head = await object_store.head_object(Bucket=bucket_name, Key=staging_key)
+                if head["ContentLength"] != upload_session.size:
+                    raise
+
+            if upload_session.hash_state is not None and sha256_state.available:
+                sha256 = sha256_state.hexdigest(upload_session.hash_state)
+            else:
+                sha256 = await self._hash_object(bucket_name, staging_key)
+            if upload_session.sha256 is not None and upload_session.sha256 != sha256:
+                await self._discard_upload_session_content(upload_session)
+                await self.db.delete(upload_session)
+                await self.db.commit()
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Uploaded content does not match the SHA-256 declared for the upload session"
+                )
+
+            size = upload_session.size
+            content = ChunkedFile(sha256, size, [])
+            result = await self.db.execute(
+                select(Blob.id).where(
+                    Blob.owner == username,
+                    Blob.sha256 == sha256,
+                    Blob.ref_count > 0
+                )
+            )
+            content_stored = result.scalar_one_or_none() is not None
+
+            async def store(blob_sha256: str):
+                await self._copy_object(bucket_name, staging_key, self._blob_key(blob_sha256), size)
+
+            if not content_stored:
+                result = await self.db.execute(select(User).where(User.username == username))
+                user = result.scalar_one_or_none()
+                available_bytes = int((user.max_storage_mb - user.used_storage_mb) * 1024 * 1024)
+                if size > available_bytes:
+                    # Sesja zostaje - po zwolnieniu miejsca finalizację można ponowić
+                    raise self._quota_exceeded_error()
+                await store(sha256)
+
+            async def attach(version: FileVersion):
+                await self._attach_content(version, username, content, None if content_stored else store)
+                await self.db.delete(upload_session)
+
+            file_record, version, created = await self._save_version(
+                username, upload_session.filename, size, self._content_path(bucket_name, content), attach
+            )
+
+            try:
+                await object_store.delete_object(Bucket=bucket_name, Key=staging_key)
+            except Exception as e:
+                # Sesji już nie ma - obiekt zostanie w buckecie, ale nie jest liczony do limitu
+                print(f"Warning: Failed to delete staged upload {staging_key}: {str(e)}")
+
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD,
+                username=username,
+                status="SUCCESS",
+                file_id=file_record.id,
+                details={
+                    "version": version.version_number,
+                    "size": size,
+                    "path": version.path,
+                    "sha256": sha256,
+                    "deduplicated": content_stored,
+                    "stored_bytes": 0 if content_stored else size,
+                    "upload_session_id": upload_session_id,
+                    "chunks": len(parts),
+                    "ip_address": ip_address
+                }
+            )
+
+            return {
+                "message": "File uploaded successfully" if created else "New version uploaded successfully",
+                "file_id": str(file_record.id),
+                "filename": file_record.name,
+                "version": version.version_number,
+                "size": size,
+                "path": version.path
+            }
+        except Exception as e:
+            # Zwalnia blokadę sesji, jeśli finalizacja przerwała się przed zatwierdzeniem
+            await self.db.rollback()
+            await self.log_service.log_action(
+                action=LogAction.FILE_UPLOAD,
+                username=username,
+                status="FAILED",
+                details={
+                    "error": str(e),
+                    "upload_session_id": upload_session_id,
+                    "ip_address": ip_address
+                },
+            )
+            raise
+
+    def _direct_part_size(self, size: int) -> int:
+        # Części co najmniej S3_MULTIPART_CHUNK_SIZE, ale nie więcej niż S3_MAX_PARTS części
+        return max(settings.S3_MULTIPART_CHUNK_SIZE, S3_MIN_PART_SIZE, -(-size // S3_MAX_PARTS))
+
+    async def presign_upload(self, upload_session_id: str, username: str) -> dict:
+        """
+        Podpisane URL-e do wysłania treści sesji bezpośrednio do MinIO (z pominięciem API).
+        Pliki od S3_MULTIPART_THRESHOLD wysyłane są multipartem - URL dla każdej części.
+        Ponowne wywołanie (np. po wygaśnięciu URL-i) zwraca nowe URL-e dla tego samego uploadu.
+        Po wysłaniu klient wywołuje finalize_upload_session. Blokada sesji (jak przy finalizacji)
+        sprawia, że po finalizacji, która usuwa sesję, nowych URL-i już nie ma
+        """
+        upload_session = await self._get_upload_session(upload_session_id, username, for_update=True)
+        if not upload_session.direct_upload and (
+                upload_session.upload_id is not None or upload_session.committed_offset
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload session is being uploaded in chunks through the API"
+            )
+
+        bucket_name = f"user-{username}"
+        staging_key = self._staging_key(upload_session)
+        size = upload_session.size
+        multipart = size >= max(settings.S3_MULTIPART_THRESHOLD, 1)
+        await ensure_bucket_exists(bucket_name)
+
+        if multipart and upload_session.upload_id is None:
+            upload = await object_store.create_multipart_upload(Bucket=bucket_name, Key=staging_key)
+            result = await self.db.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload_session.id, UploadSession.upload_id.is_(None))
+                .values(upload_id=upload["UploadId"], direct_upload=True)
+            )
+            await self.db.commit()
+            if not result.rowcount:
+                # Równoległe żądanie utworzyło upload pierwsze - użyj jego
+                await object_store.abort_multipart_upload(
+                    Bucket=bucket_name, Key=staging_key, UploadId=upload["UploadId"]
+                )
+            await self.db.refresh(upload_session)
+            if not upload_session.direct_upload:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Upload session is being uploaded in chunks through the API"
+                )
+        elif not upload_session.direct_upload:
+            upload_session.direct_upload = True
+            await self.db.commit()
+            await self.db.refresh(upload_session)
+
+        expires_in = settings.PRESIGNED_URL_EXPIRES_S
+        response = {
+            "upload_session_id": str(upload_session.id),
+            "method": "PUT",
+            "multipart": multipart,
+            "url_expires_in": expires_in,
+            "expires_at": upload_session.expires_at
+        }
+
+        if not multipart:
+            response["url"] = generate_presigned_url(
+                "put_object", {"Bucket": bucket_name, "Key": staging_key}, expires_in
+            )
+            return response
+
+        part_size = self._direct_part_size(size)
+        response["part_size"] = part_size
+        response["parts"] = [
+            {
+                "part_number": part_number,
+                "offset": offset,
+                "size": min(part_size, size - offset),
+                "url": generate_presigned_url(
+                    "upload_part",
+                    {
+                        "Bucket": bucket_name,
+                        "Key": staging_key,
+                        "UploadId": upload_session.upload_id,
+                        "PartNumber": part_number
+                    },
+                    expires_in
+                )
+            }
+            for part_number, offset in enumerate(range(0, size, part_size), start=1)
+        ]
+        return response
+
+    async def _list_uploaded_parts(self, bucket_name: str, key: str, upload_id: str) -> Optional[List[dict]]:
+        """
+        Części wysłane do uploadu multipart (wg S3, nie klienta); None, jeśli upload został już złożony
+        """
+        parts = []
+        params = {"Bucket": bucket_name, "Key": key, "UploadId": upload_id}
+        while True:
+            try:
+                response = await object_store.list_parts(**params)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                    return None
+                raise
+            parts.extend(
+                {"PartNumber": part["PartNumber"], "ETag": part["ETag"], "Size": part["Size"]}
+                for part in response.get("Parts", [])
+            )
+            if not response.get("IsTruncated"):
+                return parts
+            params["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+    async def _finalize_direct_upload(self, upload_session: UploadSession, username: str, ip_address: str = None) -> dict:
+        """
+        Finalizacja uploadu wysłanego bezpośrednio do MinIO: składa multipart (jeśli był),
+        kopiuje obiekt pod klucz versions/<uuid>, sprawdza rozmiar kopii i zapisuje wersję,
+        a na końcu usuwa uploads/<id>. Treść nie przechodzi przez API, więc nie jest haszowana -
+        wersja ma własny obiekt i zajmuje limit jak wersje sprzed deduplikacji.
+        Deduplikację zapewnia negotiate_upload
+        """
+        bucket_name = f"user-{username}"
+        staging_key = self._staging_key(upload_session)
+        size = upload_session.size
+
+        if upload_session.upload_id is not None:
+            parts = await self._list_uploaded_parts(bucket_name, staging_key, upload_session.upload_id)
+            if parts is not None:
+                expected_parts = -(-size // self._direct_part_size(size))
+                part_numbers = sorted(part["PartNumber"] for part in parts)
+                if part_numbers != list(range(1, expected_parts + 1)) or sum(part["Size"] for part in parts) != size:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail=f"Upload is incomplete: {len(parts)} of {expected_parts} parts received"
+                    )
+                await object_store.complete_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=staging_key,
+                    UploadId=upload_session.upload_id,
+                    MultipartUpload={"Parts": [
+                        {"ETag": part["ETag"], "PartNumber": part["PartNumber"]}
+                        for part in sorted(parts, key=lambda p: p["PartNumber"])
+                    ]}
                 )
 
-            # Sprawdź czy plik o tej nazwie już istnieje
-            base_filename = self._parse_base_filename(file.filename)
-            existing_file_query = select(FileStorage).where(
-                FileStorage.owner == username,
-                FileStorage.name == base_filename
+        try:
+            head = await object_store.head_object(Bucket=bucket_name, Key=staging_key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="File has not been uploaded yet"
             )
-            result = await self.db.execute(existing_file_query)
-            existing_file = result.scalar_one_or_none()
 
-            bucket_name = f"user-{username}"
-            ensure_bucket_exists(bucket_name)
+        async def reject_size(uploaded_size: int):
+            await self._discard_upload_session_content(upload_session)
+            await self.db.delete(upload_session)
+            await self.db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Uploaded object has {uploaded_size} bytes, but {upload_session.size} bytes were declared"
+            )
 
-            if existing_file:
-                # Plik istnieje - tworzymy nową wersję
-                # Znajdź najwyższy numer wersji
-                versions_query = select(FileVersion).where(
-                    FileVersion.file_id == existing_file.id
-                ).order_by(FileVersion.version_number.desc())
-                result = await self.db.execute(versions_query)
-                versions = result.scalars().all()
+        if head["ContentLength"] != size:
+            await reject_size(head["ContentLength"])
 
-                new_version_number = max([v.version_number for v in versions]) + 1 if versions else existing_file.current_version + 1
+        # Podpisane URL-e wskazują uploads/<id> i są ważne jeszcze po finalizacji - wersja dostaje
+        # kopię pod nowym kluczem, a rozmiar (do limitu) brany jest z kopii, nie z obiektu klienta
+        content_key = self._version_object_key()
+        await self._copy_object(bucket_name, staging_key, content_key, size)
+        try:
+            size = (await object_store.head_object(Bucket=bucket_name, Key=content_key))["ContentLength"]
+            if size != upload_session.size:
+                await reject_size(size)
 
-                # Utwórz nazwę pliku z wersją
-                versioned_filename = self._build_versioned_filename(base_filename, new_version_number)
-                file_key = versioned_filename
+            result = await self.db.execute(select(User).where(User.username == username))
+            user = result.scalar_one_or_none()
+            available_bytes = int((user.max_storage_mb - user.used_storage_mb) * 1024 * 1024)
+            if size > available_bytes:
+                # Sesja zostaje - po zwolnieniu miejsca finalizację można ponowić
+                raise self._quota_exceeded_error()
+
+            async def attach(version: FileVersion):
+                self.db.add(version)
+                await self._apply_storage_delta(username, size)
+                await self.db.delete(upload_session)
+
+            file_record, version, created = await self._save_version(
+                username, upload_session.filename, size, f"s3://{bucket_name}/{content_key}", attach
+            )
+        except BaseException:
+            try:
+                await object_store.delete_object(Bucket=bucket_name, Key=content_key)
+            except Exception as e:
+                print(f"Warning: Failed to delete copied upload {content_key}: {str(e)}")
+            raise
 
-                # Upload do S3
-                try:
-                    s3.upload_fileobj(BytesIO(file_content), bucket_name, file_key)
-                except Exception as e:
-                    raise ValueError(f"Failed to upload file: {str(e)}")
+        try:
+            await object_store.delete_object(Bucket=bucket_name, Key=staging_key)
+        except Exception as e:
+            # Sesji już nie ma - obiekt zostanie w buckecie, ale nie jest liczony do limitu
+            print(f"Warning: Failed to delete staged upload {staging_key}: {str(e)}")
+
+        await self.log_service.log_action(
+            action=LogAction.FILE_UPLOAD,
+            username=username,
+            status="SUCCESS",
+            file_id=file_record.id,
+            details={
+                "version": version.version_number,
+                "size": size,
+                "path": version.path,
+                "sha256": upload_session.sha256,
+                "deduplicated": False,
+                "stored_bytes": size,
+                "upload_session_id": str(upload_session.id),
+                "direct_upload": True,
+                "ip_address": ip_address
+            }
+        )
+
+        return {
+            "message": "File uploaded successfully" if created else "New version uploaded successfully",
+            "file_id": str(file_record.id),
+            "filename": file_record.name,
+            "version": version.version_number,
+            "size": size,
+            "path": version.path
+        }
+
+    async def presign_download(
+            self,
+            file_id: str,
+            username: str,
+            version_number: int = None,
+            ip_address: str = None
+    ) -> dict:
+        """
+        Podpisany URL do pobrania wersji pliku (domyślnie aktualnej) bezpośrednio z MinIO.
+        Wersje zapisane w kawałkach nie mają jednego obiektu - pobiera się je przez API
+        """
+        try:
+            file_uuid = _str_to_uuid(file_id)
 
-                # Utwórz nową wersję w bazie
-                new_version = FileVersion(
-                    id=uuid4(),
-                    file_id=existing_file.id,
-                    version_number=new_version_number,
-                    path=f"s3://{bucket_name}/{file_key}",
-                    size=file_size,
-                    created_at=datetime.now(timezone.utc),
-                    created_by=username
+            result = await self.db.execute(
+                select(FileStorage).where(
+                    FileStorage.id == file_uuid,
+                    FileStorage.owner == username
                 )
+            )
+            file_record = result.scalar_one_or_none()
 
-                try:
-                    self.db.add(new_version)
-
-                    # Zaktualizuj current_version i size w FileStorage
-                    existing_file.current_version = new_version_number
-                    existing_file.size = file_size
-                    existing_file.updated_at = datetime.now(timezone.utc)
-                    self.db.add(existing_file)
-
-                    await self.db.commit()
-                    await self.db.refresh(new_version)
-                except Exception as e:
-                    await self.db.rollback()
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Database error: {str(e)}",
-                    )
-
-                # Przelicz rzeczywiste wykorzystanie miejsca
-                try:
-                    await self._recalculate_user_storage(username)
-                except Exception as e:
-                    await self.db.rollback()
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Failed to update user storage usage: {str(e)}",
-                    )
-
-                await self.log_service.log_action(
-                    action=LogAction.FILE_UPLOAD,
-                    username=username,
-                    status="SUCCESS",
-                    file_id=existing_file.id,
-                    details={
-                        "version": new_version_number,
-                        "size": file_size,
-                        "path": new_version.path,
-                        "ip_address": ip_address
-                    }
+            if not file_record:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="File not found or you don't have permission to access it"
                 )
 
-                return {
-                    "message": "New version uploaded successfully",
-                    "file_id": str(existing_file.id),
-                    "filename": base_filename,
-                    "version": new_version_number,
-                    "size": file_size,
-                    "path": new_version.path
-                }
-
-            else:
-                # Nowy plik - tworzymy pierwszą wersję
-                version_number = 1
-                versioned_filename = self._build_versioned_filename(base_filename, version_number)
-                file_key = versioned_filename
-
-                # Upload do S3
-                try:
-                    s3.upload_fileobj(BytesIO(file_content), bucket_name, file_key)
-                except Exception as e:
-                    raise ValueError(f"Failed to upload file: {str(e)}")
+            if version_number is None:
+                version_number = file_record.current_version
 
-                # Utwórz nowy rekord FileStorage
-                new_file = FileStorage(
-                    id=uuid4(),
-                    path=f"s3://{bucket_name}/{file_key}",
-                    name=base_filename,
-                    size=file_size,
-                    owner=username,
-                    current_version=version_number,
-                    created_at=datetime.now(timezone.utc),
-                    updated_at=datetime.now(timezone.utc)
+            result = await self.db.execute(
+                select(FileVersion).where(
+                    FileVersion.file_id == file_record.id,
+                    FileVersion.version_number == version_number
                 )
+            )
+            version = result.scalar_one_or_none()
 
-                # Utwórz pierwszą wersję
-                first_version = FileVersion(
-                    id=uuid4(),
-                    file_id=new_file.id,
-                    version_number=version_number,
-                    path=f"s3://{bucket_name}/{file_key}",
-                    size=file_size,
-                    created_at=datetime.now(timezone.utc),
-                    created_by=username
+            if not version:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Version {version_number} not found"
                 )
 
-                try:
-                    self.db.add(new_file)
-                    self.db.add(first_version)
-                    await self.db.commit()
-                    await self.db.refresh(new_file)
-                except IntegrityError:
-                    await self.db.rollback()
-                    raise HTTPException(
-                        status_code=status.HTTP_409_CONFLICT,
-                        detail="File with the same name already exists in the database.",
-                    )
-                except Exception as e:
-                    await self.db.rollback()
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Database error: {str(e)}",
-                    )
-
-                # Przelicz rzeczywiste wykorzystanie miejsca
-                try:
-                    await self._recalculate_user_storage(username)
-                except Exception as e:
-                    await self.db.rollback()
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Failed to update user storage usage: {str(e)}",
-                    )
-
-                await self.log_service.log_action(
-                    action=LogAction.FILE_UPLOAD,
-                    username=username,
-                    status="SUCCESS",
-                    file_id=new_file.id,
-                    details={
-                        "version": version_number,
-                        "size": file_size,
-                        "path": new_file.path,
-                        "ip_address": ip_address
-                    }
+            if version.is_chunked:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="This version is stored in chunks and can only be downloaded through the API"
                 )
 
-                return {
-                    "message": "File uploaded successfully",
-                    "file_id": str(new_file.id),
-                    "filename": base_filename,
+            expires_in = settings.PRESIGNED_URL_EXPIRES_S
+            url = generate_presigned_url(
+                "get_object",
+                {
+                    "Bucket": f"user-{username}",
+                    "Key": self._key_from_path(version.path),
+                    "ResponseContentDisposition": f"attachment; filename*=UTF-8''{quote(file_record.name)}"
+                },
+                expires_in
+            )
+
+            await self.log_service.log_action(
+                action=LogAction.FILE_DOWNLOAD,
+                username=username,
+                status="SUCCESS",
+                file_id=file_record.id,
+                details={
                     "version": version_number,
-                    "size": file_size,
-                    "path": new_file.path
+                    "size": version.size,
+                    "presigned": True,
+                    "ip_address": ip_address
                 }
+            )
+
+            return {
+                "url": url,
+                "filename": file_record.name,
+                "version": version_number,
+                "size": version.size,
+                "url_expires_in": expires_in
+            }
         except Exception as e:
             await self.log_service.log_action(
-                action=LogAction.FILE_UPLOAD,
+                action=LogAction.FILE_DOWNLOAD,
                 username=username,
                 status="FAILED",
+                file_id=file_id,
                 details={
                     "error": str(e),
+                    "presigned": True,
                     "ip_address": ip_address
-                },
+                }
             )
             raise
 
-    async def list_files(self, username: str) -> List[FileItem]:
+    async def cancel_upload_session(self, upload_session_id: str, username: str) -> dict:
+        upload_session = await self._get_upload_session(upload_session_id, username, for_update=True)
+        await self._discard_upload_session_content(upload_session)
+        try:
+            await self.db.delete(upload_session)
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Database error: {str(e)}",
+            )
+        return {"message": "Upload session cancelled", "upload_session_id": upload_session_id}
+
+    async def cleanup_expired_upload_sessions(self, batch_size: int = 500) -> int:
+        """
+        Usuwa wygasłe sesje uploadu razem z ich niedokończonymi uploadami multipart
+        (zadanie w tle). Zwraca liczbę usuniętych sesji.
+        Sesje zablokowane przez trwającą finalizację, dosyłanie części albo anulowanie są pomijane
+        (skip_locked) - treść usuwana jest tylko dla sesji zablokowanych tutaj i nadal wygasłych
+        """
+        removed = 0
+        while True:
+            now = datetime.now(timezone.utc)
+            result = await self.db.execute(
+                select(UploadSession)
+                .where(UploadSession.expires_at <= now)
+                .order_by(UploadSession.expires_at)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+                .execution_options(populate_existing=True)
+            )
+            locked = result.scalars().all()
+            if not locked:
+                await self.db.rollback()
+                return removed
+
+            expired = [upload_session for upload_session in locked if upload_session.expires_at <= now]
+            if not expired:
+                await self.db.rollback()
+                return removed
+
+            for upload_session in expired:
+                await self._discard_upload_session_content(upload_session)
+            await self.db.execute(
+                delete(UploadSession).where(
+                    UploadSession.id.in_([upload_session.id for upload_session in expired])
+                )
+            )
+            await self.db.commit()
+            removed += len(expired)
+
+            if len(locked) < batch_size:
+                return removed
+
+    def _encode_cursor(self, sort: str, order: str, file_record: FileStorage) -> str:
+        value = getattr(file_record, sort)
+        payload = {
+            "sort": sort,
+            "order": order,
+            "value": value.isoformat() if isinstance(value, datetime) else value,
+            "id": str(file_record.id),
+        }
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def _decode_cursor(self, cursor: str, sort: str, order: str) -> tuple:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if payload["sort"] != sort or payload["order"] != order:
+                raise ValueError("cursor was issued for a different sort order")
+            value = datetime.fromisoformat(payload["value"]) if sort == "updated_at" else str(payload["value"])
+            return value, UUID(payload["id"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid cursor: {str(e)}"
+            )
+
+    async def list_files(
+            self,
+            username: str,
+            limit: int = 100,
+            cursor: str = None,
+            sort: str = "updated_at",
+            order: str = "desc",
+            is_favorite: bool = None,
+            name_prefix: str = None
+    ) -> dict:
+        """
+        Zwraca jedną stronę plików użytkownika (paginacja keyset po (sort, id)),
+        więc czas odpowiedzi nie zależy od liczby plików.
+        sort: "updated_at" lub "name", order: "asc" lub "desc"
+        """
         try:
-            result = await self.db.execute(select(FileStorage).where(FileStorage.owner == username))
+            sort_column = FileStorage.updated_at if sort == "updated_at" else FileStorage.name
+
+            query = select(FileStorage).where(FileStorage.owner == username)
+
+            if is_favorite is not None:
+                query = query.where(FileStorage.is_favorite.is_(is_favorite))
+
+            if name_prefix:
+                query = query.where(FileStorage.name.startswith(name_prefix, autoescape=True))
+
+            if cursor:
+                last_value, last_id = self._decode_cursor(cursor, sort, order)
+                keyset = tuple_(sort_column, FileStorage.id)
+                if order == "desc":
+                    query = query.where(keyset < tuple_(last_value, last_id))
+                else:
+                    query = query.where(keyset > tuple_(last_value, last_id))
+
+            if order == "desc":
+                query = query.order_by(sort_column.desc(), FileStorage.id.desc())
+            else:
+                query = query.order_by(sort_column.asc(), FileStorage.id.asc())
+
+            # Jeden rekord więcej, żeby wiedzieć czy istnieje następna strona
+            result = await self.read_db.execute(query.limit(limit + 1))
             files = result.scalars().all()
 
-            if not files:
-                return []
+            next_cursor = None
+            if len(files) > limit:
+                files = files[:limit]
+                next_cursor = self._encode_cursor(sort, order, files[-1])
 
-            return [FileItem.model_validate(file) for file in files]
+            return {
+                "files": [FileItem.model_validate(file) for file in files],
+                "next_cursor": next_cursor
+            }
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -292,59 +2040,73 @@ class FileService:
 
     async def get_user_storage_info(self, username: str) -> dict:
         """
-        Pobiera statystyki przechowywania plików użytkownika
+        Pobiera statystyki przechowywania plików użytkownika.
+        Wszystkie liczniki i sumy liczone są po stronie bazy jednym zapytaniem,
+        endpoint jest tylko do odczytu (korekty used_storage_mb robi reconcile_storage)
         """
         try:
-            result = await self.db.execute(select(User).where(User.username == username))
-            user = result.scalar_one_or_none()
+            files_stats = select(
+                func.count(FileStorage.id).label("total_files"),
+                func.coalesce(func.sum(FileStorage.size), 0).label("total_size_bytes"),
+                func.count(FileStorage.id).filter(FileStorage.is_favorite.is_(True)).label("total_favorite_files")
+            ).where(FileStorage.owner == username).subquery()
+
+            versions_stats = select(
+                func.count(FileVersion.id).label("total_versions"),
+                func.coalesce(func.sum(FileVersion.size), 0).label("total_versions_size_bytes"),
+                func.coalesce(
+                    func.sum(FileVersion.size).filter(
+                        FileVersion.blob_id.is_(None), FileVersion.is_chunked.is_(False)
+                    ), 0
+                ).label("legacy_versions_size_bytes")
+            ).join(
+                FileStorage, FileVersion.file_id == FileStorage.id
+            ).where(FileStorage.owner == username).subquery()
+
+            # Treść przechowywana po deduplikacji - każdy blob liczony raz
+            blobs_stats = select(
+                func.count(Blob.id).label("total_blobs"),
+                func.coalesce(func.sum(Blob.size), 0).label("blobs_size_bytes")
+            ).where(Blob.owner == username, Blob.ref_count > 0).subquery()
+
+            result = await self.read_db.execute(
+                select(User.max_storage_mb, files_stats, versions_stats, blobs_stats)
+                .select_from(User)
+                .join(files_stats, true())
+                .join(versions_stats, true())
+                .join(blobs_stats, true())
+                .where(User.username == username)
+            )
+            stats = result.one_or_none()
 
-            if not user:
+            if not stats:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="User not found"
                 )
 
-            result = await self.db.execute(select(FileStorage).where(FileStorage.owner == username))
-            files = result.scalars().all()
-
-            total_files = len(files)
-            total_size_bytes = sum(file.size for file in files)
-
-            all_versions_query = select(FileVersion).join(
-                FileStorage, FileVersion.file_id == FileStorage.id
-            ).where(FileStorage.owner == username)
-            result = await self.db.execute(all_versions_query)
-            all_versions = result.scalars().all()
-
-            total_versions = len(all_versions)
-            total_versions_size_bytes = sum(version.size for version in all_versions)
-
-            actual_used_storage_mb = total_versions_size_bytes / (1024 * 1024)
-
-            if abs(user.used_storage_mb - actual_used_storage_mb) > 0.01:
-                user.used_storage_mb = actual_used_storage_mb
-                try:
-                    self.db.add(user)
-                    await self.db.commit()
-                except Exception as e:
-                    await self.db.rollback()
+            total_size_bytes = int(stats.total_size_bytes)
+            total_versions_size_bytes = int(stats.total_versions_size_bytes)
+            stored_size_bytes = int(stats.blobs_size_bytes) + int(stats.legacy_versions_size_bytes)
+            max_storage_mb = stats.max_storage_mb
 
-            favorite_files = [file for file in files if file.is_favorite]
-            total_favorite_files = len(favorite_files)
+            actual_used_storage_mb = stored_size_bytes / (1024 * 1024)
 
             return {
                 "username": username,
-                "total_files": total_files,
+                "total_files": stats.total_files,
                 "total_size_bytes": total_size_bytes,
                 "total_size_mb": round(total_size_bytes / (1024 * 1024), 2),
-                "max_storage_mb": user.max_storage_mb,
+                "max_storage_mb": max_storage_mb,
                 "used_storage_mb": round(actual_used_storage_mb, 2),
-                "available_storage_mb": round(user.max_storage_mb - actual_used_storage_mb, 2),
-                "storage_usage_percentage": round((actual_used_storage_mb / user.max_storage_mb) * 100, 2) if user.max_storage_mb > 0 else 0,
-                "total_favorite_files": total_favorite_files,
-                "total_versions": total_versions,
+                "available_storage_mb": round(max_storage_mb - actual_used_storage_mb, 2),
+                "storage_usage_percentage": round((actual_used_storage_mb / max_storage_mb) * 100, 2) if max_storage_mb > 0 else 0,
+                "total_favorite_files": stats.total_favorite_files,
+                "total_versions": stats.total_versions,
                 "total_versions_size_bytes": total_versions_size_bytes,
-                "total_versions_size_mb": round(total_versions_size_bytes / (1024 * 1024), 2)
+                "total_versions_size_mb": round(total_versions_size_bytes / (1024 * 1024), 2),
+                "total_blobs": stats.total_blobs,
+                "deduplicated_bytes": total_versions_size_bytes - stored_size_bytes
             }
         except HTTPException:
             raise
@@ -354,7 +2116,101 @@ class FileService:
                 detail=f"Error fetching storage info: {str(e)}",
             )
 
-    async def download_file(self, file_id: str, username: str, ip_address: str = None):
+    async def _build_download(
+            self,
+            bucket_name: str,
+            filename: str,
+            version: FileVersion,
+            range_header: Optional[str] = None,
+            if_range: Optional[str] = None
+    ) -> dict:
+        """
+        Przygotowuje pobieranie wersji pliku z obsługą nagłówków Range/If-Range.
+        Każdy zakres mapowany jest na osobne get_object z nagłówkiem Range, więc
+        wznowienie pobierania nie przesyła ponownie z S3 już pobranych bajtów
+        (wersja w kawałkach pobiera tylko kawałki pokrywające zakres).
+        Wersje są niezmienne, więc ETag to id wersji.
+        """
+        file_size = version.size
+        chunks = (await self._load_chunks([version.id]))[version.id] if version.is_chunked else None
+        etag = f'"{version.id}"'
+        headers = {"Accept-Ranges": "bytes", "ETag": etag}
+        if version.created_at:
+            headers["Last-Modified"] = format_datetime(version.created_at.astimezone(timezone.utc), usegmt=True)
+
+        ranges = None
+        if range_header and if_range_matches(if_range, etag, version.created_at):
+            ranges = parse_range_header(range_header, file_size)
+
+        download = {
+            "filename": filename,
+            "headers": headers,
+            "ranges": ranges,
+            "media_type": "application/octet-stream",
+        }
+
+        if not ranges:
+            download.update(
+                stream=await self._open_version(bucket_name, version, chunks),
+                size=file_size,
+                status_code=status.HTTP_200_OK
+            )
+            return download
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            download.update(
+                stream=await self._open_version(bucket_name, version, chunks, byte_range=(start, end)),
+                size=end - start + 1,
+                status_code=status.HTTP_206_PARTIAL_CONTENT
+            )
+            return download
+
+        # Kilka zakresów - odpowiedź multipart/byteranges, zakresy pobierane z S3 po kolei
+        boundary = uuid4().hex
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: application/octet-stream\r\n"
+                f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+            ).encode()
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode()
+        content_length = sum(
+            len(part_header) + (end - start + 1) + 2
+            for part_header, (start, end) in zip(part_headers, ranges)
+        ) + len(closing)
+
+        async def iter_parts():
+            for part_header, byte_range in zip(part_headers, ranges):
+                yield part_header
+                parts = self._iter_version(bucket_name, version, chunks, byte_range=byte_range)
+                try:
+                    async for part in parts:
+                        yield part
+                finally:
+                    await parts.aclose()
+                yield b"\r\n"
+            yield closing
+
+        download.update(
+            stream=iter_parts(),
+            size=content_length,
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=f"multipart/byteranges; boundary={boundary}"
+        )
+        return download
+
+    async def download_file(
+            self,
+            file_id: str,
+            username: str,
+            ip_address: str = None,
+            range_header: str = None,
+            if_range: str = None
+    ) -> dict:
         try:
             file_uuid = _str_to_uuid(file_id)
 
@@ -390,13 +2246,11 @@ class FileService:
                 )
 
             bucket_name = f"user-{username}"
-            # Pobierz nazwę pliku z wersją z S3
-            versioned_filename = self._build_versioned_filename(file_record.name, current_version_number)
 
             try:
-                file_obj = BytesIO()
-                s3.download_fileobj(bucket_name, versioned_filename, file_obj)
-                file_obj.seek(0)
+                download = await self._build_download(
+                    bucket_name, file_record.name, current_version, range_header, if_range
+                )
 
                 await self.log_service.log_action(
                     action=LogAction.FILE_DOWNLOAD,
@@ -406,20 +2260,14 @@ class FileService:
                     details={
                         "version": current_version_number,
                         "size": current_version.size,
+                        "ranges": download["ranges"],
                         "ip_address": ip_address
                     }
                 )
 
-                # Zwróć generator chunków dla lepszego streamingu
-                def iter_file():
-                    chunk_size = 1024 * 1024  # 1 MB chunks
-                    while True:
-                        chunk = file_obj.read(chunk_size)
-                        if not chunk:
-                            break
-                        yield chunk
-
-                return iter_file(), file_record.name, current_version.size
+                return download
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -438,83 +2286,68 @@ class FileService:
             )
             raise
 
-    def _download_file_from_s3_sync(self, bucket_name: str, s3_filename: str) -> bytes:
-        """
-        Synchroniczna funkcja do pobierania pliku z S3 (do użycia w thread pool)
-        """
-        file_obj = BytesIO()
-        s3.download_fileobj(bucket_name, s3_filename, file_obj)
-        file_obj.seek(0)
-        return file_obj.read()
-
     async def get_many_files(self, file_ids: List[str], username: str, ip_address: str = None):
         try:
-            # Najpierw pobierz metadane wszystkich plików
-            files_to_download: List[Tuple[str, str, str]] = []  # (name, bucket, s3_filename)
-            size = 0.0
-            
-            for file_id in file_ids:
-                file_uuid = _str_to_uuid(file_id)
-                result = await self.db.execute(
-                    select(FileStorage).where(
-                        FileStorage.id == file_uuid,
-                        FileStorage.owner == username
+            # Unikalne id w kolejności z requestu - powtórzone id trafiają do ZIP tylko raz
+            file_uuids = list(dict.fromkeys(_str_to_uuid(file_id) for file_id in file_ids))
+
+            # Metadane wszystkich plików wraz z aktualną wersją jednym zapytaniem
+            # (id = ANY(...) z jedną tablicą jako parametrem)
+            result = await self.db.execute(
+                select(FileStorage, FileVersion).join(
+                    FileVersion,
+                    and_(
+                        FileVersion.file_id == FileStorage.id,
+                        FileVersion.version_number == FileStorage.current_version
                     )
+                ).where(
+                    FileStorage.id == any_(literal(file_uuids, ARRAY(PG_UUID(as_uuid=True)))),
+                    FileStorage.owner == username
                 )
-                file_record = result.scalar_one_or_none()
+            )
+            records_by_id = {}
+            current_versions = {}
+            for file_record, version in result.all():
+                records_by_id[file_record.id] = file_record
+                current_versions[file_record.id] = version
+
+            # Kawałki wersji zapisanych w kawałkach - również jednym zapytaniem
+            chunks_by_version = await self._load_chunks(
+                [version.id for version in current_versions.values() if version.is_chunked]
+            )
+
+            # Id, których nie ma w bazie lub należą do innego użytkownika
+            skipped_file_ids = [str(file_uuid) for file_uuid in file_uuids if file_uuid not in records_by_id]
+
+            members: List[ZipMember] = []
+            size = 0
+            bucket_name = f"user-{username}"
+
+            for file_uuid in file_uuids:
+                file_record = records_by_id.get(file_uuid)
                 if not file_record:
                     continue
-                    
-                size += file_record.size
-                bucket_name = f"user-{username}"
-                versioned_filename = self._build_versioned_filename(
-                    file_record.name, file_record.current_version
-                )
-                files_to_download.append((file_record.name, bucket_name, versioned_filename))
 
-            # Pobierz wszystkie pliki równolegle używając thread pool
-            loop = asyncio.get_event_loop()
-            
-            async def download_file_async(name: str, bucket: str, s3_filename: str) -> Tuple[str, bytes]:
-                """Pobiera plik z S3 asynchronicznie używając thread pool"""
-                try:
-                    content = await loop.run_in_executor(
-                        _s3_executor,  # Dedykowany executor z 10 wątkami
-                        self._download_file_from_s3_sync,
-                        bucket,
-                        s3_filename
-                    )
-                    return (name, content)
-                except Exception as e:
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Failed to download file '{name}' from S3: {str(e)}"
+                size += file_record.size
+                version = current_versions[file_uuid]
+                members.append(ZipMember(
+                    name=file_record.name,
+                    size=file_record.size,
+                    modified_at=file_record.updated_at,
+                    chunks=lambda version=version: self._iter_version(
+                        bucket_name, version, chunks_by_version.get(version.id)
                     )
+                ))
+
+            # Pliki w ZIP nie są kompresowane, więc rozmiar archiwum znany jest przed pobraniem z S3
+            zip_size = zip_stream_size(members)
+            if zip_size > ZIP_MAX_SIZE or len(members) > ZIP_MAX_ENTRIES:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Selected files are too large to be downloaded as a single ZIP archive."
+                )
 
-            # Pobierz wszystkie pliki równolegle
-            start_download = time.time()
-            download_tasks = [
-                download_file_async(name, bucket, s3_filename)
-                for name, bucket, s3_filename in files_to_download
-            ]
-            downloaded_files = await asyncio.gather(*download_tasks)
-            download_time = time.time() - start_download
-            print(f"[PERF] Download from S3: {download_time:.2f}s for {len(files_to_download)} files")
-
-            # Utwórz ZIP z pobranych plików (bez kompresji - szybciej)
-            start_zip = time.time()
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as zip_file:
-                for name, content in downloaded_files:
-                    zip_file.writestr(name, content)
-            zip_time = time.time() - start_zip
-            print(f"[PERF] ZIP creation: {zip_time:.2f}s")
-
-            zip_buffer.seek(0)
-            zip_size = zip_buffer.getbuffer().nbytes
             zip_filename = "files_bundle.zip"
-            
-            print(f"[PERF] Total time before response: {time.time() - start_download:.2f}s, ZIP size: {zip_size / (1024*1024):.2f} MB")
 
             await self.log_service.log_action(
                 action=LogAction.FILE_MANY_DOWNLOAD,
@@ -525,22 +2358,13 @@ class FileService:
                     "ip_address": ip_address,
                     "total_size_bytes": size,
                     "zip_size_bytes": zip_size,
-                    "files_count": len(file_ids),
-                    "download_time_s": download_time,
-                    "zip_time_s": zip_time
+                    "files_count": len(members),
+                    "skipped_file_ids": skipped_file_ids
                 }
             )
 
-            # Zwróć generator chunków dla lepszego streamingu
-            def iter_file():
-                chunk_size = 1024 * 1024  # 1 MB chunks
-                while True:
-                    chunk = zip_buffer.read(chunk_size)
-                    if not chunk:
-                        break
-                    yield chunk
-
-            return iter_file(), zip_filename, zip_size
+            # Obiekty pobierane z S3 na bieżąco w trakcie wysyłania archiwum
+            return stream_zip(members), zip_filename, zip_size, skipped_file_ids
         except Exception as e:
             await self.log_service.log_action(
                 action=LogAction.FILE_MANY_DOWNLOAD,
@@ -566,9 +2390,6 @@ class FileService:
             )
             file_record = result.scalar_one_or_none()
 
-            result = await self.db.execute(select(User).where(User.username == username))
-            user = result.scalar_one_or_none()
-
             if not file_record:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -582,20 +2403,29 @@ class FileService:
             versions = result.scalars().all()
 
             bucket_name = f"user-{username}"
-            total_size = 0
+            total_size = sum(version.size for version in versions)
+
+            # Bloby wersji i ich kawałków - zwalniane po usunięciu wersji
+            blob_ids = [version.blob_id for version in versions if version.blob_id is not None]
+            blob_ids += await self._chunk_blob_ids([version.id for version in versions if version.is_chunked])
 
-            # Usuń wszystkie wersje z S3
-            for version in versions:
-                versioned_filename = self._build_versioned_filename(file_record.name, version.version_number)
+            # Wersje sprzed deduplikacji i wysłane bezpośrednio do S3 mają własne obiekty - usuń je od razu
+            legacy_versions = [
+                version for version in versions if version.blob_id is None and not version.is_chunked
+            ]
+            for version in legacy_versions:
                 try:
-                    s3.delete_object(Bucket=bucket_name, Key=versioned_filename)
-                    total_size += version.size
+                    await object_store.delete_object(Bucket=bucket_name, Key=self._key_from_path(version.path))
                 except Exception as e:
                     # Kontynuuj nawet jeśli usuwanie jednego pliku się nie powiedzie
                     print(f"Warning: Failed to delete version {version.version_number} from S3: {str(e)}")
 
             try:
                 await self.db.delete(file_record)
+                await self.db.flush()
+                await self._apply_storage_delta(username, -sum(version.size for version in legacy_versions))
+                # Treść współdzielona przez bloby znika dopiero, gdy nie odwołuje się do niej żadna wersja
+                released_blob_ids = await self._release_blobs(username, blob_ids)
                 await self.db.commit()
             except Exception as e:
                 await self.db.rollback()
@@ -603,15 +2433,7 @@ class FileService:
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=f"Failed to delete file from database: {str(e)}"
                 )
-
-            try:
-                await self._recalculate_user_storage(username)
-            except Exception as e:
-                await self.db.rollback()
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to update user storage: {str(e)}"
-                )
+            await self._delete_released_blobs(bucket_name, released_blob_ids)
 
             await self.log_service.log_action(
                 action=LogAction.FILE_DELETE,
@@ -702,7 +2524,7 @@ class FileService:
         try:
             file_uuid = _str_to_uuid(file_id)
 
-            result = await self.db.execute(
+            result = await self.read_db.execute(
                 select(FileStorage).where(
                     FileStorage.id == file_uuid,
                     FileStorage.owner == username
@@ -717,7 +2539,7 @@ class FileService:
                 )
 
             # Pobierz wszystkie wersje
-            result = await self.db.execute(
+            result = await self.read_db.execute(
                 select(FileVersion).where(
                     FileVersion.file_id == file_record.id
                 ).order_by(FileVersion.version_number.desc())
@@ -740,7 +2562,15 @@ class FileService:
                 detail=f"Failed to fetch versions: {str(e)}"
             )
 
-    async def download_file_version(self, file_id: str, version_number: int, username: str, ip_address: str = None):
+    async def download_file_version(
+            self,
+            file_id: str,
+            version_number: int,
+            username: str,
+            ip_address: str = None,
+            range_header: str = None,
+            if_range: str = None
+    ) -> dict:
         """
         Pobiera konkretną wersję pliku
         """
@@ -777,12 +2607,11 @@ class FileService:
                 )
 
             bucket_name = f"user-{username}"
-            versioned_filename = self._build_versioned_filename(file_record.name, version_number)
 
             try:
-                file_obj = BytesIO()
-                s3.download_fileobj(bucket_name, versioned_filename, file_obj)
-                file_obj.seek(0)
+                download = await self._build_download(
+                    bucket_name, file_record.name, version, range_header, if_range
+                )
 
                 await self.log_service.log_action(
                     action=LogAction.FILE_DOWNLOAD,
@@ -792,19 +2621,14 @@ class FileService:
                     details={
                         "version": version_number,
                         "size": version.size,
+                        "ranges": download["ranges"],
                         "ip_address": ip_address
                     }
                 )
 
-                def iter_file():
-                    chunk_size = 1024 * 1024  # 1 MB chunks
-                    while True:
-                        chunk = file_obj.read(chunk_size)
-                        if not chunk:
-                            break
-                        yield chunk
-
-                return iter_file(), file_record.name, version.size
+                return download
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -954,19 +2778,31 @@ class FileService:
                 )
 
             bucket_name = f"user-{username}"
-            versioned_filename = self._build_versioned_filename(file_record.name, version_number)
 
-            # Usuń z S3
-            try:
-                s3.delete_object(Bucket=bucket_name, Key=versioned_filename)
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to delete file from S3: {str(e)}"
-                )
+            is_legacy = version.blob_id is None and not version.is_chunked
+            if version.is_chunked:
+                blob_ids = await self._chunk_blob_ids([version.id])
+            else:
+                blob_ids = [version.blob_id] if version.blob_id is not None else []
+
+            # Wersja sprzed deduplikacji lub wysłana bezpośrednio do S3 ma własny obiekt - usuń go od razu
+            if is_legacy:
+                try:
+                    await object_store.delete_object(Bucket=bucket_name, Key=self._key_from_path(version.path))
+                except Exception as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail=f"Failed to delete file from S3: {str(e)}"
+                    )
 
             try:
                 await self.db.delete(version)
+                await self.db.flush()
+                released_blob_ids = []
+                if is_legacy:
+                    await self._apply_storage_delta(username, -version.size)
+                else:
+                    released_blob_ids = await self._release_blobs(username, blob_ids)
                 await self.db.commit()
             except Exception as e:
                 await self.db.rollback()
@@ -974,15 +2810,7 @@ class FileService:
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=f"Failed to delete version from database: {str(e)}"
                 )
-
-            try:
-                await self._recalculate_user_storage(username)
-            except Exception as e:
-                await self.db.rollback()
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to delete version from database: {str(e)}"
-                )
+            await self._delete_released_blobs(bucket_name, released_blob_ids)
 
             await self.log_service.log_action(
                 action="FILE_DELETE_VERSION",
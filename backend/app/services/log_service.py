@@ -1,10 +1,23 @@
+import csv
+import io
 import json
 
 from datetime import datetime, timezone
-from uuid import uuid4
+from typing import AsyncIterator
+from uuid import UUID, uuid4
 from sqlalchemy import select
+from db.database import replica_session
 from models.models import LogEntry
+from services.audit_log_writer import audit_log_writer
 from sqlalchemy.ext.asyncio import AsyncSession
+from util import _str_to_uuid
+
+LOG_EXPORT_FORMATS = ("text", "jsonl", "csv")
+# Ile wierszy naraz pobierać z kursora po stronie serwera
+LOG_EXPORT_FETCH_SIZE = 1000
+# Sformatowane wiersze wysyłane są porcjami po około tyle znaków
+LOG_EXPORT_CHUNK_SIZE = 64 * 1024
+_CSV_COLUMNS = ("timestamp", "status", "action", "username", "file_id", "details")
 
 
 class LogAction:
@@ -15,6 +28,8 @@ class LogAction:
 
     # File actions
     FILE_UPLOAD = "FILE_UPLOAD"
+    FILE_UPLOAD_NEGOTIATE = "FILE_UPLOAD_NEGOTIATE"
+    FILE_UPLOAD_SESSION_CREATE = "FILE_UPLOAD_SESSION_CREATE"
     FILE_DOWNLOAD = "FILE_DOWNLOAD"
     FILE_MANY_DOWNLOAD = "FILE_MANY_DOWNLOAD"
     FILE_DELETE = "FILE_DELETE"
@@ -32,6 +47,50 @@ class LogAction:
     LOG_DOWNLOAD = "LOG_DOWNLOAD"
 
 
+def _format_text(row) -> str:
+    details = f" | Details: {row.details}" if row.details else ""
+    file_id = f" | File ID: {row.file_id}" if row.file_id else ""
+    return f"[{row.timestamp.isoformat()}] {row.status} | {row.action} | User: {row.username}{file_id}{details}\n"
+
+
+def _format_jsonl(row) -> str:
+    details = row.details
+    if details:
+        try:
+            details = json.loads(details)
+        except ValueError:
+            pass
+    return json.dumps({
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "status": row.status,
+        "action": row.action,
+        "username": row.username,
+        "file_id": str(row.file_id) if row.file_id else None,
+        "details": details,
+    }) + "\n"
+
+
+class _CsvFormatter:
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def format(self, values) -> str:
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerow(values)
+        return self.buffer.getvalue()
+
+    def header(self) -> str:
+        return self.format(_CSV_COLUMNS)
+
+    def __call__(self, row) -> str:
+        return self.format((
+            row.timestamp.isoformat() if row.timestamp else "",
+            row.status, row.action, row.username, row.file_id or "", row.details or ""
+        ))
+
+
 class LogService:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -44,54 +103,119 @@ class LogService:
             details: dict = None,
             status: str = "SUCCESS"
     ):
+        """
+        Dodaje wpis do kolejki zapisu logów audytowych - trafia do bazy w tle
+        (w paczce, w ciągu AUDIT_LOG_FLUSH_INTERVAL_S sekund)
+        """
         if details is None:
             details = {}
 
-        log_entry = LogEntry(
-            id=uuid4(),
-            action=action,
-            username=username,
-            file_id=file_id,
-            timestamp=datetime.now(timezone.utc),
-            details=json.dumps(details) if details else None,
-            status=status,
-        )
+        # Kolumna file_id to UUID - cokolwiek innego (np. kilka id) trafia do details
+        if file_id is not None and not isinstance(file_id, UUID):
+            try:
+                file_id = UUID(str(file_id))
+            except ValueError:
+                details = {**details, "file_id": str(file_id)}
+                file_id = None
 
-        try:
-            self.db.add(log_entry)
-            await self.db.commit()
-            await self.db.refresh(log_entry)
-        except Exception:
-            await self.db.rollback()
-            pass
+        await audit_log_writer.put({
+            "id": uuid4(),
+            "action": action,
+            "username": username,
+            "file_id": file_id,
+            "timestamp": datetime.now(timezone.utc),
+            "details": json.dumps(details) if details else None,
+            "status": status,
+        })
 
     async def get_logs(
             self,
             limit: int,
             username: str,
-            ip_address: str = None
-    ):
-        query = await self.db.execute(
-            select(LogEntry).order_by(LogEntry.timestamp.desc()).limit(
-                limit)
-        )
-        logs = query.scalars().all()
+            ip_address: str = None,
+            export_format: str = "text",
+            start: datetime = None,
+            end: datetime = None,
+            filter_username: str = None,
+            action: str = None,
+            status: str = None,
+            file_id: str = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Zwraca eksport najwyżej `limit` najnowszych wpisów pasujących do filtrów (`start`
+        włącznie, `end` wyłącznie) jako asynchroniczny iterator po zakodowanych porcjach.
+        Wiersze czytane są kursorem po stronie serwera w trakcie wysyłania odpowiedzi, więc
+        zużycie pamięci nie zależy od `limit`. Formaty: "text", "jsonl" (JSON Lines), "csv".
+        """
+        # Czas bez strefy traktowany jest jako UTC
+        if start is not None and start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if end is not None and end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
 
-        # Format logs as text content
-        log_content = []
-        for log in logs:
-            details = f" | Details: {log.details}" if log.details else ""
-            file_id = f" | File ID: {log.file_id}" if log.file_id else ""
-            log_line = f"[{log.timestamp.isoformat()}] {log.status} | {log.action} | User: {log.username}{file_id}{details}"
-            log_content.append(log_line)
+        query = select(
+            LogEntry.timestamp, LogEntry.status, LogEntry.action,
+            LogEntry.username, LogEntry.file_id, LogEntry.details
+        )
+        if start is not None:
+            query = query.where(LogEntry.timestamp >= start)
+        if end is not None:
+            query = query.where(LogEntry.timestamp < end)
+        if filter_username:
+            query = query.where(LogEntry.username == filter_username)
+        if action:
+            query = query.where(LogEntry.action == action)
+        if status:
+            query = query.where(LogEntry.status == status)
+        if file_id:
+            query = query.where(LogEntry.file_id == _str_to_uuid(file_id))
+        query = query.order_by(LogEntry.timestamp.desc()).limit(limit)
 
         await self.log_action(
             action=LogAction.LOG_DOWNLOAD,
             username=username,
             status="SUCCESS",
             details={
-                "ip_address": ip_address
+                "ip_address": ip_address,
+                "format": export_format,
+                "limit": limit,
+                "filters": {
+                    "start": start.isoformat() if start else None,
+                    "end": end.isoformat() if end else None,
+                    "username": filter_username,
+                    "action": action,
+                    "status": status,
+                    "file_id": file_id
+                }
             }
         )
 
-        return "\n".join(log_content)
+        return self._stream_export(query, export_format, username)
+
+    async def _stream_export(self, query, export_format: str, username: str) -> AsyncIterator[bytes]:
+        if export_format == "csv":
+            csv_formatter = _CsvFormatter()
+            format_row = csv_formatter
+            chunk = [csv_formatter.header()]
+        else:
+            format_row = _format_jsonl if export_format == "jsonl" else _format_text
+            chunk = []
+        chunk_size = sum(len(line) for line in chunk)
+
+        # Własna sesja - sesja żądania jest zamykana, zanim odpowiedź zacznie być wysyłana
+        async with replica_session(username) as session:
+            result = await session.stream(query.execution_options(yield_per=LOG_EXPORT_FETCH_SIZE))
+            try:
+                async for row in result:
+                    line = format_row(row)
+                    chunk.append(line)
+                    chunk_size += len(line)
+                    if chunk_size >= LOG_EXPORT_CHUNK_SIZE:
+                        yield "".join(chunk).encode("utf-8")
+                        chunk = []
+                        chunk_size = 0
+            finally:
+                await result.close()
+
+        if chunk:
+            yield "".join(chunk).encode("utf-8")
@@ -5,6 +5,7 @@ import pyotp
 import qrcode
 from core.security import create_access_token, create_refresh_token
 from core.security import now_utc
+from core.user_cache import user_cache
 from fastapi import HTTPException, status
 from models.models import User, RefreshToken
 from schemas.user import Token
@@ -46,6 +47,7 @@ class TOTPService:
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to save TOTP secret: {str(e)}"
             )
+        user_cache.invalidate(username)
 
         # Generate provisioning URI
         totp = pyotp.TOTP(secret)
@@ -99,6 +101,7 @@ class TOTPService:
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=f"Failed to update TOTP status: {str(e)}"
                 )
+            user_cache.invalidate(username)
 
         return True
 
@@ -1,14 +1,14 @@
 import logging
 
+from core.password_pool import password_pool, PasswordHashPoolBusy
 from core.security import (
-    hash_password,
-    verify_password,
     create_access_token,
     create_refresh_token,
     decode_refresh_token,
     now_utc,
     create_totp_setup_token
 )
+from core.user_cache import user_cache
 from fastapi import HTTPException, status
 from models.models import User, RefreshToken
 from schemas.totp import TOTPSetupToken
@@ -28,13 +28,26 @@ class UserService:
         self.db = db
         self.log_service = LogService(db)
 
+    async def _run_password_operation(self, operation, *args):
+        """
+        Wykonuje hashowanie/weryfikację hasła w puli wątków (poza pętlą zdarzeń)
+        """
+        try:
+            return await operation(*args)
+        except PasswordHashPoolBusy:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+
     async def _get_and_verify_user(self, username: str, password: str) -> User:
         """
         Pobiera użytkownika i weryfikuje hasło
         """
         result = await self.db.execute(select(User).where(User.username == username))
         user = result.scalar_one_or_none()
-        if not user or not verify_password(password, user.hashed_password):
+        if not user or not await self._run_password_operation(password_pool.verify, password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid username or password",
@@ -54,9 +67,11 @@ class UserService:
                     detail="Username already exists",
                 )
 
+            hashed_password = await self._run_password_operation(password_pool.hash, user_data.password)
+
             new_user = User(
                 username=user_data.username,
-                hashed_password=hash_password(user_data.password),
+                hashed_password=hashed_password,
                 user_type="regular",
                 totp_secret=None,
                 totp_configured=False
@@ -228,6 +243,7 @@ class UserService:
                 await self.db.delete(token)
 
             await self.db.commit()
+            user_cache.invalidate(username)
 
             await self.log_service.log_action(
                 action="LOGOUT",
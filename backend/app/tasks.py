@@ -0,0 +1,80 @@
+"""
+Okresowe zadania w tle, uruchamiane i zatrzymywane w `main.lifespan`.
+"""
+import asyncio
+from typing import Awaitable, Callable, List
+
+from core.config import settings
+from db.database import AsyncSessionLocal, engine
+from db.log_partitions import drop_log_partitions, maintain_log_partitions
+from services.file_service import FileService
+
+
+async def _run_periodically(
+        name: str,
+        interval_s: int,
+        job: Callable[[], Awaitable[None]],
+        run_at_start: bool = False
+):
+    if not run_at_start:
+        await asyncio.sleep(interval_s)
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            # Nieudane uruchomienie nie może zatrzymać kolejnych
+            print(f"Warning: Background job '{name}' failed: {str(e)}")
+        await asyncio.sleep(interval_s)
+
+
+async def reconcile_storage():
+    async with AsyncSessionLocal() as db:
+        corrected = await FileService(db).reconcile_storage()
+    if corrected:
+        print(f"Storage reconciliation corrected used_storage_mb for {corrected} user(s)")
+
+
+async def cleanup_upload_sessions():
+    async with AsyncSessionLocal() as db:
+        removed = await FileService(db).cleanup_expired_upload_sessions()
+    if removed:
+        print(f"Removed {removed} expired upload session(s)")
+
+
+async def maintain_logs():
+    async with engine.begin() as conn:
+        result = await maintain_log_partitions(conn)
+    dropped = []
+    if result.get("expired"):
+        # DETACH PARTITION CONCURRENTLY nie działa w transakcji - osobne połączenie w AUTOCOMMIT
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            dropped = await drop_log_partitions(conn, result["expired"])
+    if result.get("created") or dropped:
+        print(f"Log partitions created: {result['created']}, dropped: {dropped}")
+
+
+def start_background_tasks() -> List[asyncio.Task]:
+    tasks = []
+    if settings.LOG_MAINTENANCE_INTERVAL_S > 0:
+        # Od razu przy starcie, żeby po dłuższej przerwie istniała partycja bieżącego miesiąca
+        tasks.append(asyncio.create_task(
+            _run_periodically("log maintenance", settings.LOG_MAINTENANCE_INTERVAL_S, maintain_logs, run_at_start=True)
+        ))
+    if settings.STORAGE_RECONCILE_INTERVAL_S > 0:
+        tasks.append(asyncio.create_task(
+            _run_periodically("storage reconciliation", settings.STORAGE_RECONCILE_INTERVAL_S, reconcile_storage)
+        ))
+    if settings.UPLOAD_SESSION_CLEANUP_INTERVAL_S > 0:
+        tasks.append(asyncio.create_task(
+            _run_periodically(
+                "upload session cleanup", settings.UPLOAD_SESSION_CLEANUP_INTERVAL_S, cleanup_upload_sessions
+            )
+        ))
+    return tasks
+
+
+async def stop_background_tasks(tasks: List[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,7 +1,13 @@
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
 from uuid import UUID
 
 from fastapi import HTTPException, status
 
+# Powyżej tylu zakresów nagłówek Range jest ignorowany i wysyłany jest cały plik
+MAX_BYTE_RANGES = 10
+
 
 def _str_to_uuid(id_str: str) -> UUID:
     try:
@@ -11,3 +17,94 @@ def _str_to_uuid(id_str: str) -> UUID:
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid UUID format"
         )
+
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parsuje nagłówek `Range: bytes=...` do posortowanych, scalonych zakresów (start, end) włącznie.
+
+    Zwraca None, gdy zamiast tego trzeba wysłać cały plik (brak nagłówka, inna jednostka,
+    błędna składnia lub za dużo zakresów - RFC 9110 pozwala taki nagłówek zignorować).
+    Rzuca 416, gdy żaden z zakresów nie nachodzi na plik.
+    """
+    if not range_header or file_size <= 0:
+        return None
+
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set.strip():
+        return None
+
+    ranges = []
+    for spec in range_set.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+
+        start_str, dash, end_str = spec.partition("-")
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not dash or (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+            return None
+
+        if not start_str:
+            # Zakres sufiksowy: ostatnie N bajtów pliku
+            if not end_str:
+                return None
+            suffix_length = int(end_str)
+            if suffix_length == 0:
+                continue
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            if end_str and int(end_str) < start:
+                return None
+            if start >= file_size:
+                continue
+            end = min(int(end_str), file_size - 1) if end_str else file_size - 1
+
+        ranges.append((start, end))
+
+    if not ranges:
+        raise HTTPException(
+            status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+
+    if len(ranges) > MAX_BYTE_RANGES:
+        return None
+
+    # Scalenie nachodzących na siebie i sąsiednich zakresów
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def if_range_matches(if_range: Optional[str], etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Sprawdza nagłówek `If-Range` względem ETag i Last-Modified pliku.
+    Zwraca True, gdy nagłówek Range należy uwzględnić.
+    """
+    if not if_range:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Silne porównanie - słabe ETagi nigdy nie pasują
+        return if_range == etag
+
+    if last_modified is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+
+    return int(since.timestamp()) == int(last_modified.timestamp())
@@ -0,0 +1,120 @@
+"""
+Sprawdza, czy najczęstsze zapytania FileService i LogService korzystają z indeksów.
+
+Dla każdego kształtu zapytania uruchamiany jest EXPLAIN (ze zniechęconym skanem sekwencyjnym,
+żeby planer wybrał indeks nawet na prawie pustej bazie). Testy wymagają bazy z DB_URL
+po `alembic upgrade head` - bez niej są pomijane:
+
+    cd backend && pytest
+"""
+import asyncio
+import re
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core.config import settings
+from db.database import engine
+from init_db import check_db_revision
+
+# (opis, oczekiwany indeks, zapytanie) - tabela logs jest partycjonowana, więc jej zapytania
+# używają kopii indeksów w poszczególnych partycjach (logs_YYYY_MM_..._idx)
+QUERY_PLANS = [
+    (
+        "list_files: newest first",
+        "ix_files_owner_updated_at_id",
+        "SELECT * FROM files WHERE owner = 'check' "
+        "ORDER BY updated_at DESC, id DESC LIMIT 100",
+    ),
+    (
+        "list_files: next page",
+        "ix_files_owner_updated_at_id",
+        "SELECT * FROM files WHERE owner = 'check' "
+        "AND (updated_at, id) < (now(), '00000000-0000-0000-0000-000000000000'::uuid) "
+        "ORDER BY updated_at DESC, id DESC LIMIT 100",
+    ),
+    (
+        "list_files: favorites",
+        "ix_files_owner_favorite_updated_at_id",
+        "SELECT * FROM files WHERE owner = 'check' AND is_favorite IS true "
+        "ORDER BY updated_at DESC, id DESC LIMIT 100",
+    ),
+    (
+        # Tylko filtr - czy indeks varchar_pattern_ops dostarczy też sortowanie po name,
+        # zależy od collation bazy, więc sortowanie nie jest tu sprawdzane
+        "list_files: name prefix",
+        "ix_files_owner_name_pattern",
+        "SELECT * FROM files WHERE owner = 'check' AND name LIKE 'report%'",
+    ),
+    (
+        "download_file_version: version lookup",
+        "uq_file_versions_file_id_version_number",
+        "SELECT * FROM file_versions "
+        "WHERE file_id = '00000000-0000-0000-0000-000000000000'::uuid AND version_number = 1",
+    ),
+    (
+        "get_file_versions: all versions of a file",
+        "uq_file_versions_file_id_version_number",
+        "SELECT * FROM file_versions "
+        "WHERE file_id = '00000000-0000-0000-0000-000000000000'::uuid ORDER BY version_number DESC",
+    ),
+    (
+        "get_logs: newest entries",
+        r"logs_\d{4}_\d{2}_timestamp_idx",
+        "SELECT * FROM logs ORDER BY timestamp DESC LIMIT 100",
+    ),
+    (
+        "get_logs: entries of a user",
+        r"logs_\d{4}_\d{2}_username_timestamp_idx",
+        "SELECT * FROM logs WHERE username = 'check' ORDER BY timestamp DESC LIMIT 100",
+    ),
+    (
+        "get_logs: entries of an action",
+        r"logs_\d{4}_\d{2}_action_timestamp_idx",
+        "SELECT * FROM logs WHERE action = 'FILE_UPLOAD' ORDER BY timestamp DESC LIMIT 100",
+    ),
+]
+
+
+async def _explain(query: str) -> str:
+    engine = create_async_engine(settings.DB_URL)
+    try:
+        async with engine.connect() as conn:
+            async with conn.begin() as transaction:
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+                result = await conn.execute(text(f"EXPLAIN {query}"))
+                plan = "\n".join(row[0] for row in result)
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+    return plan
+
+
+async def _check_db_revision():
+    try:
+        await asyncio.wait_for(check_db_revision(), timeout=10)
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def migrated_database():
+    try:
+        asyncio.run(_check_db_revision())
+    except RuntimeError as e:
+        pytest.skip(f"Database schema is not up to date: {e}")
+    except Exception as e:
+        pytest.skip(f"Database is not available: {e}")
+
+
+@pytest.mark.parametrize(
+    "expected_index,query",
+    [(expected_index, query) for _, expected_index, query in QUERY_PLANS],
+    ids=[description for description, _, _ in QUERY_PLANS],
+)
+def test_query_uses_index(expected_index: str, query: str):
+    plan = asyncio.run(_explain(query))
+
+    assert "Seq Scan" not in plan, plan
+    assert re.search(expected_index, plan), f"expected {expected_index}:\n{plan}"